@@ -1,54 +1,55 @@
 # seguridad_taller.py (integrated with security_core telemetry)
 import os
+import io
+import re
+import csv
 import json
+import uuid
 import threading
 from datetime import datetime
 import secrets
 import string
+from bisect import bisect_left
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 
-from cryptography.fernet import Fernet
-import pandas as pd
+from cryptography.fernet import InvalidToken
 
 from security_core import audit, module_opened, module_closed, button_clicked, view_attempt, copy_to_clipboard_then_clear
+from visor_auditoria import VisorAuditoria
+from vault_core import RecordVault
+from gestor_llaves import store_fernet, session_fernet, rotate_master, run_with_busy, STORE_CREDENCIALES
+from exportacion_pagos import FernetChunkWriter, decrypt_export, ENCRYPTED_SUFFIX
+from contrasenas_filtradas import esta_filtrada, filtro
 
 BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
-KEY_FILE = os.path.join(BASE_DIR, "security.key")
-CREDS_FILE = os.path.join(BASE_DIR, "creds.json.enc")
-AUDIT_LOG = os.path.join(BASE_DIR, "security_audit.log")
+CREDS_FILE = os.path.join(BASE_DIR, "creds.json.enc")  # formato anterior (migrado a la bóveda)
+CREDS_VAULT_FILE = os.path.join(BASE_DIR, "creds.vault")
+STRENGTH_DELAY_MS = 200  # evaluación en vivo: espera a que pare la ráfaga de teclas
 
 # -----------------------
-# Utilities: key / crypto (legacy key support)
+# Utilities: key / crypto
 # -----------------------
+# La clave de datos de las credenciales la administra gestor_llaves (almacén
+# "credenciales", envuelta con la contraseña maestra); la antigua security.key se
+# adopta como esa clave la primera vez que se desbloquea.
 def ensure_base_dir():
     if not os.path.exists(BASE_DIR):
         os.makedirs(BASE_DIR, exist_ok=True)
 
-def generate_key():
-    ensure_base_dir()
-    key = Fernet.generate_key()
-    with open(KEY_FILE, "wb") as f:
-        f.write(key)
-    return key
-
-def load_key():
-    ensure_base_dir()
-    if not os.path.exists(KEY_FILE):
-        return generate_key()
-    with open(KEY_FILE, "rb") as f:
-        return f.read()
+def get_fernet():
+    """Fernet de la sesión de la maestra (la UI desbloquea antes con store_fernet)."""
+    f = session_fernet(STORE_CREDENCIALES)
+    if f is None:
+        raise RuntimeError("Bóveda de credenciales bloqueada: ingrese la contraseña maestra.")
+    return f
 
 def encrypt_bytes(data_bytes):
-    key = load_key()
-    f = Fernet(key)
-    return f.encrypt(data_bytes)
+    return get_fernet().encrypt(data_bytes)
 
 def decrypt_bytes(enc_bytes):
-    key = load_key()
-    f = Fernet(key)
-    return f.decrypt(enc_bytes)
+    return get_fernet().decrypt(enc_bytes)
 
 # -----------------------
 # Password helpers
@@ -59,7 +60,12 @@ def generate_password(length=16, symbols=True):
         alphabet += "!@#$%^&*()-_=+[]{};:,.<>?"
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
-def password_strength(pw: str):
+def password_strength(pw: str, context=()):
+    """
+    (score 0-4, etiqueta, notas). Además de longitud y clases de caracteres revisa
+    que no contenga el servicio/usuario (context) y que no esté en la lista local de
+    contraseñas filtradas o comunes (contrasenas_filtradas, offline).
+    """
     score = 0
     notes = []
     if len(pw) >= 12:
@@ -84,32 +90,150 @@ def password_strength(pw: str):
     else:
         notes.append("Agregar símbolos especiales.")
 
+    score = min(score, 4)
+    lower = pw.lower()
+    if any(len(w.strip()) >= 3 and w.strip().lower() in lower for w in context if w):
+        score -= 1
+        notes.append("No incluir el servicio ni el usuario.")
+
+    if esta_filtrada(pw):
+        score = 0
+        notes.insert(0, "Aparece en la lista de contraseñas filtradas o comunes.")
+
+    score = max(0, score)
     strength = {0: "Muy débil", 1: "Débil", 2: "Moderada", 3: "Fuerte", 4: "Muy fuerte"}.get(score, "Débil")
     return score, strength, notes
 
 # -----------------------
 # Credential store (encrypted)
 # -----------------------
+# Bóveda por registro: cada credencial lleva su contraseña cifrada aparte y el
+# índice guarda en claro solo servicio/usuario/fecha, para listar sin desencriptar.
+_cred_vault = None
+
+def cred_vault():
+    global _cred_vault
+    if _cred_vault is None:
+        ensure_base_dir()
+        _cred_vault = RecordVault(CREDS_VAULT_FILE)
+    return _cred_vault
+
+def _cred_meta(c):
+    return {"service": c.get("service", ""), "user": c.get("user", ""), "created_at": c.get("created_at")}
+
+def _encrypt_secret(password):
+    return encrypt_bytes(json.dumps({"password": password}).encode("utf-8")).decode("utf-8")
+
+def creds_migration_pending():
+    return os.path.exists(CREDS_FILE)
+
+def _migrate_creds_file():
+    # creds.json.enc (todo el arreglo en un solo blob) -> un registro por credencial.
+    # Necesita la clave desbloqueada; mientras tanto se lista lo que ya está en la bóveda.
+    if not creds_migration_pending() or session_fernet(STORE_CREDENCIALES) is None:
+        return
+    with open(CREDS_FILE, "rb") as f:
+        arr = json.loads(decrypt_bytes(f.read()).decode("utf-8"))
+    cred_vault().put_many([(uuid.uuid4().hex, _cred_meta(c), _encrypt_secret(c.get("password", ""))) for c in arr])
+    bak = CREDS_FILE + ".migrated-" + datetime.now().strftime("%Y%m%d%H%M%S")
+    os.replace(CREDS_FILE, bak)
+    audit("creds_vault_migrated", f"records={len(arr)} backup={os.path.basename(bak)}")
+
 def load_creds():
+    """Metadatos de las credenciales (sin desencriptar nada)."""
     ensure_base_dir()
-    if not os.path.exists(CREDS_FILE):
-        return []
     try:
-        with open(CREDS_FILE, "rb") as f:
-            enc = f.read()
-        data = decrypt_bytes(enc)
-        arr = json.loads(data.decode("utf-8"))
-        return arr
+        _migrate_creds_file()
+        vault = cred_vault()
+        vault.refresh()
+        return [dict(meta, id=key) for key, meta in vault.items()]
     except Exception as e:
         audit("load_creds_failed", str(e))
         return []
 
-def save_creds(arr):
-    ensure_base_dir()
-    data = json.dumps(arr, ensure_ascii=False, indent=2).encode("utf-8")
-    enc = encrypt_bytes(data)
-    with open(CREDS_FILE, "wb") as f:
-        f.write(enc)
+def get_cred(key):
+    """Credencial completa: desencripta solo ese registro (None si ya no existe)."""
+    vault = cred_vault()
+    blob = vault.get_blob(key)
+    if blob is None:
+        return None
+    secret = json.loads(decrypt_bytes(blob.encode("utf-8")).decode("utf-8"))
+    return dict(vault.meta(key), id=key, password=secret.get("password", ""))
+
+def add_cred(service, user, password):
+    key = uuid.uuid4().hex
+    meta = _cred_meta({"service": service, "user": user, "created_at": datetime.now().isoformat()})
+    cred_vault().put(key, meta, _encrypt_secret(password))
+    return key
+
+def update_cred(key, service, user, password):
+    """Reescribe la credencial con el mismo id (False si otro proceso la eliminó)."""
+    vault = cred_vault()
+    vault.refresh()
+    old = vault.meta(key)
+    if old is None:
+        return False
+    meta = dict(_cred_meta(dict(old, service=service, user=user)), updated_at=datetime.now().isoformat())
+    vault.put(key, meta, _encrypt_secret(password))
+    return True
+
+def delete_cred(key):
+    return cred_vault().delete(key)
+
+EXPORT_COLUMNS = ["service", "user", "created_at", "updated_at"]
+
+def export_creds(creds, path, with_passwords=False, fernet=None):
+    """
+    CSV por flujo con csv.writer (sin DataFrame): con with_passwords desencripta
+    cada registro al escribirlo; con fernet la salida va cifrada en bloques
+    (FernetChunkWriter) y el contenido en claro nunca toca el disco. Devuelve las filas.
+    """
+    columns = EXPORT_COLUMNS + (["password"] if with_passwords else [])
+    raw = FernetChunkWriter(path, fernet) if fernet is not None else open(path, "wb")
+    n = 0
+    try:
+        text = io.TextIOWrapper(io.BufferedWriter(raw) if fernet is not None else raw,
+                                encoding="utf-8-sig", newline="")
+        writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for c in creds:
+            if with_passwords:
+                c = get_cred(c["id"])
+                if c is None:
+                    continue          # eliminada por otro proceso mientras se exportaba
+            writer.writerow(c)
+            n += 1
+        text.close()
+    finally:
+        if not raw.closed:
+            raw.close()
+    return n
+
+_WORD_SPLIT = re.compile(r"[\s@._\-/:]+")
+
+class CredIndex:
+    """
+    Índice de prefijos sobre servicio/usuario (el valor completo y cada palabra):
+    lista ordenada de (término, id) y bisect, sin recorrer las credenciales.
+    """
+    def __init__(self, creds):
+        terms = set()
+        for c in creds:
+            for field in ("service", "user"):
+                value = (c.get(field) or "").lower()
+                if value:
+                    terms.add((value, c["id"]))
+                    terms.update((w, c["id"]) for w in _WORD_SPLIT.split(value) if w)
+        self._terms = sorted(terms)
+
+    def search(self, prefix):
+        prefix = prefix.strip().lower()
+        found = set()
+        i = bisect_left(self._terms, (prefix,))
+        while i < len(self._terms) and self._terms[i][0].startswith(prefix):
+            found.add(self._terms[i][1])
+            i += 1
+        return found
 
 # -----------------------
 # GUI: Seguridad (uses security_core for telemetry)
@@ -124,9 +248,16 @@ class SeguridadTaller:
 
         module_opened("Seguridad", "window_created")
 
+        self._creds = []
+        self._cred_index = CredIndex([])
+        self._editing_id = None
+        self._strength_job = None
+
         self._setup_styles()
         self._build_ui()
         self._load_list()
+        # El filtro de contraseñas filtradas se abre (mmap) fuera del hilo de Tk
+        threading.Thread(target=filtro, name="filtro-contrasenas", daemon=True).start()
 
         # register close
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
@@ -158,6 +289,7 @@ class SeguridadTaller:
         tk.Label(frame, text="Contraseña:", bg="#0f172a", fg="#e2e8f0").grid(row=3, column=0, sticky="e", padx=6, pady=6)
         self.pw_var = tk.StringVar()
         self.pw_entry = ttk.Entry(frame, textvariable=self.pw_var, width=30, show="*")
+        self.pw_var.trace_add("write", self._schedule_strength)
         self.pw_entry.grid(row=3, column=1, sticky="w")
 
         # Password tools
@@ -179,6 +311,10 @@ class SeguridadTaller:
 
         # Right: listado de credenciales
         tk.Label(frame, text="Credenciales guardadas:", bg="#0f172a", fg="#e2e8f0").grid(row=1, column=2, sticky="w", padx=12)
+        tk.Label(frame, text="Buscar:", bg="#0f172a", fg="#e2e8f0").grid(row=1, column=3, sticky="e")
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self._fill_tree())
+        ttk.Entry(frame, textvariable=self.search_var, width=22).grid(row=1, column=4, sticky="w")
         self.tree = ttk.Treeview(frame, columns=("service","user"), show="headings", height=12)
         self.tree.heading("service", text="Servicio")
         self.tree.heading("user", text="Usuario")
@@ -197,6 +333,8 @@ class SeguridadTaller:
         # Export / audit
         ttk.Button(frame, text="📤 Exportar (CSV)", style="Menu.TButton", command=self._on_export_csv).grid(row=9, column=2, pady=6, sticky="w")
         ttk.Button(frame, text="📘 Ver audit log", style="Menu.TButton", command=self._on_open_audit).grid(row=9, column=3, pady=6, sticky="w")
+        ttk.Button(frame, text="🔑 Cambiar maestra", style="Menu.TButton", command=self._on_rotate_master).grid(row=9, column=4, pady=6, sticky="w")
+        ttk.Button(frame, text="🔓 Descifrar exportación", style="Menu.TButton", command=self._on_decrypt_export).grid(row=10, column=2, pady=6, sticky="w")
 
         # configure resizing behaviour
         frame.grid_columnconfigure(2, weight=1)
@@ -205,11 +343,24 @@ class SeguridadTaller:
     # -----------------------
     # UI callbacks
     # -----------------------
+    def _unlock(self, purpose):
+        return store_fernet(self.root, STORE_CREDENCIALES, purpose) is not None
+
     def _load_list(self):
+        if creds_migration_pending() and session_fernet(STORE_CREDENCIALES) is None:
+            self._unlock("migrar las credenciales guardadas")
+        self._creds = load_creds()
+        self._cred_index = CredIndex(self._creds)
+        self._fill_tree()
+
+    def _fill_tree(self):
+        # iid = id persistente de la credencial (no la posición en la lista)
         self.tree.delete(*self.tree.get_children())
-        creds = load_creds()
-        for i, c in enumerate(creds):
-            self.tree.insert("", "end", iid=str(i), values=(c.get("service",""), c.get("user","")))
+        query = self.search_var.get().strip()
+        found = self._cred_index.search(query) if query else None
+        for c in self._creds:
+            if found is None or c["id"] in found:
+                self.tree.insert("", "end", iid=c["id"], values=(c.get("service",""), c.get("user","")))
 
     def _on_generate_pw(self):
         pw = generate_password(16, symbols=True)
@@ -218,15 +369,30 @@ class SeguridadTaller:
             self.pw_entry.configure(show="")
         else:
             self.pw_entry.configure(show="*")
-        self._on_check_strength()
+        self._show_strength()
         audit("generate_password", f"len={len(pw)}")
         button_clicked("Seguridad", "Generar contraseña", f"len={len(pw)}")
     
-    def _on_check_strength(self):
+    def _schedule_strength(self, *args):
+        # Evaluación en vivo mientras se escribe (sin audit por pulsación)
+        if self._strength_job is not None:
+            self.root.after_cancel(self._strength_job)
+        self._strength_job = self.root.after(STRENGTH_DELAY_MS, self._show_strength)
+
+    def _show_strength(self):
+        self._strength_job = None
         pw = self.pw_var.get() or ""
-        score, label, notes = password_strength(pw)
+        editing = f"Editando: {self.service_var.get()} | {self.user_var.get()}. " if self._editing_id else ""
+        if not pw:
+            self.strength_lbl.config(text=editing)
+            return None
+        score, label, notes = password_strength(pw, (self.service_var.get(), self.user_var.get()))
         note_text = " — ".join(notes) if notes else ""
-        self.strength_lbl.config(text=f"Fuerza: {label}. {note_text}")
+        self.strength_lbl.config(text=f"{editing}Fuerza: {label}. {note_text}")
+        return score
+
+    def _on_check_strength(self):
+        score = self._show_strength() or 0
         audit("check_password_strength", f"score={score}")
         button_clicked("Seguridad", "Mostrar fuerza", f"score={score}")
 
@@ -257,12 +423,29 @@ class SeguridadTaller:
         if not service or not user or not pw:
             messagebox.showwarning("Validación", "Completa Servicio, Usuario y Contraseña.")
             return
-        creds = load_creds()
-        creds.append({"service": service, "user": user, "password": pw, "created_at": datetime.now().isoformat()})
-        save_creds(creds)
-        audit("save_credential", f"{service}|{user}")
-        button_clicked("Seguridad", "Guardar credencial", f"{service}|{user}")
-        messagebox.showinfo("Guardado", "Credencial guardada (archivo cifrado).")
+        leaked = esta_filtrada(pw)
+        if leaked and not messagebox.askyesno("Contraseña filtrada", "Esta contraseña aparece en la lista de contraseñas filtradas o comunes.\n¿Guardarla de todos modos?"):
+            button_clicked("Seguridad", "Guardar credencial (cancel: filtrada)", f"{service}|{user}")
+            return
+        if not self._unlock("guardar la credencial"):
+            return
+        if self._editing_id:
+            if not update_cred(self._editing_id, service, user, pw):
+                # Otro proceso la eliminó: no se crea una nueva sin que el usuario lo pida
+                audit("update_credential_missing", f"{service}|{user}", id=self._editing_id)
+                self._editing_id = None
+                self._load_list()
+                messagebox.showwarning("Atención", "La credencial que editabas ya no existe (fue eliminada desde otra ventana).\n"
+                                                   "Pulsa Guardar de nuevo para crearla como nueva.")
+                return
+            audit("update_credential", f"{service}|{user}", id=self._editing_id, filtrada=leaked)
+            button_clicked("Seguridad", "Guardar credencial", f"{service}|{user}")
+            messagebox.showinfo("Guardado", "Credencial actualizada (archivo cifrado).")
+        else:
+            key = add_cred(service, user, pw)
+            audit("save_credential", f"{service}|{user}", id=key, filtrada=leaked)
+            button_clicked("Seguridad", "Guardar credencial", f"{service}|{user}")
+            messagebox.showinfo("Guardado", "Credencial guardada (archivo cifrado).")
         self._load_list()
         self._on_clear_form()
 
@@ -271,33 +454,44 @@ class SeguridadTaller:
         self.user_var.set("")
         self.pw_var.set("")
         self.strength_lbl.config(text="")
+        self._editing_id = None
 
-    def _get_selected_index(self):
+    def _get_selected_id(self):
         sel = self.tree.selection()
         if not sel:
             return None
-        return int(sel[0])
+        return sel[0]
+
+    def _existing_meta(self, key):
+        # Otro proceso pudo haberla eliminado desde que se cargó la lista
+        vault = cred_vault()
+        vault.refresh()
+        meta = vault.meta(key)
+        if meta is None:
+            messagebox.showerror("Error", "La credencial ya no existe (fue eliminada desde otra ventana).")
+            self._load_list()
+        return meta
 
     def _on_view_cred(self):
         # verify master before showing (the module's own verify function still applies)
         # Here we only record the attempt early
-        idx = self._get_selected_index()
-        if idx is None:
+        key = self._get_selected_id()
+        if key is None:
             messagebox.showwarning("Atención", "Selecciona una credencial para ver.")
             return
-        creds = load_creds()
-        if idx < 0 or idx >= len(creds):
-            messagebox.showerror("Error", "Índice inválido.")
+        c = self._existing_meta(key)
+        if c is None:
             return
-        c = creds[idx]
-        # Use existing local dialogs to verify master (if user has set one in other module)
-        # We call view_attempt with success=True only after showing
-        # For compatibility we ask a simple confirm (the verify flow can be in Pasarela/security_core)
-        confirmed = messagebox.askyesno("Confirmar", "Ver la credencial seleccionada (se registrará en audit log)?")
-        if not confirmed:
-            view_attempt("Seguridad", f"cred:{c.get('service')}|{c.get('user')}", success=False, reason="user_cancel")
+        # Contraseña maestra (o sesión vigente); view_attempt success=True solo al mostrar
+        if not self._unlock("ver la credencial"):
+            view_attempt("Seguridad", f"cred:{c.get('service')}|{c.get('user')}", success=False, reason="master_not_verified")
+            return
+        # show: solo se desencripta este registro
+        c = get_cred(key)
+        if c is None:
+            messagebox.showerror("Error", "La credencial ya no existe (fue eliminada desde otra ventana).")
+            self._load_list()
             return
-        # show
         audit("view_credential", f"{c.get('service')}|{c.get('user')}")
         view_attempt("Seguridad", f"cred:{c.get('service')}|{c.get('user')}", success=True)
         top = tk.Toplevel(self.root)
@@ -310,39 +504,41 @@ class SeguridadTaller:
         ttk.Button(top, text="Cerrar", command=top.destroy).pack(pady=8)
 
     def _on_load_selected(self):
-        idx = self._get_selected_index()
-        if idx is None:
+        key = self._get_selected_id()
+        if key is None:
             messagebox.showwarning("Atención", "Selecciona una credencial para modificar.")
             return
-        creds = load_creds()
-        if idx < 0 or idx >= len(creds):
-            messagebox.showerror("Error", "Índice inválido.")
+        if self._existing_meta(key) is None or not self._unlock("modificar la credencial"):
+            return
+        c = get_cred(key)
+        if c is None:
+            messagebox.showwarning("Atención", "La credencial ya no existe (fue eliminada desde otra ventana).")
+            self._load_list()
             return
-        c = creds[idx]
+        # Se edita en el formulario y "Guardar" reescribe el mismo id
         self.service_var.set(c.get("service",""))
         self.user_var.set(c.get("user",""))
         self.pw_var.set(c.get("password",""))
-        creds.pop(idx)
-        save_creds(creds)
-        audit("load_for_edit", f"{c.get('service')}|{c.get('user')}")
+        self._editing_id = key
+        self._show_strength()
+        audit("load_for_edit", f"{c.get('service')}|{c.get('user')}", id=key)
         button_clicked("Seguridad", "Modificar credencial", f"{c.get('service')}|{c.get('user')}")
-        self._load_list()
 
     def _on_delete_selected(self):
-        idx = self._get_selected_index()
-        if idx is None:
+        key = self._get_selected_id()
+        if key is None:
             messagebox.showwarning("Atención", "Selecciona una credencial para eliminar.")
             return
         if not messagebox.askyesno("Confirmar", "¿Eliminar credencial seleccionada?"):
             view_attempt("Seguridad", "delete_attempt", success=False, reason="user_cancel")
             return
-        creds = load_creds()
-        if idx < 0 or idx >= len(creds):
-            messagebox.showerror("Error", "Índice inválido.")
+        removed = self._existing_meta(key)
+        if removed is None:
             return
-        removed = creds.pop(idx)
-        save_creds(creds)
-        audit("delete_credential", f"{removed.get('service')}|{removed.get('user')}")
+        delete_cred(key)
+        if self._editing_id == key:
+            self._on_clear_form()
+        audit("delete_credential", f"{removed.get('service')}|{removed.get('user')}", id=key)
         button_clicked("Seguridad", "Eliminar credencial", f"{removed.get('service')}|{removed.get('user')}")
         view_attempt("Seguridad", f"cred:{removed.get('service')}|{removed.get('user')}", success=True, reason="deleted")
         messagebox.showinfo("Eliminado", "Credencial eliminada.")
@@ -360,36 +556,71 @@ class SeguridadTaller:
         fname = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV","*.csv")])
         if not fname:
             return
-        df = pd.DataFrame(creds)
-        if not messagebox.askyesno("Exportar", "¿Incluir contraseñas en el CSV exportado? (archivo no cifrado)"):
-            df = df.drop(columns=["password"], errors="ignore")
-        df.to_csv(fname, index=False, encoding="utf-8-sig")
-        audit("export_credentials", fname)
+        with_passwords = messagebox.askyesno("Exportar", "¿Incluir contraseñas en el CSV exportado?")
+        encrypt = messagebox.askyesno("Cifrado", "¿Cifrar el archivo exportado con la clave maestra?"
+                                      + ("" if not with_passwords else "\n(Sin cifrar, las contraseñas quedan en claro en el disco)"))
+        f = None
+        if with_passwords or encrypt:
+            f = store_fernet(self.root, STORE_CREDENCIALES, "exportar credenciales")
+            if f is None:
+                return
+        if encrypt:
+            fname += ENCRYPTED_SUFFIX
+        try:
+            n = run_with_busy(self.root, "Exportando...", export_creds, creds, fname, with_passwords, f if encrypt else None)
+        except Exception as e:
+            try:
+                os.remove(fname)   # no dejar archivos a medias
+            except OSError:
+                pass
+            audit("export_failed", str(e))
+            messagebox.showerror("Error", f"No se pudo exportar: {e}")
+            return
+        audit("export_credentials", fname, rows=n, passwords=with_passwords, encrypted=encrypt)
         button_clicked("Seguridad", "Exportar (CSV)", fname)
-        messagebox.showinfo("Exportado", f"CSV exportado: {fname}")
+        messagebox.showinfo("Exportado", f"{n} credenciales exportadas a:\n{fname}")
+
+    def _on_decrypt_export(self):
+        src = filedialog.askopenfilename(filetypes=[("Exportación cifrada", "*" + ENCRYPTED_SUFFIX)])
+        if not src:
+            return
+        f = store_fernet(self.root, STORE_CREDENCIALES, "descifrar exportación")
+        if f is None:
+            return
+        dst = src[:-len(ENCRYPTED_SUFFIX)] if src.endswith(ENCRYPTED_SUFFIX) else src + ".dec"
+        dst = filedialog.asksaveasfilename(initialfile=os.path.basename(dst))
+        if not dst:
+            return
+        try:
+            run_with_busy(self.root, "Descifrando...", decrypt_export, src, dst, f)
+        except InvalidToken:
+            messagebox.showerror("Error", "El archivo no corresponde a la clave maestra actual o está dañado.")
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo descifrar: {e}")
+            return
+        audit("export_decrypted", dst)
+        button_clicked("Seguridad", "Descifrar exportación", dst)
+        messagebox.showinfo("Descifrado", f"Archivo descifrado en:\n{dst}")
 
     def _on_open_audit(self):
         ensure_base_dir()
-        if not os.path.exists(AUDIT_LOG):
-            messagebox.showinfo("Audit log", "No hay registros de auditoría aún.")
-            return
-        with open(AUDIT_LOG, "r", encoding="utf-8") as f:
-            data = f.read()
-        top = tk.Toplevel(self.root)
-        top.title("Audit log")
-        txt = tk.Text(top, width=120, height=30)
-        txt.pack(fill="both", expand=True)
-        txt.insert("1.0", data)
-        txt.config(state="disabled")
+        VisorAuditoria(self.root, "Seguridad")
         button_clicked("Seguridad", "Ver audit log", "")
 
+    def _on_rotate_master(self):
+        # Re-envuelve las claves de datos (credenciales y pasarela); no re-cifra registros
+        ok = rotate_master(self.root)
+        button_clicked("Seguridad", "Cambiar maestra", f"ok={ok}")
+        if ok:
+            messagebox.showinfo("Contraseña maestra", "Contraseña maestra actualizada. Las claves de datos se re-envolvieron sin re-cifrar las bóvedas.")
+
     def _on_close(self):
         module_closed("Seguridad", "window_closed")
         self.root.destroy()
 
 if __name__ == "__main__":
     ensure_base_dir()
-    _ = load_key()
     root = tk.Tk()
     app = SeguridadTaller(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,253 @@
+# analitica_sesiones.py
+# Analítica de uso a partir del audit log (auditoria_log): agrupa los eventos en
+# sesiones en una sola pasada y acumula
+#   - permanencia por módulo (module_opened -> module_closed)
+#   - clics por módulo/botón y por día de la semana/hora
+#   - sesiones y duración por usuario, lanzamientos desde el panel
+# El resultado se guarda en analitica_sesiones.json junto con el último n procesado
+# y las sesiones aún abiertas, así que cada corrida solo lee los registros nuevos
+# (los segmentos sellados ya procesados se saltan por el manifiesto).
+#
+#   python analitica_sesiones.py              # incremental
+#   python analitica_sesiones.py --completo   # recalcula desde el primer registro
+
+import os
+import sys
+import json
+import gzip
+from datetime import datetime, timedelta
+
+from auditoria_log import load_manifest, ACTIVE_NAME, line_seq
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+AUDIT_DIR = os.path.join(BASE_DIR, "auditoria")
+
+STATE_NAME = "analitica_sesiones.json"
+STATE_VERSION = 1
+SESSION_GAP_SECONDS = 30 * 60        # sin id de sesión: una pausa mayor abre sesión nueva
+SESSION_STALE_SECONDS = 12 * 3600    # sesión sin session_ended ni actividad: se cierra
+MAX_DWELL_SECONDS = 4 * 3600         # tope por apertura (ventanas olvidadas abiertas)
+DIAS = ("Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom")
+
+def _parse_ts(ts):
+    try:
+        return datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return None
+
+def _segundos(desde, hasta):
+    a, b = _parse_ts(desde), _parse_ts(hasta)
+    if a is None or b is None:
+        return 0.0
+    return max(0.0, (b - a).total_seconds())
+
+def _estado_vacio():
+    return {"version": STATE_VERSION, "n": 0, "archivos": [], "actualizado": None,
+            "eventos": 0, "sesiones": 0, "duracion_s": 0.0,
+            "abiertas": {}, "terminadas": {}, "usuarios": {}, "modulos": {}, "botones": {},
+            "lanzamientos": {}, "horas": [[0] * 24 for _ in DIAS], "dias": {}}
+
+def state_path(directory):
+    return os.path.join(directory, STATE_NAME)
+
+def load_state(directory):
+    try:
+        with open(state_path(directory), "r", encoding="utf-8") as f:
+            st = json.load(f)
+        if st.get("version") == STATE_VERSION:
+            return st
+    except (OSError, ValueError):
+        pass
+    return _estado_vacio()
+
+def _save_state(directory, st):
+    path = state_path(directory)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(st, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+class Sesionizador:
+    """
+    Aplica registros (en orden) sobre el estado acumulado. Los módulos abiertos desde
+    el panel heredan TALLER_SESSION_ID y pueden seguir registrando después del
+    session_ended; esos eventos se suman a la sesión terminada ("terminadas": id ->
+    último ts) sin contarla otra vez.
+    """
+
+    def __init__(self, st):
+        self.st = st
+        st.setdefault("terminadas", {})
+
+    def _modulo(self, nombre):
+        m = self.st["modulos"].get(nombre)
+        if m is None:
+            m = self.st["modulos"][nombre] = {"aperturas": 0, "cerradas": 0, "permanencia_s": 0.0, "clics": 0}
+        return m
+
+    def _permanencia(self, nombre, desde, hasta, cerrada):
+        m = self._modulo(nombre)
+        m["permanencia_s"] += min(_segundos(desde, hasta), MAX_DWELL_SECONDS)
+        if cerrada:
+            m["cerradas"] += 1
+
+    def _cerrar(self, clave, fin=None):
+        s = self.st["abiertas"].pop(clave)
+        fin = fin or s["ultimo"]
+        for nombre, abierto in s["modulos"].items():
+            # Sin module_closed: hasta la última actividad registrada en ese módulo
+            self._permanencia(nombre, abierto, s["actividad"].get(nombre, abierto), False)
+        if not clave.startswith("~"):
+            self.st["terminadas"][clave] = fin
+        if s.get("terminada"):
+            return                                        # cola de una sesión ya contada
+        dur = _segundos(s["inicio"], fin)
+        self.st["sesiones"] += 1
+        self.st["duracion_s"] += dur
+        u = self.st["usuarios"].setdefault(s["user"] or "?", {"sesiones": 0, "duracion_s": 0.0})
+        u["sesiones"] += 1
+        u["duracion_s"] += dur
+        d = self.st["dias"].setdefault(s["inicio"][:10], {"sesiones": 0, "clics": 0})
+        d["sesiones"] += 1
+
+    def aplicar(self, rec):
+        ts, event = rec.get("ts"), rec.get("event")
+        t = _parse_ts(ts)
+        if t is None:
+            return
+        clave = rec.get("session") or "~" + (rec.get("user") or "?")
+        abiertas = self.st["abiertas"]
+        s = abiertas.get(clave)
+        if s is not None and clave.startswith("~") and (t - _parse_ts(s["ultimo"])).total_seconds() > SESSION_GAP_SECONDS:
+            self._cerrar(clave)
+            s = None
+        if s is None:
+            if event in ("session_ended", "module_closed"):
+                return                                    # cierre de una sesión ya contada
+            s = abiertas[clave] = {"user": rec.get("user"), "inicio": ts, "ultimo": ts, "modulos": {}, "actividad": {}}
+            if clave in self.st["terminadas"]:
+                s["terminada"] = True
+        s["ultimo"] = ts
+        self.st["eventos"] += 1
+        data = rec.get("data") or {}
+        modulo = rec.get("module") or "?"
+
+        if event == "session_ended":
+            self._cerrar(clave, ts)
+        elif event == "module_opened":
+            if data.get("details") == "opened_from_panel":
+                self.st["lanzamientos"][modulo] = self.st["lanzamientos"].get(modulo, 0) + 1
+                return
+            if modulo in s["modulos"]:                    # reabierto sin cierre registrado
+                self._permanencia(modulo, s["modulos"][modulo], s["actividad"].get(modulo, ts), False)
+            self._modulo(modulo)["aperturas"] += 1
+            s["modulos"][modulo] = ts
+            s["actividad"][modulo] = ts
+        elif event == "module_closed":
+            abierto = s["modulos"].pop(modulo, None)
+            if abierto is not None:
+                self._permanencia(modulo, abierto, ts, True)
+            s["actividad"].pop(modulo, None)
+        elif event == "button_clicked":
+            self._modulo(modulo)["clics"] += 1
+            botones = self.st["botones"].setdefault(modulo, {})
+            boton = str(data.get("button") or "?")
+            botones[boton] = botones.get(boton, 0) + 1
+            self.st["horas"][t.weekday()][t.hour] += 1
+            self.st["dias"].setdefault(ts[:10], {"sesiones": 0, "clics": 0})["clics"] += 1
+            if modulo in s["modulos"]:
+                s["actividad"][modulo] = ts
+
+    def cerrar_inactivas(self, ahora=None):
+        limite = ((ahora or datetime.now()) - timedelta(seconds=SESSION_STALE_SECONDS)).isoformat(timespec="milliseconds")
+        for clave in [c for c, s in self.st["abiertas"].items() if s["ultimo"] < limite]:
+            self._cerrar(clave)
+        terminadas = self.st["terminadas"]
+        for clave in [c for c, fin in terminadas.items() if fin < limite and c not in self.st["abiertas"]]:
+            del terminadas[clave]
+
+def _raw_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for raw in f:
+            yield raw
+
+def _registros_nuevos(directory, st):
+    """Registros posteriores al estado: por n (encadenados) o por archivo (segmentos sin n)."""
+    desde = st["n"]
+    hechos = set(st["archivos"])
+    segmentos = sorted(load_manifest(directory)["segments"], key=lambda s: (s.get("first_n") is not None, s.get("first_n") or 0))
+    rutas = []
+    for seg in segmentos:
+        if seg.get("last_n") is None:
+            if seg["file"] not in hechos:
+                rutas.append((os.path.join(directory, seg["file"]), seg["file"]))
+        elif seg["last_n"] > desde:
+            rutas.append((os.path.join(directory, seg["file"]), None))
+    rutas.append((os.path.join(directory, ACTIVE_NAME), None))
+    for path, sin_cadena in rutas:
+        if not os.path.exists(path):
+            continue
+        for raw in _raw_lines(path):
+            n = line_seq(raw)
+            if n is not None and n <= desde:
+                continue
+            try:
+                rec = json.loads(raw)
+            except ValueError:
+                continue
+            if n is None and sin_cadena is None:
+                continue                                  # activo a medio migrar
+            yield n, rec
+        if sin_cadena:
+            st["archivos"].append(sin_cadena)
+
+def analizar(directory=None, completo=False, guardar=True):
+    """Procesa lo nuevo del audit log, guarda el estado y lo devuelve."""
+    directory = directory or AUDIT_DIR
+    st = _estado_vacio() if completo else load_state(directory)
+    ses = Sesionizador(st)
+    for n, rec in _registros_nuevos(directory, st):
+        ses.aplicar(rec)
+        if n is not None:
+            st["n"] = n
+    ses.cerrar_inactivas()
+    st["actualizado"] = datetime.now().isoformat(timespec="seconds")
+    if guardar and os.path.isdir(directory):
+        _save_state(directory, st)
+    return st
+
+# ==========================
+# RESUMEN
+# ==========================
+def _hms(segundos):
+    segundos = int(segundos)
+    return f"{segundos // 3600}h {segundos % 3600 // 60:02d}m" if segundos >= 3600 else f"{segundos // 60}m {segundos % 60:02d}s"
+
+def top_modulos(st, limite=10):
+    """[(módulo, permanencia_s, aperturas, clics)] por permanencia y luego clics."""
+    filas = [(m, v["permanencia_s"], v["aperturas"], v["clics"]) for m, v in st["modulos"].items()]
+    return sorted(filas, key=lambda f: (f[1], f[3]), reverse=True)[:limite]
+
+def top_botones(st, limite=10):
+    filas = [(m, b, q) for m, bs in st["botones"].items() for b, q in bs.items()]
+    return sorted(filas, key=lambda f: f[2], reverse=True)[:limite]
+
+def texto_resumen(st):
+    prom = st["duracion_s"] / st["sesiones"] if st["sesiones"] else 0
+    lines = [f"Sesiones: {st['sesiones']}  (abiertas: {len(st['abiertas'])})",
+             f"Duración promedio: {_hms(prom)}",
+             f"Eventos analizados: {st['eventos']}  (hasta n {st['n']})",
+             "", "Permanencia por módulo:"]
+    for m, seg, ap, cl in top_modulos(st):
+        lines.append(f"• {m}: {_hms(seg)} en {ap} aperturas, {cl} clics")
+    lines += ["", "Botones más usados:"]
+    for m, b, q in top_botones(st):
+        lines.append(f"• {m} / {b}: {q}")
+    if st["lanzamientos"]:
+        lines += ["", "Abiertos desde el panel:"]
+        for archivo, q in sorted(st["lanzamientos"].items(), key=lambda x: x[1], reverse=True)[:10]:
+            lines.append(f"• {archivo}: {q}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    print(texto_resumen(analizar(completo="--completo" in sys.argv[1:])))
@@ -0,0 +1,409 @@
+# auditoria_log.py
+# Formato y almacenamiento del audit log: un registro JSON por línea con campos
+# tipados, segmento activo que rota por tamaño y por día, segmentos cerrados
+# comprimidos con gzip y un manifiesto con el rango de fechas, conteos por evento
+# y usuarios de cada segmento (para saltar segmentos sin abrirlos).
+#
+# Registro:
+#   {"n": 1234, "ts": "2026-01-31T09:15:02.123", "event": "button_clicked", "user": "ana",
+#    "session": "ana-20260131091400", "module": "PasarelaPagos",
+#    "data": {...} | null, "msg": "texto libre" | null, "h": "<sha256>"}
+#
+# n es el número de secuencia global y h encadena cada registro con el anterior:
+#   h = sha256(h_anterior + línea sin el campo h)   (ver integridad_auditoria)
+
+import os
+import re
+import json
+import gzip
+import shutil
+import hashlib
+from datetime import datetime
+
+from bloqueo_archivos import bloqueo
+
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+ACTIVE_NAME = "audit_actual.jsonl"
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "audit.lock"
+SEGMENT_PREFIX = "audit-"
+GENESIS = "0" * 64
+_HASH_SUFFIX_LEN = len(',"h":""}') + 64
+
+# ==========================
+# ESQUEMA
+# ==========================
+_KV_LINE = re.compile(r"\w+=\S*(?:\s+\w+=\S*)*")
+_KV = re.compile(r"(\w+)=(\S*)")
+_INT = re.compile(r"-?(?:0|[1-9]\d*)")
+_FLOAT = re.compile(r"-?\d+\.\d+")
+
+def _typed(value):
+    if _INT.fullmatch(value):
+        return int(value)
+    if _FLOAT.fullmatch(value):
+        return float(value)
+    return {"True": True, "False": False, "None": None}.get(value, value)
+
+def parse_details(details):
+    """
+    details libre -> (data, msg). JSON de objeto -> data; "k=v k2=v2" -> data con
+    números/booleanos tipados; cualquier otro texto se conserva en msg.
+    """
+    if not details:
+        return None, None
+    text = str(details).strip()
+    if text.startswith("{"):
+        try:
+            obj = json.loads(text)
+            if isinstance(obj, dict):
+                return obj, None
+        except ValueError:
+            pass
+    if _KV_LINE.fullmatch(text):
+        return {k: _typed(v) for k, v in _KV.findall(text)}, None
+    return None, text
+
+def build_record(ts, event, user, session=None, details="", fields=None):
+    data, msg = parse_details(details)
+    if fields:
+        data = dict(data or {}, **fields)
+    module = data.pop("module", None) if data else None
+    return {"ts": ts, "event": event, "user": user, "session": session,
+            "module": module, "data": data or None, "msg": msg}
+
+def dumps(rec):
+    # default=str: un valor no serializable en data no debe impedir escribir el registro
+    return json.dumps(rec, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def chain_line(rec, n, prev):
+    """Línea encadenada (bytes, con salto de línea) y su hash."""
+    body = dumps({"n": n, **rec}).encode("utf-8")
+    h = hashlib.sha256(prev.encode("ascii") + body).hexdigest()
+    return body[:-1] + b',"h":"' + h.encode("ascii") + b'"}\n', h
+
+def split_chained(raw):
+    """
+    Línea cruda (sin salto) -> (n, cuerpo_sin_h, h), o None si no está encadenada.
+    Se separa por bytes: el hash se verifica sobre lo escrito, no sobre un re-dump.
+    """
+    if not raw.startswith(b'{"n":') or not raw.endswith(b'"}') or raw[-_HASH_SUFFIX_LEN:-66] != b',"h":"':
+        return None
+    try:
+        n = int(raw[5:raw.index(b",")])
+    except ValueError:
+        return None
+    return n, raw[:-_HASH_SUFFIX_LEN] + b"}", raw[-66:-2].decode("ascii")
+
+def line_seq(raw):
+    """Número de secuencia de una línea cruda sin parsear el JSON (None si no tiene)."""
+    if not raw.startswith(b'{"n":'):
+        return None
+    try:
+        return int(raw[5:raw.index(b",")])
+    except ValueError:
+        return None
+
+def format_record(rec):
+    """Línea legible "fecha | evento | usuario | detalle" para visores."""
+    detail = rec.get("msg") or ""
+    extra = dict(rec.get("data") or {})
+    if rec.get("module"):
+        extra = {"module": rec["module"], **extra}
+    if extra:
+        detail = (detail + " " if detail else "") + json.dumps(extra, ensure_ascii=False)
+    return f"{rec.get('ts', '').replace('T', ' ')} | {rec.get('event')} | {rec.get('user')} | {detail}"
+
+def legacy_records(lines):
+    """Líneas del formato anterior ("ts | event | user | details") -> registros."""
+    last = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        parts = line.split(" | ", 3)
+        if len(parts) >= 3 and len(parts[0]) >= 19 and parts[0][4] == "-":
+            if last is not None:
+                yield last
+            ts = parts[0].replace(" ", "T", 1)
+            last = build_record(ts, parts[1], parts[2], None, parts[3] if len(parts) > 3 else "")
+        elif last is not None and line:
+            # Detalle de varias líneas (p. ej. trazas de error)
+            last["msg"] = ((last.get("msg") or "") + "\n" + line).lstrip("\n")
+    if last is not None:
+        yield last
+
+# ==========================
+# SEGMENTOS
+# ==========================
+def manifest_path(directory):
+    return os.path.join(directory, MANIFEST_NAME)
+
+def load_manifest(directory):
+    try:
+        with open(manifest_path(directory), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"version": 1, "segments": []}
+
+def _save_manifest(directory, manifest):
+    path = manifest_path(directory)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+def _segment_stats(path):
+    stats = {"first_ts": None, "last_ts": None, "records": 0, "bytes": 0, "events": {}, "users": {},
+             "first_n": None, "last_n": None, "last_hash": None}
+    with open(path, "rb") as f:
+        for raw in f:
+            stats["bytes"] += len(raw)
+            try:
+                rec = json.loads(raw)
+            except ValueError:
+                continue
+            ts = rec.get("ts")
+            if ts:
+                if stats["first_ts"] is None or ts < stats["first_ts"]:
+                    stats["first_ts"] = ts
+                if stats["last_ts"] is None or ts > stats["last_ts"]:
+                    stats["last_ts"] = ts
+            stats["records"] += 1
+            if rec.get("n") is not None:
+                if stats["first_n"] is None:
+                    stats["first_n"] = rec["n"]
+                stats["last_n"], stats["last_hash"] = rec["n"], rec.get("h")
+            ev, us = rec.get("event") or "", rec.get("user") or ""
+            stats["events"][ev] = stats["events"].get(ev, 0) + 1
+            stats["users"][us] = stats["users"].get(us, 0) + 1
+    return stats
+
+def seal_segment(directory, path):
+    """
+    Cierra un segmento sin comprimir (ya renombrado fuera del activo): gzip,
+    entrada en el manifiesto y borrado del original, en ese orden, para que un
+    corte a mitad se pueda retomar en el siguiente arranque.
+    """
+    gz = path + ".gz"
+    stats = _segment_stats(path)
+    with open(path, "rb") as src, gzip.open(gz + ".tmp", "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(gz + ".tmp", gz)
+    manifest = load_manifest(directory)
+    name = os.path.basename(gz)
+    manifest["segments"] = [s for s in manifest["segments"] if s["file"] != name]
+    manifest["segments"].append(dict(stats, file=name, stored_bytes=os.path.getsize(gz)))
+    manifest["segments"].sort(key=lambda s: (s.get("first_ts") or "", s["file"]))
+    _save_manifest(directory, manifest)
+    os.remove(path)
+    return name
+
+class SegmentLog:
+    """
+    Escritor del segmento activo (lo usa el hilo de auditoría de security_core).
+    append() rota antes de escribir si el lote se pasaría de SEGMENT_MAX_BYTES o
+    si el día cambió respecto al primer registro del segmento. La cadena (n, h)
+    continúa entre segmentos: al abrir se retoma del último registro escrito.
+
+    Cada módulo que abre el panel es un proceso con su propio SegmentLog sobre el
+    mismo directorio: append, rotación y sellado se hacen con el candado del
+    directorio (LOCK_NAME) y el activo se abre en cada append, así nadie escribe
+    en un segmento que otro proceso ya renombró (en Windows, además, nadie retiene
+    el activo mientras otro lo rota). Si el activo no es el que dejó el último
+    append (otro inode u otro tamaño), otro proceso escribió o rotó: se vuelven a
+    leer su día y la cola de la cadena, así n sigue siendo único y h encadena
+    con lo que de verdad está en disco. El mismo candado (lock) cubre los
+    checkpoints que firma security_core.
+    """
+    def __init__(self, directory, legacy_log=None, max_bytes=SEGMENT_MAX_BYTES, on_seal=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.on_seal = on_seal          # on_seal(ruta_gz): p. ej. dejar listo el índice de consulta
+        os.makedirs(directory, exist_ok=True)
+        self.active_path = os.path.join(directory, ACTIVE_NAME)
+        self.lock = bloqueo(os.path.join(directory, LOCK_NAME))
+        self._ino = None
+        self._size = 0
+        self._day = None
+        with self.lock:
+            sealed = self._recover()
+            self.last_n, self.last_hash = self._chain_tail()
+            if legacy_log and os.path.exists(legacy_log):
+                sealed.append(self._migrate_legacy(legacy_log))
+        self._notify(sealed)
+
+    def _chain_tail(self):
+        """(n, h) del último registro encadenado: cola del activo o, si está vacío, el manifiesto."""
+        if os.path.exists(self.active_path) and os.path.getsize(self.active_path):
+            with open(self.active_path, "rb") as f:
+                f.seek(max(0, os.path.getsize(self.active_path) - 65536))
+                for raw in reversed(f.read().splitlines()):
+                    parts = split_chained(raw)
+                    if parts:
+                        return parts[0], parts[2]
+        chained = [s for s in load_manifest(self.directory)["segments"] if s.get("last_n") is not None]
+        if chained:
+            seg = max(chained, key=lambda s: s["last_n"])
+            return seg["last_n"], seg["last_hash"]
+        return 0, GENESIS
+
+    def _encode(self, records):
+        """(bytes, n, h): líneas encadenadas desde la cola actual, sin avanzarla; quien
+        escribe fija last_n/last_hash solo cuando la escritura terminó."""
+        n, h = self.last_n, self.last_hash
+        lines = []
+        for rec in records:
+            n += 1
+            line, h = chain_line(rec, n, h)
+            lines.append(line)
+        return b"".join(lines), n, h
+
+    def _first_day(self):
+        if self._size == 0:
+            return None
+        with open(self.active_path, "rb") as f:
+            try:
+                return json.loads(f.readline()).get("ts", "")[:10] or None
+            except ValueError:
+                return None
+
+    def _open_active(self):
+        """Abre el activo para agregar (con el candado tomado); si otro proceso lo tocó, retoma día y cadena."""
+        f = open(self.active_path, "ab")
+        st = os.fstat(f.fileno())
+        if (st.st_ino, st.st_size) != (self._ino, self._size):
+            self._ino, self._size = st.st_ino, st.st_size
+            self._day = self._first_day()
+            self.last_n, self.last_hash = self._chain_tail()
+        return f
+
+    def _recover(self):
+        """Sella los segmentos que quedaron renombrados sin sellar (corte a mitad de una rotación)."""
+        return [seal_segment(self.directory, os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(".jsonl")]
+
+    def _migrate_legacy(self, legacy_log):
+        pending = os.path.join(self.directory, f"{SEGMENT_PREFIX}legacy-{datetime.now():%Y%m%d%H%M%S}.jsonl")
+        with open(legacy_log, "r", encoding="utf-8", errors="replace") as src, open(pending, "wb") as dst:
+            for rec in legacy_records(src):
+                data, n, h = self._encode([rec])
+                dst.write(data)
+                self.last_n, self.last_hash = n, h
+        name = seal_segment(self.directory, pending)
+        os.replace(legacy_log, legacy_log + ".migrated")
+        return name
+
+    def append(self, records, sync=False):
+        """
+        records: lista de dicts; se escriben en una sola llamada. sync: fsync antes de
+        soltar el candado; devuelve si quedó sincronizado (un fsync fallido no anula
+        lo escrito, así que no se propaga: el lote no debe reintentarse).
+        """
+        if not records:
+            return False
+        sealed, synced = [], False
+        with self.lock:
+            f = self._open_active()
+            try:
+                data, n, h = self._encode(records)
+                day = records[0].get("ts", "")[:10]
+                if self._size and (self._size + len(data) > self.max_bytes or (self._day and day != self._day)):
+                    f.close()
+                    sealed.append(self._rotate())
+                    f = self._open_active()
+                    data, n, h = self._encode(records)  # la cola se volvió a leer del segmento sellado
+                try:
+                    f.write(data)
+                    f.flush()
+                except Exception:
+                    f.truncate(self._size)              # sin líneas a medias
+                    raise
+                self.last_n, self.last_hash = n, h
+                if sync:
+                    try:
+                        os.fsync(f.fileno())
+                        synced = True
+                    except OSError:
+                        pass
+            except Exception:
+                # Rotación, reapertura o escritura fallida: el próximo append retoma
+                # día y cadena desde el disco (sin huecos ni saltos en n)
+                self._ino = None
+                raise
+            finally:
+                f.close()
+            if self._day is None:
+                self._day = day
+            self._size += len(data)
+        self._notify(sealed)
+        return synced
+
+    def rotate(self):
+        with self.lock:
+            self._open_active().close()
+            name = self._rotate()
+        self._notify([name] if name else [])
+        return name
+
+    def _rotate(self):
+        if self._size == 0:
+            return None
+        pending = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._day or 'sin-fecha'}-{datetime.now():%H%M%S%f}.jsonl")
+        os.replace(self.active_path, pending)
+        self._ino, self._size, self._day = None, 0, None
+        return seal_segment(self.directory, pending)
+
+    def _notify(self, sealed):
+        # Fuera del candado: indexar un segmento no debe frenar a los demás escritores
+        if self.on_seal is None:
+            return
+        for name in sealed:
+            try:
+                self.on_seal(os.path.join(self.directory, name))
+            except Exception:
+                pass
+
+    def sync(self):
+        """fsync del activo (el archivo no queda abierto entre appends)."""
+        with self.lock:
+            with open(self.active_path, "ab") as f:
+                os.fsync(f.fileno())
+
+    def close(self):
+        # No hay descriptor que liberar: el activo se abre y cierra en cada append
+        pass
+
+# ==========================
+# LECTURA
+# ==========================
+def _read_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for raw in f:
+            try:
+                yield json.loads(raw)
+            except ValueError:
+                continue
+
+def iter_records(directory, since=None, until=None):
+    """
+    Registros en orden cronológico, de los segmentos del manifiesto y el activo.
+    since/until (prefijos ISO, p. ej. "2026-01-31", until incluye ese día) saltan
+    segmentos completos usando first_ts/last_ts del manifiesto.
+    """
+    hi = until + "\uffff" if until else None
+    paths = []
+    for seg in load_manifest(directory)["segments"]:
+        if since and (seg.get("last_ts") or "") < since:
+            continue
+        if hi and (seg.get("first_ts") or "") > hi:
+            continue
+        paths.append(os.path.join(directory, seg["file"]))
+    paths.append(os.path.join(directory, ACTIVE_NAME))
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for rec in _read_lines(path):
+            ts = rec.get("ts") or ""
+            if (since and ts < since) or (hi and ts > hi):
+                continue
+            yield rec
@@ -0,0 +1,208 @@
+# benchmark_pagos.py
+# Prueba de carga sin interfaz del flujo de cobro de pasarela_pagos:
+#   validación -> procesador -> save_transaction -> audit -> conciliación
+# contra el sandbox HTTP embebido (o otro procesador con --url). Reporta p50/p95/p99
+# y rendimiento por etapa; con --max-p95 termina con código 1 si una etapa se
+# pasa del límite (para CI). Todo se escribe en un directorio temporal.
+#
+#   python benchmark_pagos.py --payments 500 --concurrency 16 --latency-scale 0.05
+#   python benchmark_pagos.py --json resultado.json --max-p95 save_transaction=50 --max-p95 total=400
+
+import os
+import sys
+import json
+import time
+import math
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import as_completed
+
+STAGES = ["validation", "processor", "save_transaction", "audit", "reconcile", "total"]
+
+# Tarjetas de prueba (pasan Luhn)
+TEST_CARDS = ["4111111111111111", "5555555555554444", "4012888888881881", "378282246310005"]
+METHODS = ["card", "pse", "wallet", "transfer", "cash"]
+
+def _redirect_data_dir(tmp):
+    """Apunta todos los archivos de datos a tmp antes de medir (nunca toca los datos reales)."""
+    import security_core
+    import pasarela_pagos
+    import cierre_caja
+    import conciliacion_pagos
+    import cartera_taller
+    for mod in (security_core, pasarela_pagos, cartera_taller):
+        mod.BASE_DIR = tmp
+    security_core.AUDIT_LOG = os.path.join(tmp, "security_audit.log")
+    security_core.AUDIT_DIR = os.path.join(tmp, "auditoria")
+    security_core.AUDIT_KEY_FILE = os.path.join(tmp, "audit_checkpoint.key")
+    pasarela_pagos.TRANSACTIONS_FILE = os.path.join(tmp, "transactions.json")
+    conciliacion_pagos.TRANSACTIONS_FILE = pasarela_pagos.TRANSACTIONS_FILE
+    conciliacion_pagos.LEDGER_FILE = os.path.join(tmp, "conciliaciones.jsonl")
+    cierre_caja.SETTLEMENT_FILE = os.path.join(tmp, "liquidacion_diaria.json")
+    cierre_caja.CLOSES_FILE = os.path.join(tmp, "cierres_caja.jsonl")
+    cartera_taller.DATA_FILE = os.path.join(tmp, "cartera.json")
+    return pasarela_pagos
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano (sin interpolar), sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+def _build_request(pp, i):
+    """Etapa de validación: lo mismo que hacen los _*_request de la pasarela."""
+    kind = METHODS[i % len(METHODS)]
+    amount = float(10000 + (i % 50) * 1000)
+    if kind == "card":
+        card = TEST_CARDS[i % len(TEST_CARDS)]
+        if not pp.luhn_checksum(card):
+            raise ValueError("Luhn")
+        request = {"kind": "card", "amount": amount, "card": card, "exp": "12/30", "token": None, "extra": {}}
+        mask = pp.mask_card(card)
+    elif kind == "pse":
+        request = {"kind": "pse", "amount": amount, "extra": {"bank": "Bancolombia", "account_type": "Ahorros", "doc": "1020304050"}}
+        mask = "PSE-Bancolombia"
+    elif kind == "wallet":
+        request = {"kind": "wallet", "amount": amount, "extra": {"provider": "Nequi", "phone": "3001234567", "ref": f"B{i}"}}
+        mask = "Nequi-4567"
+    elif kind == "transfer":
+        request = {"kind": "transfer", "amount": amount, "extra": {"bank": "Bancolombia", "ref": f"TR{i}"}}
+        mask = "TR-Bancolombia"
+    else:
+        request = {"kind": "cash", "amount": amount, "extra": {"note": "benchmark"}}
+        mask = "EFECTIVO"
+    request["method"] = {"card": "Tarjeta crédito", "pse": "PSE", "wallet": "Nequi",
+                         "transfer": "Transferencia Bancolombia", "cash": "Efectivo"}[kind]
+    return request, mask
+
+def run(payments=200, concurrency=8, latency_scale=0.05, failure_pct=0, url=None, port=0):
+    """
+    Igual que la pasarela: validación, envío y guardado/audit corren en un solo hilo
+    (el de Tk); solo el procesador es concurrente (pool de `concurrency` hilos).
+    Devuelve {"config", "stages": {etapa: {p50, p95, p99, mean, count}}, "throughput_per_s"}.
+    """
+    from procesador_pagos import PaymentDispatcher, IdempotencyStore, HttpProcessor, new_idempotency_key, start_sandbox_server
+
+    tmp = tempfile.mkdtemp(prefix="bench_pagos_")
+    server = None
+    try:
+        pp = _redirect_data_dir(tmp)
+        if url is None:
+            server = start_sandbox_server("127.0.0.1", port, latency_scale=latency_scale, failure_pct=failure_pct)
+            url = f"http://127.0.0.1:{server.server_address[1]}/charges"
+        dispatcher = PaymentDispatcher(HttpProcessor(url), workers=concurrency, timeout=pp.PROCESSOR_TIMEOUT_SECONDS,
+                                       retries=pp.PROCESSOR_RETRIES,
+                                       idempotency=IdempotencyStore(os.path.join(tmp, "idempotency_keys.jsonl")))
+        samples = {s: [] for s in STAGES}
+        clock = time.perf_counter
+        started = clock()
+        inflight = {}
+
+        for i in range(payments):
+            t0 = clock()
+            request, mask = _build_request(pp, i)
+            t1 = clock()
+            samples["validation"].append(t1 - t0)
+            future = dispatcher.submit(request, idempotency_key=new_idempotency_key())
+            meta = {"t0": t0, "sent": t1, "mask": mask, "request": request, "done": None}
+            future.add_done_callback(lambda f, m=meta: m.__setitem__("done", clock()))
+            inflight[future] = meta
+
+        for future in as_completed(inflight):
+            meta = inflight[future]
+            result = future.result()
+            samples["processor"].append((meta["done"] or clock()) - meta["sent"])
+            request = meta["request"]
+            tx = {"id": result.get("id"), "cliente": f"Cliente {len(samples['total']) % 100}", "amount": result.get("amount"),
+                  "method": request["method"], "status": result.get("status"), "processor_code": result.get("processor_code"),
+                  "message": result.get("message"), "time": datetime.now().isoformat(), "card_mask": meta["mask"],
+                  "extra": result.get("extra", {}), "idempotency_key": request.get("idempotency_key")}
+            t2 = clock()
+            pp.save_transaction(tx)
+            t3 = clock()
+            pp.audit("process_payment_result", f"id={tx['id']} status={tx['status']} amount={tx['amount']} method={tx['method']}")
+            t4 = clock()
+            pp.reconcile_receivables([tx])
+            t5 = clock()
+            samples["save_transaction"].append(t3 - t2)
+            samples["audit"].append(t4 - t3)
+            samples["reconcile"].append(t5 - t4)
+            samples["total"].append(t5 - meta["t0"])
+        elapsed = clock() - started
+        dispatcher.shutdown(wait=True)
+    finally:
+        if server is not None:
+            server.shutdown()
+        import security_core
+        security_core.flush_audit(close=True)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    stages = {}
+    for stage, values in samples.items():
+        values.sort()
+        stages[stage] = {
+            "count": len(values),
+            "mean_ms": round(1000 * sum(values) / len(values), 3) if values else 0.0,
+            "p50_ms": round(1000 * percentile(values, 50), 3),
+            "p95_ms": round(1000 * percentile(values, 95), 3),
+            "p99_ms": round(1000 * percentile(values, 99), 3),
+        }
+    return {
+        "config": {"payments": payments, "concurrency": concurrency, "latency_scale": latency_scale,
+                   "failure_pct": failure_pct, "url": url},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(payments / elapsed, 2) if elapsed else 0.0,
+        "stages": stages,
+    }
+
+def format_report(report):
+    cfg = report["config"]
+    lines = [f"Pagos: {cfg['payments']}  concurrencia: {cfg['concurrency']}  latencia x{cfg['latency_scale']}  "
+             f"fallas: {cfg['failure_pct']}%",
+             f"Tiempo total: {report['elapsed_s']} s  |  {report['throughput_per_s']} pagos/s",
+             "",
+             f"{'etapa':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'media ms':>10}"]
+    for stage in STAGES:
+        s = report["stages"][stage]
+        lines.append(f"{stage:<18}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['mean_ms']:>10.2f}")
+    return "\n".join(lines)
+
+def check_limits(report, limits):
+    """limits: {etapa: ms máximo de p95}. Devuelve la lista de etapas que se pasaron."""
+    return [f"{stage}: p95 {report['stages'][stage]['p95_ms']} ms > {ms} ms"
+            for stage, ms in limits.items() if report["stages"][stage]["p95_ms"] > ms]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del flujo de cobro (sandbox)")
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-scale", type=float, default=0.05, help="escala de la latencia simulada del sandbox")
+    parser.add_argument("--failure-pct", type=int, default=0, help="%% de respuestas 503 del sandbox (reintentos)")
+    parser.add_argument("--url", default=None, help="procesador HTTP externo en lugar del sandbox embebido")
+    parser.add_argument("--json", default=None, help="guardar el reporte en este archivo")
+    parser.add_argument("--max-p95", action="append", default=[], metavar="ETAPA=MS",
+                        help="límite de p95 por etapa; se puede repetir")
+    args = parser.parse_args(argv)
+
+    limits = {}
+    for item in args.max_p95:
+        stage, _, ms = item.partition("=")
+        if stage not in STAGES or not ms:
+            parser.error(f"--max-p95 inválido: {item} (etapas: {', '.join(STAGES)})")
+        limits[stage] = float(ms)
+
+    report = run(args.payments, args.concurrency, args.latency_scale, args.failure_pct, args.url)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    exceeded = check_limits(report, limits)
+    for msg in exceeded:
+        print("LÍMITE EXCEDIDO:", msg)
+    return 1 if exceeded else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# bin_marcas.py
+# Marca y tipo de tarjeta por BIN: tabla de rangos (editable en bin_marcas.json) cargada
+# en un trie de dígitos. La consulta recorre a lo sumo tantos nodos como dígitos tenga
+# el prefijo más largo y gana la coincidencia más larga. Si el archivo cambia, la
+# tabla se recarga sola en la siguiente consulta.
+
+import os
+import json
+import time
+import threading
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+BIN_FILE = os.path.join(BASE_DIR, "bin_marcas.json")
+RELOAD_CHECK_SECONDS = 2.0
+UNKNOWN = ("CARD", "")
+
+# desde/hasta: prefijos del mismo largo (rango inclusivo). tipo: credito/debito/prepago o "".
+DEFAULT_TABLE = [
+    {"desde": "4", "hasta": "4", "marca": "VISA", "tipo": ""},
+    {"desde": "51", "hasta": "55", "marca": "MASTERCARD", "tipo": ""},
+    {"desde": "2221", "hasta": "2720", "marca": "MASTERCARD", "tipo": ""},
+    {"desde": "34", "hasta": "34", "marca": "AMEX", "tipo": "credito"},
+    {"desde": "37", "hasta": "37", "marca": "AMEX", "tipo": "credito"},
+    {"desde": "300", "hasta": "305", "marca": "DINERS", "tipo": "credito"},
+    {"desde": "36", "hasta": "36", "marca": "DINERS", "tipo": "credito"},
+    {"desde": "38", "hasta": "39", "marca": "DINERS", "tipo": "credito"},
+    {"desde": "3528", "hasta": "3589", "marca": "JCB", "tipo": ""},
+    {"desde": "6011", "hasta": "6011", "marca": "DISCOVER", "tipo": ""},
+    {"desde": "644", "hasta": "659", "marca": "DISCOVER", "tipo": ""},
+    {"desde": "5895", "hasta": "5895", "marca": "MAESTRO", "tipo": "debito"},
+    {"desde": "6759", "hasta": "6759", "marca": "MAESTRO", "tipo": "debito"},
+]
+
+def range_to_prefixes(desde, hasta):
+    """
+    Cubre el rango [desde, hasta] (mismo largo) con el mínimo de prefijos:
+    2221-2720 -> 2221..2229, 223..229, 23..26, 270, 271, 2720.
+    """
+    if len(desde) != len(hasta) or desde > hasta:
+        raise ValueError(f"Rango BIN inválido: {desde}-{hasta}")
+    out = []
+    lo, hi, width = int(desde), int(hasta), len(desde)
+    while lo <= hi:
+        # Bloque alineado más grande que empieza en lo y no se pasa de hi
+        size, digits = 1, width
+        while digits > 1 and lo % (size * 10) == 0 and lo + size * 10 - 1 <= hi:
+            size *= 10
+            digits -= 1
+        out.append(str(lo // size).zfill(digits) if digits else "")
+        lo += size
+    return out
+
+class BinTrie:
+    """Trie de dígitos: cada nodo es un dict dígito -> nodo; la hoja guarda (marca, tipo) en la llave None."""
+    def __init__(self, entries=()):
+        self.root = {}
+        self.max_depth = 0
+        for e in entries:
+            for prefix in range_to_prefixes(str(e["desde"]), str(e["hasta"])):
+                self.insert(prefix, (e["marca"], e.get("tipo", "")))
+
+    def insert(self, prefix, value):
+        node = self.root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[None] = value
+        self.max_depth = max(self.max_depth, len(prefix))
+
+    def lookup(self, digits):
+        """(marca, tipo) del prefijo más largo que coincide, o UNKNOWN."""
+        node, found = self.root, UNKNOWN
+        for ch in digits[:self.max_depth]:
+            node = node.get(ch)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+class BinTable:
+    """Trie + recarga en caliente por mtime del archivo (revisado como máximo cada RELOAD_CHECK_SECONDS)."""
+    def __init__(self, path=None):
+        self.path = path or BIN_FILE
+        self._trie = BinTrie(DEFAULT_TABLE)
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.version = 0
+        self.reload()
+
+    def reload(self):
+        entries = DEFAULT_TABLE
+        mtime = None
+        try:
+            if os.path.exists(self.path):
+                mtime = os.path.getmtime(self.path)
+                with open(self.path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            elif os.path.isdir(os.path.dirname(self.path)):
+                # Primera vez: dejar la tabla por defecto como archivo editable
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(DEFAULT_TABLE, f, ensure_ascii=False, indent=2)
+                mtime = os.path.getmtime(self.path)
+            trie = BinTrie(entries)
+        except Exception:
+            # Archivo mal formado: se conserva la tabla anterior
+            self._mtime = mtime
+            return False
+        with self._lock:
+            self._trie = trie
+            self._mtime = mtime
+            self.version += 1
+        return True
+
+    def check_reload(self):
+        """Recarga si el archivo cambió; devuelve la versión vigente de la tabla."""
+        now = time.monotonic()
+        if now - self._checked < RELOAD_CHECK_SECONDS:
+            return self.version
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return self.version
+        if mtime != self._mtime:
+            self.reload()
+        return self.version
+
+    def lookup(self, card_number):
+        self.check_reload()
+        digits = "".join(ch for ch in str(card_number or "")[:32] if ch.isdigit())
+        return self._trie.lookup(digits)
+
+_table = None
+
+def bin_table():
+    global _table
+    if _table is None:
+        _table = BinTable()
+    return _table
+
+def detect_brand(card_number):
+    """(marca, tipo) de un número de tarjeta o BIN."""
+    return bin_table().lookup(card_number)
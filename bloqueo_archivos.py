@@ -0,0 +1,98 @@
+# bloqueo_archivos.py
+# Candado entre procesos sobre un archivo ".lock" (msvcrt en Windows, fcntl en POSIX).
+# El panel abre cada módulo como un proceso aparte, así que los archivos que varios
+# escriben (audit log, cartera, bóvedas) se modifican siempre con el candado tomado:
+#
+#   with bloqueo(ruta + ".lock"):
+#       releer, modificar, escribir
+#
+# Una instancia por ruta y proceso (bloqueo() la reutiliza); es reentrante dentro del
+# mismo hilo y excluye a los demás hilos del proceso con un RLock.
+
+import os
+import time
+import threading
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+LOCK_TIMEOUT = 30.0
+_POLL = 0.01
+
+class BloqueoArchivo:
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._f = None
+
+    def _lock_file(self):
+        f = open(self.path, "a+b")
+        limite = time.monotonic() + self.timeout
+        while True:
+            try:
+                if msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._f = f
+                return
+            except OSError:
+                if time.monotonic() >= limite:
+                    f.close()
+                    raise TimeoutError(f"No se pudo tomar el candado {self.path}")
+                time.sleep(_POLL)
+
+    def _unlock_file(self):
+        f, self._f = self._f, None
+        try:
+            if msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def acquire(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._lock_file()
+            except Exception:
+                self._rlock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self._unlock_file()
+        finally:
+            self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+_bloqueos = {}
+_bloqueos_lock = threading.Lock()
+
+def bloqueo(path):
+    """Candado (compartido en el proceso) para la ruta dada."""
+    key = os.path.normcase(os.path.abspath(path))
+    with _bloqueos_lock:
+        b = _bloqueos.get(key)
+        if b is None:
+            b = _bloqueos[key] = BloqueoArchivo(path)
+        return b
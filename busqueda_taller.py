@@ -0,0 +1,179 @@
+# busqueda_taller.py
+# Búsqueda aproximada (trigramas) de productos y repuestos, sin tildes ni mayúsculas.
+# Se usa desde Inventario, Órdenes de Trabajo y Compras.
+
+import os
+import json
+import math
+import heapq
+import unicodedata
+from itertools import islice
+from collections import Counter
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+INVENTARIO_FILE = os.path.join(BASE_DIR, "inventario.json")
+
+# Trigramas presentes en más de MAX_DF del catálogo ("  p", "de ") no generan
+# candidatos en la búsqueda aproximada: solo suman puntaje a los que ya lo son.
+MAX_DF = 0.02
+MIN_DF = 200                # en catálogos pequeños todo trigrama es "raro"
+MAX_CANDIDATOS = 1000       # documentos que se puntúan/ordenan como máximo por consulta
+_VACIO = frozenset()
+
+# ==========================
+# NORMALIZACIÓN
+# ==========================
+def normalizar(texto):
+    """Minúsculas, sin tildes y solo letras/números separados por un espacio."""
+    texto = unicodedata.normalize("NFKD", str(texto or "").lower())
+    limpio = []
+    for ch in texto:
+        if unicodedata.combining(ch):
+            continue
+        limpio.append(ch if ch.isalnum() else " ")
+    return " ".join("".join(limpio).split())
+
+def trigramas(texto_normalizado):
+    """Trigramas por palabra con relleno ("  fi", " fil", ..., "ro "), estilo pg_trgm."""
+    tris = set()
+    for palabra in texto_normalizado.split():
+        p = f"  {palabra} "
+        for i in range(len(p) - 2):
+            tris.add(p[i:i + 3])
+    return tris
+
+# ==========================
+# ÍNDICE
+# ==========================
+class IndiceBusqueda:
+    """
+    Índice invertido trigrama -> ids. Se construye una vez y se actualiza con
+    agregar/quitar por documento, sin reconstruir. Las consultas trabajan
+    sobre las listas de la consulta (intersecciones y conteos de sets), nunca
+    recorren el catálogo completo.
+    """
+    def __init__(self, umbral=0.4):
+        self.umbral = umbral
+        self._docs = {}        # id -> trigramas del documento
+        self._largo = {}       # id -> largo del texto (desempate: más corto primero)
+        self._palabras = {}    # id -> palabras del documento
+        self._postings = {}    # trigrama -> set(ids)
+        self._por_palabra = {} # palabra -> set(ids) (orden de coincidencias exactas)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def agregar(self, doc_id, *textos):
+        if doc_id in self._docs:
+            self.quitar(doc_id)
+        norm = normalizar(" ".join(str(t) for t in textos if t))
+        tris = trigramas(norm)
+        self._docs[doc_id] = tris
+        self._largo[doc_id] = len(norm)
+        palabras = self._palabras[doc_id] = set(norm.split())
+        for t in tris:
+            self._postings.setdefault(t, set()).add(doc_id)
+        for p in palabras:
+            self._por_palabra.setdefault(p, set()).add(doc_id)
+
+    def quitar(self, doc_id):
+        tris = self._docs.pop(doc_id, None)
+        if tris is None:
+            return
+        del self._largo[doc_id]
+        for indice, claves in ((self._postings, tris), (self._por_palabra, self._palabras.pop(doc_id))):
+            for clave in claves:
+                ids = indice.get(clave)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del indice[clave]
+
+    def _ordenar_exactos(self, exactos, palabras, limite):
+        """
+        Primero los que contienen las palabras de la consulta completas (el código
+        exacto, "freno" antes que "frenos"), luego el resto; dentro de cada grupo
+        el texto más corto. Cada grupo se acota a MAX_CANDIDATOS.
+        """
+        largo = self._largo.__getitem__
+        # Quien tiene todas las palabras completas tiene todos sus trigramas: ya es exacto
+        listas = sorted((self._por_palabra.get(p, _VACIO) for p in palabras), key=len)
+        completas = listas[0].intersection(*listas[1:]) if len(listas) > 1 else (listas[0] if listas else _VACIO)
+        mejores = heapq.nsmallest(limite, islice(completas, MAX_CANDIDATOS), key=largo)
+        if len(mejores) < limite:
+            resto = exactos - completas if completas else exactos
+            mejores += heapq.nsmallest(limite - len(mejores), islice(resto, MAX_CANDIDATOS), key=largo)
+        return mejores
+
+    def buscar(self, consulta, limite=20):
+        """Devuelve [(id, puntaje)] ordenado de mejor a peor coincidencia (puntaje 0..1)."""
+        norm = normalizar(consulta)
+        q_tris = trigramas(norm)
+        if not q_tris:
+            return []
+        listas = sorted((self._postings.get(t, _VACIO) for t in q_tris), key=len)
+        largo = self._largo.__getitem__
+
+        # 1) Documentos que contienen todos los trigramas: intersección en C,
+        #    empezando por la lista más corta.
+        exactos = listas[0].intersection(*listas[1:]) if listas[0] else set()
+        if len(exactos) >= limite:
+            return [(doc_id, 1.0) for doc_id in self._ordenar_exactos(exactos, set(norm.split()), limite)]
+
+        # 2) Coincidencia parcial (errores de digitación): los candidatos salen de
+        #    los trigramas raros; los comunes solo suman sobre esos candidatos.
+        total = len(q_tris)
+        minimo = max(1, math.ceil(total * self.umbral))
+        corte = max(MIN_DF, int(len(self._docs) * MAX_DF))
+        raras = [ids for ids in listas if len(ids) <= corte]
+        comunes = listas[len(raras):]
+        conteo = Counter()
+        for ids in raras:
+            conteo.update(ids)
+        alcanzable = minimo - len(comunes)
+        candidatos = {d for d, c in conteo.items() if c >= alcanzable}
+        if len(candidatos) > MAX_CANDIDATOS:
+            candidatos = set(heapq.nlargest(MAX_CANDIDATOS, candidatos, key=conteo.__getitem__))
+        elif len(candidatos) < limite and comunes:
+            # Ningún trigrama raro ayuda (consulta genérica): muestra acotada de la lista común más corta
+            candidatos.update(islice(comunes[0], MAX_CANDIDATOS))
+        candidatos |= exactos
+        for ids in comunes:
+            conteo.update(candidatos.intersection(ids))
+        mejores = heapq.nsmallest(
+            limite,
+            (doc_id for doc_id in candidatos if conteo[doc_id] >= minimo),
+            key=lambda d: (-conteo[d], largo(d)),
+        )
+        return [(doc_id, round(conteo[doc_id] / total, 3)) for doc_id in mejores]
+
+# ==========================
+# FUENTES Y WIDGETS
+# ==========================
+def cargar_inventario():
+    if not os.path.exists(INVENTARIO_FILE):
+        return []
+    try:
+        with open(INVENTARIO_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+def vincular_combobox(cb, indice, valores_iniciales, limite=30):
+    """
+    Convierte un Combobox en buscador: al escribir se reemplazan sus valores por
+    los ids que mejor coinciden (los ids del índice deben ser las etiquetas).
+    """
+    cb.configure(state="normal")
+    cb["values"] = list(valores_iniciales)
+
+    def on_key(event):
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        texto = cb.get().strip()
+        if not texto:
+            cb["values"] = list(valores_iniciales)
+            return
+        cb["values"] = [doc_id for doc_id, _ in indice.buscar(texto, limite=limite)]
+
+    cb.bind("<KeyRelease>", on_key)
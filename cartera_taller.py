@@ -5,11 +5,14 @@
 
 import os
 import json
+import uuid
 from datetime import datetime, timedelta
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import openpyxl
 
+from bloqueo_archivos import bloqueo
+
 # ==========================
 # CONFIGURACIÓN
 # ==========================
@@ -65,8 +68,39 @@ def cargar_cartera():
 
 def guardar_cartera(arr):
     ensure_base_dir()
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
+    tmp = DATA_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(arr, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, DATA_FILE)
+
+def bloqueo_cartera():
+    # La pasarela (conciliación) y las ventanas de Cartera son procesos distintos
+    ensure_base_dir()
+    return bloqueo(DATA_FILE + ".lock")
+
+def actualizar_cartera(cambio=None):
+    """
+    Relee cartera.json bajo el candado, aplica cambio(registros) en sitio y guarda:
+    cada acción parte de lo que hay en disco, así no se pisan los abonos que otro
+    proceso aplicó mientras la ventana estaba abierta. Devuelve los registros.
+    """
+    with bloqueo_cartera():
+        registros = cargar_cartera()
+        sin_id = [r for r in registros if not r.get("id")]
+        for r in sin_id:
+            r["id"] = uuid.uuid4().hex
+        if cambio is not None:
+            cambio(registros)
+        if cambio is not None or sin_id:
+            guardar_cartera(registros)
+        return registros
+
+def _buscar(registros, rid):
+    return next((r for r in registros if r.get("id") == rid), None)
+
+def _recalcular(r):
+    r["saldo"] = round(r["valor_factura"] - sum(a["monto"] for a in r["abonos"]), 2)
+    r["estado"], r["dias_mora"] = calcular_estado(r["saldo"], r["vencimiento"])
 
 def exportar_excel(registros):
     ensure_base_dir()
@@ -121,7 +155,8 @@ class CarteraTallerApp:
         self.root.geometry("1150x720")
         self.root.configure(bg="#0f172a")
 
-        self.registros = cargar_cartera()
+        self.registros = actualizar_cartera()
+        self._editando = None     # id de la cuenta cargada con "Editar"
         self._setup_styles()
         self._build_ui()
         self._refresh_tree()
@@ -192,6 +227,7 @@ class CarteraTallerApp:
         ttk.Button(btn_frame, text="📄 Ver detalle", style="Menu.TButton", command=self._ver_detalle).pack(side="left", padx=6)
         ttk.Button(btn_frame, text="✏️ Editar", style="Menu.TButton", command=self._editar).pack(side="left", padx=6)
         ttk.Button(btn_frame, text="🗑️ Eliminar", style="Menu.TButton", command=self._eliminar).pack(side="left", padx=6)
+        ttk.Button(btn_frame, text="🔁 Conciliar pagos", style="Menu.TButton", command=self._conciliar_pagos).pack(side="left", padx=6)
 
     # ==========================
     # ACCIONES
@@ -206,6 +242,7 @@ class CarteraTallerApp:
             return
 
         cxc = {
+            "id": uuid.uuid4().hex,
             "fecha": datetime.now().strftime("%Y-%m-%d %H:%M"),
             "cliente": self.cliente.get().strip(),
             "documento": self.documento.get().strip(),
@@ -220,8 +257,18 @@ class CarteraTallerApp:
         }
         cxc["estado"], cxc["dias_mora"] = calcular_estado(cxc["saldo"], cxc["vencimiento"])
 
-        self.registros.append(cxc)
-        guardar_cartera(self.registros)
+        def cambio(registros):
+            previo = _buscar(registros, self._editando) if self._editando else None
+            if previo is None:
+                registros.append(cxc)
+                return
+            # Edición: se conservan id, fecha y abonos (incluidos los de la pasarela)
+            cxc.update(id=previo["id"], fecha=previo["fecha"], abonos=previo["abonos"])
+            _recalcular(cxc)
+            registros[registros.index(previo)] = cxc
+
+        self.registros = actualizar_cartera(cambio)
+        self._editando = None
         self._refresh_tree()
         self._limpiar_form()
         messagebox.showinfo("Cartera", f"CxC creada para {cxc['cliente']}.\nSaldo: ${cxc['saldo']:,}")
@@ -253,17 +300,26 @@ class CarteraTallerApp:
             except Exception:
                 messagebox.showwarning("Validación", "Monto debe ser numérico y mayor a 0.")
                 return
-            if monto > r["saldo"]:
-                messagebox.showwarning("Validación", "El abono no puede superar el saldo.")
-                return
-
-            abono = {"fecha": datetime.now().isoformat(), "monto": round(monto, 2)}
-            r["abonos"].append(abono)
-            r["saldo"] = round(r["saldo"] - monto, 2)
-            r["estado"], r["dias_mora"] = calcular_estado(r["saldo"], r["vencimiento"])
-            guardar_cartera(self.registros)
+            resultado = {}
+
+            def cambio(registros):
+                actual = _buscar(registros, r["id"])
+                if actual is None or monto > actual["saldo"]:
+                    resultado["saldo"] = None if actual is None else actual["saldo"]
+                    return
+                actual["abonos"].append({"fecha": datetime.now().isoformat(), "monto": round(monto, 2)})
+                _recalcular(actual)
+                resultado["nuevo"] = actual["saldo"]
+
+            self.registros = actualizar_cartera(cambio)
             self._refresh_tree()
-            messagebox.showinfo("Abono", f"Abono registrado: ${monto:,}. Nuevo saldo: ${r['saldo']:,}")
+            if "nuevo" not in resultado:
+                # El saldo en disco puede haber bajado por un pago conciliado desde la pasarela
+                saldo = resultado["saldo"]
+                messagebox.showwarning("Validación", "La cuenta ya no existe." if saldo is None else
+                                       f"El abono no puede superar el saldo (${saldo:,}).")
+                return
+            messagebox.showinfo("Abono", f"Abono registrado: ${monto:,}. Nuevo saldo: ${resultado['nuevo']:,}")
             top.destroy()
 
         ttk.Button(top, text="Registrar", style="Menu.TButton", command=do_abono).pack(pady=8)
@@ -328,7 +384,8 @@ class CarteraTallerApp:
         self.obs_txt.delete("1.0", "end")
         self.obs_txt.insert("1.0", r["observaciones"])
 
-        # Eliminar para reemplazar al crear
+        # Se reemplaza al crear (mismo id); mientras tanto sale de la lista
+        self._editando = r["id"]
         self.registros.pop(idx)
         self._refresh_tree()
 
@@ -339,11 +396,27 @@ class CarteraTallerApp:
             return
         idx = self.tree.index(sel[0])
         if messagebox.askyesno("Confirmar", "¿Eliminar la cuenta seleccionada?"):
-            self.registros.pop(idx)
-            guardar_cartera(self.registros)
+            rid = self.registros[idx]["id"]
+
+            def cambio(registros):
+                registros[:] = [x for x in registros if x.get("id") != rid]
+
+            self.registros = actualizar_cartera(cambio)
             self._refresh_tree()
             messagebox.showinfo("Eliminado", "Cuenta eliminada.")
 
+    def _conciliar_pagos(self):
+        # Import diferido: conciliacion_pagos importa este módulo
+        from conciliacion_pagos import conciliar, resumen
+        try:
+            resultado = conciliar()
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo conciliar: {e}")
+            return
+        self.registros = resultado["registros"]
+        self._refresh_tree()
+        messagebox.showinfo("Conciliación", resumen(resultado))
+
     def _exportar(self):
         if not self.registros:
             messagebox.showwarning("Sin datos", "No hay registros para exportar.")
@@ -355,6 +428,7 @@ class CarteraTallerApp:
             messagebox.showerror("Error", f"No se pudo exportar: {e}")
 
     def _limpiar_form(self):
+        self._editando = None
         self.cliente.set("")
         self.documento.set("")
         self.referencia.set("")
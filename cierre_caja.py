@@ -0,0 +1,131 @@
+# cierre_caja.py
+# Liquidación diaria de la pasarela: totales por día y método que se actualizan en
+# cada save_transaction (sin releer el historial) y cierre de caja con efectivo
+# esperado. Los cierres se guardan como una línea JSON compacta por día cerrado.
+
+import os
+import json
+from datetime import datetime
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+SETTLEMENT_FILE = os.path.join(BASE_DIR, "liquidacion_diaria.json")
+CLOSES_FILE = os.path.join(BASE_DIR, "cierres_caja.jsonl")
+
+CASH_METHOD = "Efectivo"
+STATUSES = ("approved", "declined", "error")
+
+def _dia(tx):
+    return (tx.get("time") or "")[:10] or datetime.now().date().isoformat()
+
+def _acumular(dias, tx):
+    metodo = tx.get("method") or "Otro"
+    status = tx.get("status") if tx.get("status") in STATUSES else "error"
+    t = dias.setdefault(_dia(tx), {}).setdefault(metodo, {"approved": 0, "declined": 0, "error": 0, "amount_approved": 0.0})
+    t[status] += 1
+    if status == "approved":
+        t["amount_approved"] = round(t["amount_approved"] + float(tx.get("amount") or 0), 2)
+
+def _load():
+    if not os.path.exists(SETTLEMENT_FILE):
+        return None
+    try:
+        with open(SETTLEMENT_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _save(state):
+    tmp = SETTLEMENT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, SETTLEMENT_FILE)
+
+def reconstruir(transacciones):
+    """Recalcula los totales desde el historial completo (primera vez o si hay desfase)."""
+    dias = {}
+    for tx in transacciones:
+        _acumular(dias, tx)
+    state = {"tx_count": len(transacciones), "dias": dias}
+    _save(state)
+    return state
+
+# ==========================
+# TOTALES EN LÍNEA
+# ==========================
+def registrar(nuevas, todas):
+    """
+    Llamado tras guardar: suma solo las transacciones nuevas. tx_count detecta si
+    transactions.json cambió por fuera (p. ej. restaurado) y entonces se reconstruye.
+    """
+    state = _load()
+    if state is None or state.get("tx_count") != len(todas) - len(nuevas):
+        return reconstruir(todas)
+    for tx in nuevas:
+        _acumular(state["dias"], tx)
+    state["tx_count"] = len(todas)
+    _save(state)
+    return state
+
+def totales_dia(fecha, transacciones_loader=None):
+    state = _load()
+    if state is None and transacciones_loader is not None:
+        state = reconstruir(transacciones_loader())
+    return (state or {}).get("dias", {}).get(fecha, {})
+
+# ==========================
+# CIERRE
+# ==========================
+def reporte_cierre(fecha, por_metodo, base_inicial=0.0, efectivo_contado=None):
+    aprobados = sum(t["approved"] for t in por_metodo.values())
+    rechazados = sum(t["declined"] for t in por_metodo.values())
+    errores = sum(t["error"] for t in por_metodo.values())
+    total = round(sum(t["amount_approved"] for t in por_metodo.values()), 2)
+    efectivo = por_metodo.get(CASH_METHOD, {}).get("amount_approved", 0.0)
+    esperado = round(base_inicial + efectivo, 2)
+    reporte = {
+        "fecha": fecha,
+        "por_metodo": por_metodo,
+        "aprobados": aprobados,
+        "rechazados": rechazados,
+        "errores": errores,
+        "total_aprobado": total,
+        "base_inicial": round(base_inicial, 2),
+        "efectivo_esperado": esperado,
+    }
+    if efectivo_contado is not None:
+        reporte["efectivo_contado"] = round(efectivo_contado, 2)
+        reporte["diferencia"] = round(efectivo_contado - esperado, 2)
+    return reporte
+
+def texto_reporte(rep):
+    lines = [f"Cierre del {rep['fecha']}",
+             f"Aprobados: {rep['aprobados']}  |  Rechazados: {rep['rechazados']}  |  Errores: {rep['errores']}",
+             f"Total aprobado: ${rep['total_aprobado']:,.2f}", "", "Por método:"]
+    for metodo, t in sorted(rep["por_metodo"].items()):
+        lines.append(f"• {metodo}: {t['approved']} aprob. / {t['declined']} rech. / {t['error']} err.  ${t['amount_approved']:,.2f}")
+    lines += ["", f"Base inicial: ${rep['base_inicial']:,.2f}",
+              f"Efectivo esperado en caja: ${rep['efectivo_esperado']:,.2f}"]
+    if "efectivo_contado" in rep:
+        lines.append(f"Efectivo contado: ${rep['efectivo_contado']:,.2f}  |  Diferencia: ${rep['diferencia']:,.2f}")
+    if rep.get("cerrado_en"):
+        lines.append(f"Cerrado: {rep['cerrado_en']} por {rep.get('usuario') or '-'}")
+    return "\n".join(lines)
+
+def guardar_cierre(reporte, usuario=None):
+    snap = dict(reporte, cerrado_en=datetime.now().isoformat(timespec="seconds"), usuario=usuario)
+    with open(CLOSES_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(snap, ensure_ascii=False, separators=(",", ":")) + "\n")
+    return snap
+
+def historial_cierres():
+    """Último cierre por fecha (un día puede re-cerrarse; gana el más reciente)."""
+    cierres = {}
+    if os.path.exists(CLOSES_FILE):
+        with open(CLOSES_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    c = json.loads(line)
+                    cierres[c["fecha"]] = c
+                except Exception:
+                    continue
+    return [cierres[k] for k in sorted(cierres, reverse=True)]
@@ -10,6 +10,8 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import openpyxl
 
+from busqueda_taller import IndiceBusqueda, cargar_inventario, vincular_combobox
+
 # ==========================
 # CONFIGURACIÓN
 # ==========================
@@ -30,6 +32,14 @@ CATALOGO = [
     {"codigo": "LIQ-FRE", "nombre": "Líquido de frenos", "precio": 28000},
 ]
 
+def catalogo_compras():
+    """Catálogo fijo + productos del inventario, por etiqueta "código - nombre"."""
+    por_etiqueta = {f'{x["codigo"]} - {x["nombre"]}': x for x in CATALOGO}
+    for p in cargar_inventario():
+        item = {"codigo": p.get("Código", ""), "nombre": p.get("Producto", ""), "precio": p.get("Precio Unitario", 0)}
+        por_etiqueta.setdefault(f'{item["codigo"]} - {item["nombre"]}', item)
+    return por_etiqueta
+
 # ==========================
 # PERSISTENCIA
 # ==========================
@@ -129,6 +139,11 @@ class ComprasTallerApp:
         self.compras = cargar_compras()
         self.items_seleccionados = []
 
+        self.catalogo = catalogo_compras()
+        self.indice_catalogo = IndiceBusqueda()
+        for etiqueta in self.catalogo:
+            self.indice_catalogo.agregar(etiqueta, etiqueta)
+
         self._setup_styles()
         self._build_ui()
         self._refresh_tree()
@@ -183,8 +198,9 @@ class ComprasTallerApp:
 
         # Ítems
         ttk.Label(left, text="Ítem catálogo").grid(row=len(rows)+2, column=0, sticky="e", padx=8, pady=6)
-        self.item_cb = ttk.Combobox(left, values=[f'{x["codigo"]} - {x["nombre"]}' for x in CATALOGO], state="readonly", width=26)
+        self.item_cb = ttk.Combobox(left, values=list(self.catalogo), width=26)
         self.item_cb.grid(row=len(rows)+2, column=1, sticky="w", padx=8, pady=6)
+        vincular_combobox(self.item_cb, self.indice_catalogo, list(self.catalogo))
         self.item_cb.current(0)
 
         ttk.Label(left, text="Cantidad").grid(row=len(rows)+3, column=0, sticky="e", padx=8, pady=6)
@@ -227,8 +243,15 @@ class ComprasTallerApp:
             return
 
         sel = self.item_cb.get()
-        codigo = sel.split(" - ")[0]
-        item = next((x for x in CATALOGO if x["codigo"] == codigo), None)
+        item = self.catalogo.get(sel)
+        if item is None and sel.strip():
+            # Texto libre: la mejor coincidencia solo se agrega si el usuario la confirma
+            mejor = self.indice_catalogo.buscar(sel, limite=1)
+            if mejor and messagebox.askyesno("Catálogo", f"«{sel}» no está en la lista.\n¿Agregar «{mejor[0][0]}»?"):
+                self.item_cb.set(mejor[0][0])
+                item = self.catalogo.get(mejor[0][0])
+            elif mejor:
+                return
         if not item:
             messagebox.showwarning("Catálogo", "Ítem no encontrado.")
             return
@@ -353,6 +376,7 @@ class ComprasTallerApp:
         self.items_seleccionados = []
         self.items_list.delete(0, tk.END)
         self.cantidad_var.set("1")
+        self.item_cb["values"] = list(self.catalogo)
         self.item_cb.current(0)
 
 # ==========================
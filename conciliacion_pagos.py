@@ -0,0 +1,271 @@
+# conciliacion_pagos.py
+# Conciliación automática de pagos aprobados (transactions.json) contra cuentas por
+# cobrar abiertas (cartera.json). Los abonos se aplican en una sola escritura y cada
+# aplicación queda en un libro de conciliación (JSONL de solo-anexar), que además
+# evita aplicar dos veces la misma transacción. cartera.json se relee y se guarda
+# con el candado de cartera_taller (la ventana de Cartera corre en otro proceso).
+#
+# Corte: los pagos anteriores a la primera conciliación ya se digitaron a mano como
+# abonos, así que la primera corrida anota en el libro {"corte": fecha} y desde ahí
+# solo se concilian pagos con "time" igual o posterior. fijar_corte() lo mueve.
+# Solo se aplica con cliente + referencia o cliente + monto exacto; el abono a las
+# facturas más antiguas del cliente (REGLA_FIFO) es opcional y va apagado.
+
+import os
+import re
+import json
+from datetime import datetime
+from functools import lru_cache
+
+from busqueda_taller import normalizar
+from cartera_taller import cargar_cartera, guardar_cartera, calcular_estado, actualizar_cartera, bloqueo_cartera
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+TRANSACTIONS_FILE = os.path.join(BASE_DIR, "transactions.json")
+LEDGER_FILE = os.path.join(BASE_DIR, "conciliaciones.jsonl")
+
+# Reglas, de la más a la menos segura
+REGLA_REFERENCIA = "referencia"      # mismo cliente y referencia de factura
+REGLA_MONTO = "cliente+monto"        # mismo cliente y saldo idéntico al pago
+REGLA_FIFO = "cliente (antigüedad)"  # abono a las facturas más antiguas del cliente
+CONCILIAR_FIFO = False               # sin referencia ni monto exacto: a revisión (sin_conciliar)
+
+# Los nombres de cliente se repiten mucho: se normalizan (sin tildes) una sola vez
+_cliente = lru_cache(maxsize=4096)(normalizar)
+
+def _ref(texto):
+    # Referencias de factura: "F-0012", "f 0012" y "F0012" son la misma
+    return re.sub(r"[\W_]+", "", str(texto or "").lower())
+
+def _centavos(valor):
+    return int(round(float(valor or 0) * 100))
+
+def _load_transactions():
+    if not os.path.exists(TRANSACTIONS_FILE):
+        return []
+    try:
+        with open(TRANSACTIONS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+# ==========================
+# LIBRO DE CONCILIACIÓN
+# ==========================
+def cargar_libro():
+    if not os.path.exists(LEDGER_FILE):
+        return []
+    entradas = []
+    with open(LEDGER_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entradas.append(json.loads(line))
+            except Exception:
+                continue
+    return entradas
+
+_libro = {"pos": 0, "ids": set(), "corte": None}   # tx_id y corte del libro, y hasta qué byte se leyó
+
+def transacciones_conciliadas():
+    """
+    tx_id ya aplicados. El libro solo crece: cada llamada lee lo anexado desde la
+    anterior, no el archivo completo (el set devuelto es el caché: no modificarlo).
+    """
+    try:
+        size = os.path.getsize(LEDGER_FILE)
+    except OSError:
+        size = 0
+    if size < _libro["pos"]:
+        _libro.update(pos=0, ids=set(), corte=None)     # reemplazado o truncado: se relee
+    if size > _libro["pos"]:
+        with open(LEDGER_FILE, "rb") as f:
+            f.seek(_libro["pos"])
+            data = f.read(size - _libro["pos"])
+        completo = data.rfind(b"\n") + 1   # una línea a medio escribir se lee la próxima vez
+        for line in data[:completo].splitlines():
+            try:
+                entrada = json.loads(line)
+                if "corte" in entrada:
+                    _libro["corte"] = entrada["corte"]      # el último manda
+                else:
+                    _libro["ids"].add(entrada["tx_id"])
+            except Exception:
+                continue
+        _libro["pos"] += completo
+    return _libro["ids"]
+
+def corte_actual():
+    """Fecha ISO desde la que se concilian pagos (None: aún no se ha conciliado)."""
+    transacciones_conciliadas()
+    return _libro["corte"]
+
+def fijar_corte(desde):
+    """Concilia solo pagos con "time" >= desde (fecha ISO). Queda anotado en el libro."""
+    with bloqueo_cartera():
+        _anexar_libro([{"corte": desde, "fecha": datetime.now().isoformat()}])
+
+def _anexar_libro(entradas):
+    if not entradas:
+        return
+    with open(LEDGER_FILE, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entradas))
+
+# ==========================
+# ÍNDICES SOBRE CARTERA
+# ==========================
+class IndiceCartera:
+    """
+    Índices hash sobre las facturas con saldo:
+      (cliente, referencia) -> posición
+      (cliente, saldo en centavos) -> [posiciones]
+      cliente -> [posiciones] por vencimiento (más antigua primero)
+    Se actualizan en cada abono, así una corrida de N pagos cuesta O(N).
+    """
+    def __init__(self, registros):
+        self.registros = registros
+        self.por_ref = {}
+        self.por_monto = {}
+        self.por_cliente = {}
+        abiertas = [(r.get("vencimiento") or "", i) for i, r in enumerate(registros) if r.get("saldo", 0) > 0]
+        for _, i in sorted(abiertas):
+            r = registros[i]
+            cliente = _cliente(r.get("cliente") or "")
+            ref = _ref(r.get("referencia"))
+            if ref:
+                self.por_ref.setdefault((cliente, ref), i)
+            self.por_monto.setdefault((cliente, _centavos(r["saldo"])), []).append(i)
+            self.por_cliente.setdefault(cliente, []).append(i)
+
+    def por_referencia(self, cliente, ref):
+        i = self.por_ref.get((cliente, ref))
+        return i if i is not None and self.registros[i]["saldo"] > 0 else None
+
+    def por_saldo(self, cliente, monto):
+        candidatos = self.por_monto.get((cliente, _centavos(monto)))
+        return candidatos[0] if candidatos else None
+
+    def abiertas_cliente(self, cliente):
+        return [i for i in self.por_cliente.get(cliente, []) if self.registros[i]["saldo"] > 0]
+
+    def abonar(self, i, monto):
+        r = self.registros[i]
+        cliente = _cliente(r.get("cliente") or "")
+        lista = self.por_monto.get((cliente, _centavos(r["saldo"])))
+        if lista and i in lista:
+            lista.remove(i)
+        r["saldo"] = round(r["saldo"] - monto, 2)
+        if r["saldo"] > 0:
+            self.por_monto.setdefault((cliente, _centavos(r["saldo"])), []).append(i)
+        else:
+            self.por_cliente[cliente].remove(i)
+
+# ==========================
+# MOTOR
+# ==========================
+def conciliar(transacciones=None, registros=None, guardar=True, fifo=None):
+    """
+    Aplica como abonos los pagos aprobados posteriores al corte que aún no están en
+    el libro. Sin corte anotado, se fija en el pago más antiguo de `transacciones`
+    (pagos recién cobrados) o, si se concilia todo transactions.json, en este momento.
+    transacciones: lista a conciliar (por defecto todo transactions.json).
+    registros: cartera ya cargada; se modifica en sitio. Por defecto cartera.json se
+    relee, se concilia y se guarda (cartera y luego libro) con el candado tomado.
+    fifo: abonar a las facturas más antiguas cuando solo coincide el cliente
+    (por defecto CONCILIAR_FIFO).
+    Devuelve {"aplicadas": [entradas del libro], "sin_conciliar": [tx], "registros": cartera, "corte": fecha}.
+    """
+    if transacciones is None:
+        transacciones = _load_transactions()
+        inicial = datetime.now().isoformat()
+    else:
+        inicial = min((t.get("time") or "" for t in transacciones), default="") or datetime.now().isoformat()
+    fifo = CONCILIAR_FIFO if fifo is None else fifo
+    if registros is not None:
+        return _conciliar(transacciones, registros, guardar, inicial, fifo)
+    if not guardar:
+        return _conciliar(transacciones, cargar_cartera(), False, inicial, fifo)
+    with bloqueo_cartera():
+        return _conciliar(transacciones, actualizar_cartera(), True, inicial, fifo)
+
+def _conciliar(transacciones, registros, guardar, inicial, fifo):
+    # Un corte entre guardar cartera y anexar al libro deja el abono (con su tx_id)
+    # en cartera: también cuenta como aplicado y no se repite
+    ya = transacciones_conciliadas() | {a["tx_id"] for r in registros for a in r.get("abonos", ()) if a.get("tx_id")}
+    corte = _libro["corte"]
+    nuevo_corte = corte is None
+    if nuevo_corte:
+        corte = inicial
+    indice = IndiceCartera(registros)
+    ahora = datetime.now().isoformat()
+    entradas, sin_conciliar, tocadas = [], [], set()
+
+    for tx in transacciones:
+        if tx.get("status") != "approved" or not tx.get("id") or tx["id"] in ya:
+            continue
+        if (tx.get("time") or "") < corte:
+            continue                                      # anterior al corte: ya se digitó a mano
+        cliente = _cliente(tx.get("cliente") or "")
+        monto = round(float(tx.get("amount") or 0), 2)
+        ref = _ref((tx.get("extra") or {}).get("ref"))
+        if not cliente or monto <= 0:
+            sin_conciliar.append(tx)
+            continue
+
+        # Factura destino por regla; FIFO puede repartir el pago entre varias
+        i = indice.por_referencia(cliente, ref) if ref else None
+        if i is not None:
+            destinos, regla = [i], REGLA_REFERENCIA
+        else:
+            i = indice.por_saldo(cliente, monto)
+            if i is not None:
+                destinos, regla = [i], REGLA_MONTO
+            elif fifo:
+                destinos, regla = indice.abiertas_cliente(cliente), REGLA_FIFO
+            else:
+                destinos = []
+        if not destinos:
+            sin_conciliar.append(tx)
+            continue
+
+        restante = monto
+        for i in destinos:
+            if restante <= 0:
+                break
+            r = registros[i]
+            aplicado = round(min(restante, r["saldo"]), 2)
+            r.setdefault("abonos", []).append({"fecha": ahora, "monto": aplicado, "origen": "pasarela", "tx_id": tx["id"]})
+            indice.abonar(i, aplicado)
+            r["estado"], r["dias_mora"] = calcular_estado(r["saldo"], r["vencimiento"])
+            tocadas.add(i)
+            restante = round(restante - aplicado, 2)
+            entradas.append({"fecha": ahora, "tx_id": tx["id"], "cliente": tx.get("cliente"), "referencia": r.get("referencia"),
+                             "documento": r.get("documento"), "monto": aplicado, "regla": regla,
+                             "saldo_restante": r["saldo"], "metodo": tx.get("method")})
+        if restante > 0:
+            # Pago mayor que el saldo del cliente: el excedente queda anotado como saldo a favor
+            entradas.append({"fecha": ahora, "tx_id": tx["id"], "cliente": tx.get("cliente"), "referencia": None,
+                             "documento": None, "monto": restante, "regla": "excedente", "saldo_restante": None,
+                             "metodo": tx.get("method")})
+        ya.add(tx["id"])
+
+    if guardar and nuevo_corte:
+        entradas_libro = [{"corte": corte, "fecha": ahora}] + entradas
+    else:
+        entradas_libro = entradas if guardar else []
+    if entradas_libro:
+        if tocadas:
+            guardar_cartera(registros)
+        _anexar_libro(entradas_libro)
+    return {"aplicadas": entradas, "sin_conciliar": sin_conciliar, "registros": registros, "corte": corte}
+
+def resumen(resultado):
+    aplicadas = resultado["aplicadas"]
+    por_regla = {}
+    for e in aplicadas:
+        por_regla[e["regla"]] = por_regla.get(e["regla"], 0) + e["monto"]
+    lineas = [f"Abonos aplicados: {len(aplicadas)}  |  Pagos sin conciliar (a revisar): {len(resultado['sin_conciliar'])}"]
+    if resultado.get("corte"):
+        lineas.append(f"Solo pagos desde {resultado['corte'][:16].replace('T', ' ')} (los anteriores se digitaron a mano)")
+    for regla, total in por_regla.items():
+        lineas.append(f"• {regla}: ${total:,.2f}")
+    return "\n".join(lineas)
@@ -0,0 +1,199 @@
+# contrasenas_filtradas.py
+# Chequeo offline de contraseñas filtradas/comunes con un filtro de Bloom en disco.
+# El filtro se construye una vez a partir de una lista local (texto plano, una por
+# línea, o el volcado SHA-1 de Pwned Passwords "HASH:conteo") y se abre con mmap:
+# cada consulta lee k bytes del archivo (microsegundos) y solo quedan en RAM las
+# páginas tocadas. Falsos positivos acotados por FP_RATE; nunca falsos negativos.
+#
+#   python contrasenas_filtradas.py construir rockyou.txt
+#   python contrasenas_filtradas.py construir pwned-passwords-sha1-ordered-by-hash.txt --sha1
+#   python contrasenas_filtradas.py probar "Taller2025"
+#
+# Formato: cabecera HEADER (magia, versión, m bits, k, n) + m bits (LSB primero).
+# Las posiciones salen del SHA-1 de la contraseña (doble hashing h1 + i*h2 mod 2^64).
+
+import os
+import sys
+import mmap
+import math
+import time
+import struct
+import hashlib
+import threading
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+FILTRO_FILE = os.path.join(BASE_DIR, "contrasenas_filtradas.bloom")
+
+MAGIC = b"TALLERBF"
+VERSION = 1
+HEADER = struct.Struct("<8sIQIQ")
+FP_RATE = 0.001
+CHUNK = 1_000_000              # contraseñas por bloque al construir (numpy)
+_MASK64 = (1 << 64) - 1
+
+# Siempre se revisan, aunque no exista el archivo del filtro
+COMUNES = frozenset("""
+123456 123456789 12345678 12345 1234567 1234567890 123123 111111 000000 654321
+qwerty qwerty123 abc123 password password1 admin admin123 root toor welcome
+iloveyou letmein dragon monkey football baseball superman batman 1q2w3e4r
+contraseña contrasena clave clave123 hola123 hola1234 colombia colombia123
+bogota medellin taller taller123 mecanica mecanica123 usuario usuario123
+""".split())
+
+def _digest(password):
+    return hashlib.sha1(password.encode("utf-8")).digest()
+
+def dimensionar(n, fp=FP_RATE):
+    """(m bits, k funciones) óptimos para n elementos con tasa de falsos positivos fp."""
+    n = max(1, n)
+    m = max(64, math.ceil(-n * math.log(fp) / (math.log(2) ** 2)))
+    k = max(1, round(m / n * math.log(2)))
+    return m, k
+
+class FiltroBloom:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.m, self.k, self.n = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path}: no es un filtro de contraseñas válido")
+            if len(self._mm) < HEADER.size + (self.m + 7) // 8:
+                raise ValueError(f"{path}: archivo truncado")
+        except Exception:
+            self._file.close()
+            raise
+
+    def contiene(self, digest):
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        mm, m, off = self._mm, self.m, HEADER.size
+        for i in range(self.k):
+            bit = ((h1 + i * h2) & _MASK64) % m
+            if not (mm[off + (bit >> 3)] >> (bit & 7)) & 1:
+                return False
+        return True
+
+    def __contains__(self, password):
+        return self.contiene(_digest(password))
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+# ==========================
+# CONSTRUCCIÓN
+# ==========================
+def _digests(origen, sha1):
+    with open(origen, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            if sha1:
+                try:
+                    yield bytes.fromhex(line.split(":", 1)[0])
+                except ValueError:
+                    continue
+            else:
+                yield _digest(line)
+
+def construir(origen, destino=None, fp=FP_RATE, sha1=False, progreso=None):
+    """
+    Construye el filtro desde una lista local (dos pasadas: contar y cargar).
+    sha1=True para volcados de hashes SHA-1 en hexadecimal. Devuelve estadísticas.
+    """
+    import numpy as np        # solo al construir; las consultas no lo necesitan
+
+    destino = destino or FILTRO_FILE
+    t0 = time.perf_counter()
+    n = sum(1 for _ in _digests(origen, sha1))
+    m, k = dimensionar(n, fp)
+    bits = np.zeros((m + 7) // 8, dtype=np.uint8)   # empaquetado como en disco: m/8 bytes en RAM
+    m64 = np.uint64(m)
+    tres, siete, uno = np.uint64(3), np.uint64(7), np.uint64(1)
+    hechos = 0
+
+    def cargar(buf):
+        d = np.frombuffer(b"".join(buf), dtype=np.uint8).reshape(-1, 20)
+        h1 = d[:, :8].copy().view(">u8").ravel().astype(np.uint64)
+        h2 = d[:, 8:16].copy().view(">u8").ravel().astype(np.uint64) | np.uint64(1)
+        for i in range(k):
+            bit = (h1 + np.uint64(i) * h2) % m64           # uint64: mismo mod 2^64 que la consulta
+            # Mismo orden que contiene(): byte bit >> 3, máscara 1 << (bit & 7) (LSB primero)
+            np.bitwise_or.at(bits, (bit >> tres).astype(np.intp), (uno << (bit & siete)).astype(np.uint8))
+
+    buf = []
+    for digest in _digests(origen, sha1):
+        buf.append(digest)
+        if len(buf) == CHUNK:
+            cargar(buf)
+            hechos += len(buf)
+            buf = []
+            if progreso:
+                progreso(hechos, n)
+    if buf:
+        cargar(buf)
+        hechos += len(buf)
+
+    tmp = destino + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, m, k, hechos))
+        bits.tofile(f)
+    os.replace(tmp, destino)
+    return {"n": hechos, "m": m, "k": k, "mb": round(os.path.getsize(destino) / 1e6, 1),
+            "segundos": round(time.perf_counter() - t0, 1)}
+
+# ==========================
+# CONSULTA
+# ==========================
+_filtro = None
+_filtro_mtime = None
+_filtro_lock = threading.Lock()   # la UI lo precarga en un hilo
+
+def filtro():
+    """Filtro abierto (se reabre si el archivo cambió); None si no se ha construido."""
+    global _filtro, _filtro_mtime
+    try:
+        mtime = os.path.getmtime(FILTRO_FILE)
+    except OSError:
+        return None
+    if _filtro is not None and mtime == _filtro_mtime:
+        return _filtro
+    with _filtro_lock:
+        if _filtro is None or mtime != _filtro_mtime:
+            try:
+                nuevo = FiltroBloom(FILTRO_FILE)
+            except (OSError, ValueError):
+                return _filtro
+            # El anterior no se cierra: otro hilo puede estar consultándolo
+            _filtro, _filtro_mtime = nuevo, mtime
+    return _filtro
+
+def esta_filtrada(password):
+    """True si la contraseña (o su versión en minúsculas) es común o está en el filtro."""
+    if not password:
+        return False
+    lower = password.lower()
+    if lower in COMUNES:
+        return True
+    f = filtro()
+    if f is None:
+        return False
+    return password in f or (lower != password and lower in f)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == "construir":
+        stats = construir(args[1], sha1="--sha1" in args,
+                          progreso=lambda h, n: print(f"  {h}/{n}", file=sys.stderr))
+        print(f"Filtro: {stats['n']} contraseñas, {stats['m']} bits, k={stats['k']}, "
+              f"{stats['mb']} MB en {stats['segundos']} s -> {FILTRO_FILE}")
+    elif len(args) == 2 and args[0] == "probar":
+        t0 = time.perf_counter()
+        res = esta_filtrada(args[1])
+        print(f"{'FILTRADA' if res else 'no encontrada'} ({(time.perf_counter() - t0) * 1e6:.0f} µs)")
+    else:
+        print("uso: python contrasenas_filtradas.py construir <lista> [--sha1] | probar <contraseña>")
+        sys.exit(2)
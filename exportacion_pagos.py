@@ -0,0 +1,131 @@
+# exportacion_pagos.py
+# Exportación de transacciones por flujo (XLSX write-only o CSV) con progreso por
+# bloques, cancelable, y salida cifrada opcional: el archivo se escribe como bloques
+# Fernet (uno por línea) y el contenido en claro nunca toca el disco.
+
+import io
+import csv
+import json
+
+CHUNK_ROWS = 5000             # filas entre reportes de progreso
+CHUNK_BYTES = 1024 * 1024     # tamaño de cada bloque cifrado
+ENCRYPTED_HEADER = b"TALLER-EXPORT-FERNET-v1\n"
+ENCRYPTED_SUFFIX = ".enc"
+
+BASE_COLUMNS = [("id", "ID"), ("cliente", "Cliente"), ("amount", "Monto"), ("method", "Método"),
+                ("status", "Estado"), ("message", "Mensaje"), ("time", "Fecha"), ("card_mask", "Tarjeta/Ref")]
+# Campos de "extra" como columnas propias (sin json.dumps por fila)
+EXTRA_COLUMNS = [("bank", "Banco"), ("account_type", "Tipo cuenta"), ("doc", "Documento"), ("provider", "Billetera"),
+                 ("phone", "Celular"), ("ref", "Referencia"), ("note", "Nota")]
+_EXTRA_KEYS = {k for k, _ in EXTRA_COLUMNS}
+
+HEADERS = [h for _, h in BASE_COLUMNS] + [h for _, h in EXTRA_COLUMNS] + ["Extra"]
+
+def row_values(tx):
+    extra = tx.get("extra") or {}
+    values = [tx.get(k) for k, _ in BASE_COLUMNS]
+    values += [extra.get(k) for k, _ in EXTRA_COLUMNS]
+    # Solo las llaves no previstas se serializan, y solo si existen
+    rest = {k: v for k, v in extra.items() if k not in _EXTRA_KEYS}
+    values.append(json.dumps(rest, ensure_ascii=False) if rest else None)
+    return values
+
+# ==========================
+# SALIDA CIFRADA
+# ==========================
+class FernetChunkWriter(io.RawIOBase):
+    """
+    Archivo binario de solo escritura: acumula hasta CHUNK_BYTES y escribe cada
+    bloque como un token Fernet en su propia línea. Memoria acotada a un bloque.
+    No es "seekable", así que zipfile (XLSX) escribe en modo flujo.
+    """
+    def __init__(self, path, fernet, chunk_bytes=CHUNK_BYTES):
+        self._f = open(path, "wb")
+        self._f.write(ENCRYPTED_HEADER)
+        self._fernet = fernet
+        self._chunk = chunk_bytes
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        while len(self._buf) >= self._chunk:
+            self._emit(bytes(self._buf[:self._chunk]))
+            del self._buf[:self._chunk]
+        return len(data)
+
+    def _emit(self, block):
+        self._f.write(self._fernet.encrypt(block) + b"\n")
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buf:
+            self._emit(bytes(self._buf))
+            self._buf.clear()
+        self._f.close()
+        super().close()
+
+def decrypt_export(src_path, dst_path, fernet):
+    """Descifra bloque a bloque un archivo generado con FernetChunkWriter."""
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        if src.readline() != ENCRYPTED_HEADER:
+            raise ValueError("El archivo no es una exportación cifrada del taller.")
+        for line in src:
+            line = line.strip()
+            if line:
+                dst.write(fernet.decrypt(line))
+
+# ==========================
+# EXPORTACIÓN
+# ==========================
+class ExportCancelled(Exception):
+    pass
+
+def export_transactions(rows, path, fmt="xlsx", fernet=None, progress=None, cancel=None):
+    """
+    rows: iterable de transacciones (se consume una vez, sin materializar).
+    fmt: "xlsx" (openpyxl write-only) o "csv". Con fernet, la salida va cifrada a path.
+    progress(n) se llama cada CHUNK_ROWS filas; cancel es un threading.Event.
+    Devuelve el número de filas exportadas.
+    """
+    raw = FernetChunkWriter(path, fernet) if fernet is not None else open(path, "wb")
+    n = 0
+    try:
+        if fmt == "csv":
+            text = io.TextIOWrapper(io.BufferedWriter(raw) if fernet is not None else raw,
+                                    encoding="utf-8-sig", newline="")
+            writer = csv.writer(text)
+            writer.writerow(HEADERS)
+            for tx in rows:
+                writer.writerow(row_values(tx))
+                n += 1
+                if n % CHUNK_ROWS == 0:
+                    if cancel is not None and cancel.is_set():
+                        raise ExportCancelled()
+                    if progress:
+                        progress(n)
+            text.close()
+        else:
+            import openpyxl   # solo para XLSX: Seguridad usa este módulo para CSV cifrado
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet("Transacciones")
+            ws.append(HEADERS)
+            for tx in rows:
+                ws.append(row_values(tx))
+                n += 1
+                if n % CHUNK_ROWS == 0:
+                    if cancel is not None and cancel.is_set():
+                        raise ExportCancelled()
+                    if progress:
+                        progress(n)
+            wb.save(raw)
+            raw.close()
+    finally:
+        if not raw.closed:
+            raw.close()
+    if progress:
+        progress(n)
+    return n
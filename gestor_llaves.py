@@ -0,0 +1,443 @@
+# gestor_llaves.py
+# Gestión de llaves compartida por la pasarela de pagos y el módulo de Seguridad.
+# Cifrado de sobre: cada almacén ("pagos", "credenciales") tiene su propia clave de
+# datos (Fernet) y master_auth.json guarda solo esas claves envueltas con la KEK que
+# sale de la contraseña maestra (PBKDF2 -> HKDF). Cambiar la maestra re-envuelve las
+# claves de datos (unos bytes por almacén): los registros de las bóvedas no se tocan.
+#
+# master_auth.json v3:
+#   {"version": 3, "salt", "iterations", "verifier",
+#    "keys": {"pagos": {"wrapped": "...", "created_at": "..."}, ...}, "rotated_at": ...}
+# v2 (una sola "wrapped_key") pasa a ser la clave de "pagos"; v1 se migra como antes.
+# security.key (llave en claro del módulo de Seguridad) se adopta como clave de
+# "credenciales" al desbloquear y se borra del disco.
+# Pasarela y Seguridad son procesos aparte: toda lectura-modificación-escritura de
+# master_auth.json se hace con el candado "master_auth.json.lock" (bloqueo_archivos).
+
+import os
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+import tkinter as tk
+from tkinter import ttk, messagebox, simpledialog
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives import hashes
+
+from security_core import audit
+from bloqueo_archivos import bloqueo
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+MASTER_FILE = os.path.join(BASE_DIR, "master_auth.json")
+LEGACY_KEY_FILE = os.path.join(BASE_DIR, "security.key")
+
+STORE_PAGOS = "pagos"
+STORE_CREDENCIALES = "credenciales"
+LEGACY_ORIGIN = "security.key"
+
+MASTER_VERSION = 3
+KDF_ITERATIONS = 300_000
+MAX_MASTER_ATTEMPTS = 5
+LOCKOUT_SECONDS = 300
+SESSION_TIMEOUT_SECONDS = 600  # inactividad: cada uso o pulsación renueva la sesión
+
+def ensure_base_dir():
+    if not os.path.exists(BASE_DIR):
+        os.makedirs(BASE_DIR, exist_ok=True)
+
+def _set_private_file_permissions(path):
+    try:
+        if os.name == "posix":
+            os.chmod(path, 0o600)
+    except Exception:
+        pass
+
+# ==========================
+# DERIVACIÓN Y SOBRES
+# ==========================
+def _derive_fernet_key(password: str, enc_salt_b64: str, iterations: int):
+    # Solo para migrar maestras v1 (la clave de datos se derivaba con un segundo PBKDF2)
+    enc_salt = base64.b64decode(enc_salt_b64)
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=enc_salt,
+        iterations=iterations,
+    )
+    key = base64.urlsafe_b64encode(kdf.derive(password.encode("utf-8")))
+    return key
+
+def _derive_master_key(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+def _split_master_key(master_key: bytes):
+    """
+    De una sola derivación PBKDF2 salen, vía HKDF con contextos distintos,
+    el verificador que se guarda en disco y la KEK que envuelve las claves de datos.
+    """
+    verifier = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"taller-master-verifier").derive(master_key)
+    kek = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"taller-master-kek").derive(master_key)
+    return verifier, base64.urlsafe_b64encode(kek)
+
+def _wrap_entry(kek, data_key, old=None):
+    entry = dict(old or {}, wrapped=Fernet(kek).encrypt(data_key).decode("ascii"))
+    entry.setdefault("created_at", datetime.now().isoformat(timespec="seconds"))
+    return entry
+
+def _master_record(salt: bytes, iterations: int, master_key: bytes, data_keys: dict, old_entries=None):
+    """Registro v3: data_keys {almacén: clave} envueltas con la KEK de master_key."""
+    verifier, kek = _split_master_key(master_key)
+    old_entries = old_entries or {}
+    return {
+        "version": MASTER_VERSION,
+        "salt": base64.b64encode(salt).decode("ascii"),
+        "iterations": iterations,
+        "verifier": base64.b64encode(verifier).decode("ascii"),
+        "keys": {store: _wrap_entry(kek, key, old_entries.get(store)) for store, key in data_keys.items()},
+        "rotated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+def _read_master_record():
+    with open(MASTER_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_master_record(data):
+    tmp = MASTER_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, MASTER_FILE)
+    _set_private_file_permissions(MASTER_FILE)
+
+def _unlock_master(data, attempt: str):
+    """
+    Trabajo pesado de la verificación (corre fuera del hilo de Tk).
+    Devuelve (kek, {almacén: clave_de_datos}, registro_v3_para_guardar | None),
+    o (None, None, None) si la contraseña no coincide.
+    """
+    salt = base64.b64decode(data["salt"])
+    iterations = int(data.get("iterations", KDF_ITERATIONS))
+    master_key = _derive_master_key(attempt, salt, iterations)
+    version = data.get("version", 1)
+    if version >= 2:
+        verifier, kek = _split_master_key(master_key)
+        if not secrets.compare_digest(verifier, base64.b64decode(data["verifier"])):
+            return None, None, None
+        if version >= 3:
+            keys = {store: Fernet(kek).decrypt(e["wrapped"].encode("ascii")) for store, e in data.get("keys", {}).items()}
+            return kek, keys, None
+        # v2: la única clave envuelta era la de la pasarela
+        keys = {STORE_PAGOS: Fernet(kek).decrypt(data["wrapped_key"].encode("ascii"))}
+        return kek, keys, _master_record(salt, iterations, master_key, keys)
+    # v1: el hash guardado es el propio PBKDF2; se migra una vez envolviendo la clave antigua.
+    # Ese hash queda en respaldos del v1: la KEK nueva sale de otra sal, nunca de él.
+    if not secrets.compare_digest(master_key, base64.b64decode(data["hash"])):
+        return None, None, None
+    keys = {STORE_PAGOS: _derive_fernet_key(attempt, data["enc_salt"], iterations)}
+    salt = secrets.token_bytes(16)
+    master_key = _derive_master_key(attempt, salt, KDF_ITERATIONS)
+    _, kek = _split_master_key(master_key)
+    return kek, keys, _master_record(salt, KDF_ITERATIONS, master_key, keys)
+
+def run_with_busy(parent, text, fn, *args):
+    """
+    Ejecuta fn en un hilo y mantiene viva la ventana (indicador de espera)
+    hasta que termine. Devuelve el resultado o re-lanza la excepción.
+    """
+    out = {}
+    def work():
+        try:
+            out["value"] = fn(*args)
+        except Exception as e:
+            out["error"] = e
+    t = threading.Thread(target=work, name="kdf", daemon=True)
+    t.start()
+    top = None
+    if parent is not None:
+        top = tk.Toplevel(parent)
+        top.title("Procesando")
+        top.configure(bg="#0f172a")
+        top.resizable(False, False)
+        tk.Label(top, text=text, bg="#0f172a", fg="#e2e8f0").pack(padx=20, pady=(14, 6))
+        bar = ttk.Progressbar(top, mode="indeterminate", length=220)
+        bar.pack(padx=20, pady=(0, 14))
+        bar.start(12)
+        top.transient(parent)
+        top.grab_set()
+    while t.is_alive():
+        if top is not None:
+            parent.update()
+        t.join(0.02)
+    if top is not None:
+        top.grab_release()
+        top.destroy()
+    if "error" in out:
+        raise out["error"]
+    return out["value"]
+
+# ==========================
+# SESIÓN (por proceso)
+# ==========================
+_master_failed_count = 0
+_lockout_until = None
+_session = None   # {"kek", "verifier", "keys": {almacén: clave}, "fernets": {}, "origins": {}, "expires"}
+_session_lock = threading.Lock()
+_master_lock = bloqueo(MASTER_FILE + ".lock")
+
+def master_exists():
+    return os.path.exists(MASTER_FILE)
+
+def _session_active():
+    return _session is not None and datetime.now() < _session["expires"]
+
+def touch_session():
+    """Actividad del operador: extiende la sesión de la maestra si sigue vigente."""
+    if _session_active():
+        _session["expires"] = datetime.now() + timedelta(seconds=SESSION_TIMEOUT_SECONDS)
+
+def lock_session():
+    global _session
+    _session = None
+
+def _start_session(kek, keys, record):
+    global _session
+    _session = {"kek": kek, "verifier": record["verifier"], "keys": dict(keys), "fernets": {},
+                "origins": {s: e.get("origen") for s, e in record.get("keys", {}).items()},
+                "expires": datetime.now() + timedelta(seconds=SESSION_TIMEOUT_SECONDS)}
+    _adopt_legacy_key()
+    return _session
+
+def _add_store_key(store, data_key, origin=None):
+    """
+    Agrega la clave envuelta de un almacén al registro en disco. Relee el archivo:
+    si otro proceso ya creó ese almacén se usa su clave; si la maestra cambió
+    desde que se desbloqueó esta sesión, la sesión deja de valer.
+    """
+    with _session_lock, _master_lock:
+        record = _read_master_record()
+        if record.get("verifier") != _session["verifier"]:
+            lock_session()
+            raise RuntimeError("La contraseña maestra cambió en otra ventana; vuelva a ingresarla.")
+        entry = record.setdefault("keys", {}).get(store)
+        if entry is not None:
+            data_key = Fernet(_session["kek"]).decrypt(entry["wrapped"].encode("ascii"))
+        else:
+            entry = _wrap_entry(_session["kek"], data_key, {"origen": origin} if origin else None)
+            record["keys"][store] = entry
+            _write_master_record(record)
+            audit("store_key_created", f"store={store}" + (f" origin={origin}" if origin else ""))
+        _session["keys"][store] = data_key
+        _session["origins"][store] = entry.get("origen")
+        return data_key
+
+def _adopt_legacy_key():
+    # security.key en claro -> clave de datos de "credenciales" envuelta con la KEK
+    if not os.path.exists(LEGACY_KEY_FILE) or STORE_CREDENCIALES in _session["keys"]:
+        return
+    try:
+        with open(LEGACY_KEY_FILE, "rb") as f:
+            legacy = f.read().strip()
+        Fernet(legacy)
+        adopted = _add_store_key(STORE_CREDENCIALES, legacy, origin=LEGACY_ORIGIN)
+        if adopted != legacy:
+            # Otro proceso ya había creado "credenciales" con otra clave: security.key
+            # sigue siendo la única forma de leer lo cifrado con ella
+            audit("legacy_key_kept", f"store={STORE_CREDENCIALES} reason=store_key_differs")
+            return
+        os.remove(LEGACY_KEY_FILE)
+        audit("legacy_key_removed", f"adopted_as={STORE_CREDENCIALES}")
+    except Exception as e:
+        audit("legacy_key_adopt_failed", str(e))
+
+def _store_fernet_from_session(store):
+    f = _session["fernets"].get(store)
+    if f is None:
+        data_key = _session["keys"].get(store)
+        if data_key is None:
+            data_key = _add_store_key(store, Fernet.generate_key())
+        f = _session["fernets"][store] = Fernet(data_key)
+    return f
+
+def session_fernet(store):
+    """Fernet del almacén si la sesión sigue vigente (sin diálogos); None si está bloqueada."""
+    if not _session_active():
+        return None
+    touch_session()
+    return _store_fernet_from_session(store)
+
+def legacy_fernet():
+    """Fernet de la antigua security.key (archivo o ya adoptada en la sesión), o None."""
+    if os.path.exists(LEGACY_KEY_FILE):
+        try:
+            with open(LEGACY_KEY_FILE, "rb") as f:
+                return Fernet(f.read().strip())
+        except Exception:
+            return None
+    if _session_active():
+        for store, origin in _session["origins"].items():
+            if origin == LEGACY_ORIGIN:
+                return _store_fernet_from_session(store)
+    return None
+
+# ==========================
+# DIÁLOGOS
+# ==========================
+def _ask_new_password(parent, title):
+    p1 = simpledialog.askstring(title, "Ingrese la nueva contraseña maestra:", show="*", parent=parent)
+    if not p1:
+        return None
+    p2 = simpledialog.askstring(title, "Reingrese la contraseña maestra:", show="*", parent=parent)
+    if p1 != p2:
+        messagebox.showerror("Error", "Las contraseñas no coinciden.")
+        return None
+    return p1
+
+def create_master_interactive(parent):
+    ensure_base_dir()
+    password = _ask_new_password(parent, "Crear contraseña maestra")
+    if not password:
+        return False
+    salt = secrets.token_bytes(16)
+    master_key = run_with_busy(parent, "Derivando clave maestra...", _derive_master_key, password, salt, KDF_ITERATIONS)
+    record = _master_record(salt, KDF_ITERATIONS, master_key, {})
+    with _master_lock:
+        exists = master_exists()
+        if not exists:
+            _write_master_record(record)
+    if exists:
+        messagebox.showerror("Error", "Ya se creó una contraseña maestra en otra ventana; use esa.")
+        return False
+    _start_session(_split_master_key(master_key)[1], {}, record)
+    audit("master_created", "")
+    return True
+
+def _ask_and_unlock(parent, purpose):
+    """Pide la maestra, la verifica (con bloqueo por intentos). Devuelve (kek, keys, record) o None."""
+    global _master_failed_count, _lockout_until
+    now = datetime.now()
+    if _lockout_until and now < _lockout_until:
+        secs = int((_lockout_until - now).total_seconds())
+        messagebox.showerror("Bloqueado", f"Demasiados intentos fallidos. Intenta nuevamente en {secs} segundos.")
+        return None
+    try:
+        data = _read_master_record()
+    except Exception as e:
+        messagebox.showerror("Error", f"No se pudo leer configuración de la maestra: {e}")
+        audit("master_read_failed", str(e))
+        return None
+    attempt = simpledialog.askstring("Contraseña maestra", f"Ingrese la contraseña maestra para {purpose}:", show="*", parent=parent)
+    if attempt is None:
+        return None
+    try:
+        kek, keys, upgraded = run_with_busy(parent, "Verificando contraseña maestra...", _unlock_master, data, attempt)
+    except Exception as e:
+        audit("master_derive_failed", str(e))
+        messagebox.showerror("Error", f"No se pudo derivar la clave: {e}")
+        return None
+    if kek is None:
+        _master_failed_count += 1
+        audit("master_failed", purpose)
+        if _master_failed_count >= MAX_MASTER_ATTEMPTS:
+            _lockout_until = datetime.now() + timedelta(seconds=LOCKOUT_SECONDS)
+            _master_failed_count = 0
+            messagebox.showerror("Bloqueado", f"Demasiados intentos fallidos. Bloqueado por {LOCKOUT_SECONDS} segundos.")
+        else:
+            remaining = MAX_MASTER_ATTEMPTS - _master_failed_count
+            messagebox.showerror("Error", f"Contraseña maestra incorrecta. Intentos restantes: {remaining}")
+        return None
+    if upgraded is not None:
+        try:
+            with _master_lock:
+                current = _read_master_record()
+                if current == data:
+                    _write_master_record(upgraded)
+            if current == data:
+                data = upgraded
+                audit("master_upgraded", f"version={MASTER_VERSION}")
+            else:
+                # Otra ventana migró (o cambió) la maestra entretanto: su registro manda
+                kek, keys, _ = run_with_busy(parent, "Verificando contraseña maestra...", _unlock_master, current, attempt)
+                if kek is None:
+                    messagebox.showerror("Error", "La contraseña maestra cambió en otra ventana; vuelva a ingresarla.")
+                    return None
+                data = current
+        except Exception as e:
+            audit("master_upgrade_failed", str(e))
+    _master_failed_count = 0
+    return kek, keys, data
+
+def store_fernet(parent, store, purpose="acción sensible", require_create=True):
+    """
+    Fernet con la clave de datos del almacén. Reutiliza la sesión vigente (deslizante);
+    si no hay, pide la maestra (o propone crearla). La clave del almacén se crea la
+    primera vez que se pide. None si el operador cancela o falla la verificación.
+    """
+    global _session
+    ensure_base_dir()
+    try:
+        if _session_active():
+            touch_session()
+            return _store_fernet_from_session(store)
+        _session = None
+        if not master_exists():
+            if require_create and messagebox.askyesno("Contraseña maestra no encontrada", "No existe una contraseña maestra. ¿Desea crearla ahora?"):
+                if not create_master_interactive(parent):
+                    return None
+                audit("master_verified", purpose)
+                return _store_fernet_from_session(store)
+            return None
+        unlocked = _ask_and_unlock(parent, purpose)
+        if unlocked is None:
+            return None
+        _start_session(*unlocked)
+        audit("master_verified", purpose)
+        return _store_fernet_from_session(store)
+    except Exception as e:
+        audit("store_key_failed", f"store={store} error={e}")
+        messagebox.showerror("Error", f"No se pudo obtener la clave de {store}: {e}")
+        return None
+
+def rotate_master(parent):
+    """
+    Cambia la contraseña maestra: nueva sal y nueva KEK, y re-envuelve las claves de
+    datos de todos los almacenes. Ningún registro se re-cifra, así que tarda lo
+    mismo con 10 o con 100.000 registros.
+    """
+    ensure_base_dir()
+    if not master_exists():
+        messagebox.showwarning("Contraseña maestra", "Aún no existe una contraseña maestra.")
+        return False
+    unlocked = _ask_and_unlock(parent, "cambiar la contraseña maestra")
+    if unlocked is None:
+        return False
+    old_kek, keys, record = unlocked
+    password = _ask_new_password(parent, "Nueva contraseña maestra")
+    if not password:
+        return False
+    salt = secrets.token_bytes(16)
+    master_key = run_with_busy(parent, "Derivando clave maestra...", _derive_master_key, password, salt, KDF_ITERATIONS)
+    t0 = time.perf_counter()
+    with _session_lock, _master_lock:
+        current = _read_master_record()
+        changed = current.get("verifier") != record.get("verifier")
+        if not changed:
+            # Todas las entradas del disco, no solo las del desbloqueo: otro proceso pudo
+            # agregar un almacén entretanto, y su clave no debe perderse al re-envolver
+            keys = dict(keys)
+            for store, entry in current.get("keys", {}).items():
+                keys[store] = Fernet(old_kek).decrypt(entry["wrapped"].encode("ascii"))
+            new_record = _master_record(salt, KDF_ITERATIONS, master_key, keys, current.get("keys"))
+            _write_master_record(new_record)
+    if changed:
+        messagebox.showerror("Error", "La contraseña maestra cambió en otra ventana. Intente de nuevo.")
+        return False
+    ms = (time.perf_counter() - t0) * 1000
+    _start_session(_split_master_key(master_key)[1], keys, new_record)
+    audit("master_rotated", f"stores={len(keys)} rewrap_ms={ms:.1f}")
+    return True
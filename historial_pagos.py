@@ -0,0 +1,130 @@
+# historial_pagos.py
+# Índice en memoria de transactions.json para el navegador de transacciones:
+# llave primaria ordenada por tiempo ("<time>|<id>"), índices secundarios por
+# cliente/método/estado y paginación por cursor (más recientes primero).
+
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+
+from busqueda_taller import normalizar
+
+_cliente = lru_cache(maxsize=8192)(normalizar)
+
+PAGE_SIZE = 50
+INDEXED_FIELDS = ("cliente", "method", "status")
+
+def _insert(keys, key):
+    # Las transacciones llegan casi siempre en orden: append O(1), insort si no
+    if not keys or keys[-1] <= key:
+        keys.append(key)
+    else:
+        insort(keys, key)
+
+class TransactionIndex:
+    """
+    Cada índice secundario es una lista de llaves primarias ordenada, así que un
+    filtro de igualdad más un rango de fechas se resuelve con bisect sobre la
+    lista más corta. page() recorre solo lo necesario para llenar la página.
+    """
+    def __init__(self, transacciones=()):
+        self._rows = {}                               # llave -> tx
+        self._ids = set()                             # ids de transacción (¿ya guardada?)
+        self._keys = []                               # todas las llaves, ordenadas
+        self._by = {f: {} for f in INDEXED_FIELDS}    # campo -> valor -> [llaves]
+        self._counts = {}
+        for tx in transacciones:
+            self.add(tx)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def primary_key(tx):
+        return f"{tx.get('time') or ''}|{tx.get('id') or ''}"
+
+    @staticmethod
+    def _value(field, raw):
+        return _cliente(raw or "") if field == "cliente" else (raw or "")
+
+    def add(self, tx):
+        key = self.primary_key(tx)
+        if key in self._rows:
+            return
+        self._rows[key] = tx
+        self._ids.add(tx.get("id"))
+        _insert(self._keys, key)
+        for field, idx in self._by.items():
+            _insert(idx.setdefault(self._value(field, tx.get(field)), []), key)
+        self._counts.clear()
+
+    def has_id(self, tx_id):
+        return tx_id in self._ids
+
+    def values(self, field):
+        """Valores distintos de un campo indexado (para combos de filtro)."""
+        return sorted(v for v in self._by[field] if v)
+
+    # ---- consultas ----
+    def _plan(self, filters):
+        """Lista base (la más corta), filtros restantes y rango [lo, hi) por fechas."""
+        filters = dict(filters or {})
+        desde = filters.pop("desde", None)
+        hasta = filters.pop("hasta", None)
+        eq = [(f, self._value(f, v)) for f, v in filters.items() if v and f in self._by]
+        if eq:
+            lists = [(self._by[f].get(v, []), (f, v)) for f, v in eq]
+            base, used = min(lists, key=lambda item: len(item[0]))
+            others = [c for c in eq if c != used]
+        else:
+            base, others = self._keys, []
+        # "YYYY-MM-DD": "hasta" incluye el día completo ("\uffff" ordena después de cualquier hora)
+        lo = bisect_left(base, desde) if desde else 0
+        hi = bisect_right(base, hasta + "\uffff") if hasta else len(base)
+        return base, others, lo, hi
+
+    def _matches(self, tx, others):
+        return all(self._value(f, tx.get(f)) == v for f, v in others)
+
+    def count(self, filters=None):
+        ck = tuple(sorted((k, v) for k, v in (filters or {}).items() if v))
+        if ck in self._counts:
+            return self._counts[ck]
+        base, others, lo, hi = self._plan(filters)
+        if not others:
+            n = max(0, hi - lo)
+        else:
+            # Intersección de listas de llaves (en C) en vez de revisar fila por fila
+            keys = set(base[lo:hi])
+            for f, v in others:
+                keys = keys.intersection(self._by[f].get(v, ()))
+            n = len(keys)
+        self._counts[ck] = n
+        return n
+
+    def page(self, filters=None, cursor=None, limit=PAGE_SIZE):
+        """
+        Devuelve (transacciones, siguiente_cursor), de la más reciente a la más antigua.
+        cursor es la llave de la última fila de la página anterior (None = primera).
+        """
+        base, others, lo, hi = self._plan(filters)
+        if cursor:
+            hi = min(hi, bisect_left(base, cursor))
+        out = []
+        last = None
+        i = hi - 1
+        while i >= lo and len(out) < limit:
+            tx = self._rows[base[i]]
+            if not others or self._matches(tx, others):
+                out.append(tx)
+                last = base[i]
+            i -= 1
+        more = len(out) == limit and i >= lo
+        return out, (last if more else None)
+
+    def scan(self, filters=None):
+        """Recorre en orden cronológico las transacciones que cumplen los filtros (exportación)."""
+        base, others, lo, hi = self._plan(filters)
+        for key in base[lo:hi]:   # copia de las llaves: el índice puede crecer mientras tanto
+            tx = self._rows[key]
+            if not others or self._matches(tx, others):
+                yield tx
@@ -0,0 +1,325 @@
+# indice_auditoria.py
+# Índice de consulta del audit log (segmentos de auditoria_log). Por segmento:
+#   - offsets: byte de inicio de cada registro (ordinal -> posición en el archivo)
+#   - índice de tiempo disperso: primer ordinal de cada minuto
+#   - postings por evento/usuario/módulo: ordinales ordenados (array compacto)
+# Un filtro se resuelve con bisect + intersección de postings, sin leer registros;
+# solo se leen (perezosamente) los de la página visible. Los segmentos sellados no
+# cambian, así que su índice se guarda al lado (.idx.json) y se reutiliza.
+
+import os
+import json
+import gzip
+import base64
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from auditoria_log import load_manifest, ACTIVE_NAME, line_seq
+
+INDEXED_FIELDS = ("event", "user", "module")
+INDEX_SUFFIX = ".idx.json"
+INDEX_VERSION = 1
+PAGE_SIZE = 100
+CACHED_SEGMENTS = 3           # segmentos .gz descomprimidos en memoria para paginar
+GZ_CHUNK = 1 << 20            # bloque al indexar un .gz por flujo
+
+def _pack(arr):
+    return base64.b64encode(arr.tobytes()).decode("ascii")
+
+def _unpack(typecode, text):
+    arr = array(typecode)
+    arr.frombytes(base64.b64decode(text))
+    return arr
+
+def time_key(value, end=False):
+    """"YYYY-MM-DD[ HH:MM]" -> prefijo ISO comparable; end=True incluye todo el minuto/día."""
+    key = value.strip().replace(" ", "T")
+    return key + "\uffff" if end else key
+
+_gz_cache = OrderedDict()
+
+def _gz_data(path):
+    data = _gz_cache.get(path)
+    if data is None:
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+        _gz_cache[path] = data
+        while len(_gz_cache) > CACHED_SEGMENTS:
+            _gz_cache.popitem(last=False)
+    else:
+        _gz_cache.move_to_end(path)
+    return data
+
+class SegmentIndex:
+    def __init__(self, path, sealed):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.sealed = sealed
+        self._reset()
+
+    def _reset(self):
+        self.size = 0                                   # bytes ya indexados
+        self.ino = None                                 # identidad del activo indexado:
+        self.first_n = None                             # inode y n de su primer registro
+        self.offsets = array("Q")
+        self.minutes = []                               # "YYYY-MM-DDTHH:MM" crecientes
+        self.minute_first = array("I")
+        self.postings = {f: {} for f in INDEXED_FIELDS}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # ---- construcción ----
+    def _add(self, offset, raw):
+        try:
+            rec = json.loads(raw)
+        except ValueError:
+            return
+        i = len(self.offsets)
+        self.offsets.append(offset)
+        minute = (rec.get("ts") or "")[:16]
+        if not self.minutes or minute > self.minutes[-1]:
+            self.minutes.append(minute)
+            self.minute_first.append(i)
+        for field in INDEXED_FIELDS:
+            value = rec.get(field) or ""
+            posting = self.postings[field].get(value)
+            if posting is None:
+                posting = self.postings[field][value] = array("I")
+            posting.append(i)
+
+    def _index_bytes(self, data, base):
+        pos, end = 0, len(data)
+        while pos < end:
+            nl = data.find(b"\n", pos)
+            if nl < 0:
+                break                                   # línea a medio escribir: se indexa luego
+            self._add(base + pos, data[pos:nl])
+            pos = nl + 1
+        return pos
+
+    def _index_gz(self):
+        # Por bloques y sin pasar por _gz_cache: on_seal construye el índice en el
+        # proceso que escribe el audit log, que no debe quedarse con el segmento en memoria
+        base, tail = 0, b""
+        with gzip.open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(GZ_CHUNK)
+                if not chunk:
+                    break
+                data = tail + chunk
+                used = self._index_bytes(data, base)
+                base += used
+                tail = data[used:]
+        return base
+
+    def update(self):
+        """Indexa lo nuevo: el segmento completo si es .gz, o solo los bytes agregados al activo."""
+        if self.sealed:
+            if not self.offsets:
+                self.size = self._index_gz()
+            return
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            first_n = line_seq(f.readline(80).rstrip(b"\r\n"))
+            # Rotó (otro archivo, aunque tenga el mismo tamaño o más): empezar de cero
+            if self.size and (st.st_size < self.size or st.st_ino != self.ino or first_n != self.first_n):
+                self._reset()
+            self.ino, self.first_n = st.st_ino, first_n
+            if st.st_size == self.size:
+                return
+            f.seek(self.size)
+            self.size += self._index_bytes(f.read(st.st_size - self.size), self.size)
+
+    def save(self):
+        doc = {"version": INDEX_VERSION, "size": self.size, "offsets": _pack(self.offsets),
+               "minutes": self.minutes, "minute_first": _pack(self.minute_first),
+               "postings": {f: {v: _pack(p) for v, p in d.items()} for f, d in self.postings.items()}}
+        tmp = self.path + INDEX_SUFFIX + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False)
+        os.replace(tmp, self.path + INDEX_SUFFIX)
+
+    @classmethod
+    def load_or_build(cls, path):
+        seg = cls(path, sealed=True)
+        try:
+            with open(path + INDEX_SUFFIX, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            if doc.get("version") != INDEX_VERSION:
+                raise ValueError("versión de índice")
+            seg.size = doc["size"]
+            seg.offsets = _unpack("Q", doc["offsets"])
+            seg.minutes = doc["minutes"]
+            seg.minute_first = _unpack("I", doc["minute_first"])
+            seg.postings = {f: {v: _unpack("I", p) for v, p in doc["postings"].get(f, {}).items()} for f in INDEXED_FIELDS}
+            return seg
+        except (OSError, ValueError, KeyError):
+            seg = cls(path, sealed=True)
+        seg.update()
+        try:
+            seg.save()
+        except OSError:
+            pass
+        return seg
+
+    # ---- consulta ----
+    def ordinal_range(self, since=None, until=None):
+        lo, hi = 0, len(self.offsets)
+        if since:
+            j = bisect_left(self.minutes, since[:16])
+            lo = self.minute_first[j] if j < len(self.minutes) else hi
+        if until:
+            j = bisect_right(self.minutes, until)
+            hi = self.minute_first[j] if j < len(self.minutes) else hi
+        return lo, hi
+
+    def matches(self, filters):
+        """Ordinales (ordenados) que cumplen los filtros de igualdad y el rango de tiempo."""
+        lo, hi = self.ordinal_range(filters.get("desde"), filters.get("hasta"))
+        if lo >= hi:
+            return []
+        eq = [(f, filters[f]) for f in INDEXED_FIELDS if filters.get(f)]
+        if not eq:
+            return range(lo, hi)
+        lists = []
+        for field, value in eq:
+            posting = self.postings[field].get(value)
+            if posting is None:
+                return []
+            lists.append(posting[bisect_left(posting, lo):bisect_left(posting, hi)])
+        lists.sort(key=len)
+        if len(lists) == 1:
+            return lists[0]
+        keep = set(lists[0])
+        for other in lists[1:]:
+            keep.intersection_update(other)
+        return sorted(keep)
+
+    def raw(self, i):
+        start = self.offsets[i]
+        if self.sealed:
+            data = _gz_data(self.path)
+            return data[start:data.find(b"\n", start)]
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return f.readline().rstrip(b"\n")
+
+    def raws(self, ordinals):
+        if self.sealed:
+            return [self.raw(i) for i in ordinals]
+        out = []
+        with open(self.path, "rb") as f:
+            for i in ordinals:
+                f.seek(self.offsets[i])
+                out.append(f.readline().rstrip(b"\n"))
+        return out
+
+def _contains(raw, needle):
+    """Búsqueda sin distinguir mayúsculas (Unicode): las líneas guardan UTF-8 sin escapar."""
+    if raw.isascii() and needle.isascii():
+        return needle.encode("ascii") in raw.lower()
+    return needle in raw.decode("utf-8", "replace").casefold()
+
+class AuditIndex:
+    """
+    Todos los segmentos (manifiesto + activo), en orden cronológico. page() va del
+    más reciente al más antiguo con cursor (segmento, ordinal) y solo lee las filas
+    de la página; "texto" se revisa sobre la línea cruda de los candidatos.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._sealed = {}
+        self._active = SegmentIndex(os.path.join(directory, ACTIVE_NAME), sealed=False)
+        self.segments = []
+        self._matches = {}
+
+    def refresh(self):
+        names = [s["file"] for s in load_manifest(self.directory)["segments"]]
+        for name in names:
+            if name not in self._sealed:
+                path = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    self._sealed[name] = SegmentIndex.load_or_build(path)
+        self._active.update()
+        self.segments = [self._sealed[n] for n in names if n in self._sealed] + [self._active]
+        self._matches.clear()
+        return self
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments)
+
+    def values(self, field):
+        out = set()
+        for seg in self.segments:
+            out.update(v for v in seg.postings[field] if v)
+        return sorted(out)
+
+    @staticmethod
+    def _key(filters):
+        return tuple(sorted((k, v) for k, v in filters.items() if v and k != "texto"))
+
+    def _seg_matches(self, seg, filters):
+        key = (seg.name, len(seg), self._key(filters))
+        found = self._matches.get(key)
+        if found is None:
+            found = self._matches[key] = seg.matches(filters)
+        return found
+
+    def count(self, filters):
+        """Total de coincidencias (None si hay filtro de texto: requiere leer filas)."""
+        if filters.get("texto"):
+            return None
+        return sum(len(self._seg_matches(seg, filters)) for seg in self.segments)
+
+    def page(self, filters, cursor=None, limit=PAGE_SIZE):
+        """Devuelve (registros, siguiente_cursor). cursor = (nombre_segmento, ordinal) exclusivo."""
+        needle = (filters.get("texto") or "").strip().casefold()
+        out, last = [], None
+        started = cursor is None
+        for seg in reversed(self.segments):
+            if not started:
+                if seg.name != cursor[0]:
+                    continue
+                started = True
+            ords = self._seg_matches(seg, filters)
+            end = len(ords)
+            if cursor is not None and seg.name == cursor[0]:
+                end = bisect_left(ords, cursor[1])
+            while end > 0 and len(out) < limit:
+                start = max(0, end - (limit - len(out)) * (4 if needle else 1))
+                chunk = ords[start:end]
+                for i, raw in zip(reversed(chunk), reversed(seg.raws(chunk))):
+                    if needle and not _contains(raw, needle):
+                        continue
+                    out.append(json.loads(raw))
+                    last = (seg.name, i)
+                    if len(out) == limit:
+                        break
+                end = start
+            if len(out) == limit:
+                return out, (last if self._has_older(filters, last) else None)
+        return out, None
+
+    def _has_older(self, filters, cursor):
+        for seg in self.segments:
+            ords = self._seg_matches(seg, filters)
+            if seg.name == cursor[0]:
+                return bisect_left(ords, cursor[1]) > 0
+            if len(ords):
+                return True
+        return False
+
+_indexes = {}
+
+def audit_index(directory):
+    """Índice compartido por directorio; cada llamada incorpora lo escrito desde la anterior."""
+    index = _indexes.get(directory)
+    if index is None:
+        index = _indexes[directory] = AuditIndex(directory)
+    return index.refresh()
@@ -0,0 +1,240 @@
+# integridad_auditoria.py
+# Integridad del audit log: cada registro ya viene encadenado por auditoria_log
+# (n, h = sha256(h_anterior + línea)). Aquí:
+#   - checkpoints firmados (HMAC-SHA256 con una llave local) cada CHECKPOINT_EVERY
+#     registros y en cada flush explícito, en checkpoints.jsonl
+#   - verificador incremental: retoma desde el último checkpoint verificado
+#     (guardado y firmado en verificacion.json), así que el chequeo diario cuesta
+#     O(registros nuevos) y no vuelve a hashear todo el historial.
+#
+#   python integridad_auditoria.py            # incremental; código 1 si falla
+#   python integridad_auditoria.py --completo  # desde el primer registro
+
+import os
+import sys
+import json
+import gzip
+import hmac
+import time
+import hashlib
+import secrets
+from datetime import datetime
+
+from auditoria_log import load_manifest, ACTIVE_NAME, GENESIS, split_chained, line_seq
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+AUDIT_DIR = os.path.join(BASE_DIR, "auditoria")
+AUDIT_KEY_FILE = os.path.join(BASE_DIR, "audit_checkpoint.key")
+
+CHECKPOINTS_NAME = "checkpoints.jsonl"
+STATE_NAME = "verificacion.json"
+CHECKPOINT_EVERY = 1000
+
+def _set_private_file_permissions(path):
+    try:
+        if os.name == "posix":
+            os.chmod(path, 0o600)
+    except Exception:
+        pass
+
+def load_key(path, create=True):
+    """
+    Llave HMAC de los checkpoints. Se crea ya con permisos 0600 (O_EXCL: si dos
+    procesos arrancan a la vez, el segundo lee la del primero) y una llave antigua
+    con permisos abiertos se restringe al cargarla.
+    """
+    if not os.path.exists(path):
+        if not create:
+            return None
+        key = secrets.token_bytes(32)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+            return key
+    if os.name == "posix" and os.stat(path).st_mode & 0o077:
+        _set_private_file_permissions(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+def _mac(key, *parts):
+    return hmac.new(key, ":".join(map(str, parts)).encode("utf-8"), hashlib.sha256).hexdigest()
+
+# ==========================
+# CHECKPOINTS (los escribe el hilo de auditoría)
+# ==========================
+class Checkpointer:
+    """
+    Varios procesos firman sobre el mismo checkpoints.jsonl: record() se llama con
+    el candado del audit log tomado y relee el último checkpoint del archivo, así
+    los n firmados quedan crecientes aunque los escriban procesos distintos.
+    """
+    def __init__(self, directory, key_path, every=CHECKPOINT_EVERY):
+        self.path = os.path.join(directory, CHECKPOINTS_NAME)
+        self.key = load_key(key_path)
+        self.every = every
+        self.last_n = self._last_on_disk()
+
+    def _last_on_disk(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            f.seek(max(0, os.path.getsize(self.path) - 4096))
+            for raw in reversed(f.read().splitlines()):
+                try:
+                    return json.loads(raw)["n"]
+                except (ValueError, KeyError):
+                    continue
+        return 0
+
+    def record(self, n, h, force=False):
+        """Firma (n, h) si pasaron `every` registros desde el último checkpoint (o si force)."""
+        self.last_n = max(self.last_n, self._last_on_disk())
+        if n <= self.last_n or (not force and n - self.last_n < self.every):
+            return False
+        cp = {"n": n, "h": h, "ts": datetime.now().isoformat(timespec="seconds"), "mac": _mac(self.key, "cp", n, h)}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(cp) + "\n")
+        self.last_n = n
+        return True
+
+def load_checkpoints(directory, key):
+    """{n: h} de los checkpoints con firma válida, y la lista de los que no la tienen."""
+    valid, bad = {}, []
+    path = os.path.join(directory, CHECKPOINTS_NAME)
+    if not os.path.exists(path):
+        return valid, bad
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f, 1):
+            try:
+                cp = json.loads(line)
+                ok = hmac.compare_digest(cp["mac"], _mac(key, "cp", cp["n"], cp["h"]))
+            except (ValueError, KeyError, TypeError):
+                ok = False
+            if ok:
+                valid[cp["n"]] = cp["h"]
+            else:
+                bad.append(f"checkpoint con firma inválida (línea {i} de {CHECKPOINTS_NAME})")
+    return valid, bad
+
+# ==========================
+# VERIFICACIÓN
+# ==========================
+def _load_state(directory, key):
+    try:
+        with open(os.path.join(directory, STATE_NAME), "r", encoding="utf-8") as f:
+            st = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if not hmac.compare_digest(st.get("mac", ""), _mac(key, "estado", st.get("n"), st.get("h"))):
+        return None, "estado de verificación con firma inválida: se verifica desde el inicio"
+    return st, None
+
+def _save_state(directory, key, n, h):
+    st = {"n": n, "h": h, "verificado": datetime.now().isoformat(timespec="seconds"), "mac": _mac(key, "estado", n, h)}
+    path = os.path.join(directory, STATE_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(st, f)
+    os.replace(path + ".tmp", path)
+
+def _raw_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for raw in f:
+            yield raw.rstrip(b"\r\n")
+
+def verificar(directory=None, key_path=None, completo=False):
+    """
+    Recorre la cadena desde el último checkpoint verificado (o desde el inicio con
+    completo=True). Detecta registros alterados (hash), borrados o reordenados
+    (saltos en n), segmentos faltantes y cortes al final (checkpoint firmado más
+    allá del último registro). Devuelve un dict con el resultado.
+    """
+    directory = directory or AUDIT_DIR
+    t0 = time.perf_counter()
+    key = load_key(key_path or AUDIT_KEY_FILE, create=False)
+    if key is None:
+        return {"ok": False, "errores": ["No existe la llave de checkpoints; no hay nada firmado que verificar."],
+                "desde": 0, "hasta": 0, "verificados": 0, "checkpoints": 0, "sin_checkpoint": 0, "segundos": 0.0}
+    checkpoints, errores = load_checkpoints(directory, key)
+    state, aviso = (None, None) if completo else _load_state(directory, key)
+    if aviso:
+        errores.append(aviso)
+    start_n, prev = (state["n"], state["h"]) if state else (0, GENESIS)
+    expected = start_n + 1
+    anchor = (start_n, prev)
+    verificados = cps_ok = 0
+    broken = started = False
+
+    segments = sorted(load_manifest(directory)["segments"], key=lambda s: (s.get("first_n") is None, s.get("first_n") or 0))
+    paths = [(os.path.join(directory, s["file"]), s) for s in segments if s.get("last_n") is not None]
+    paths.append((os.path.join(directory, ACTIVE_NAME), None))
+    for path, seg in paths:
+        if seg is not None and seg["last_n"] < expected:
+            continue                                      # ya cubierto por el checkpoint verificado
+        if not os.path.exists(path):
+            if seg is not None:
+                errores.append(f"Falta el segmento {seg['file']} (registros {seg.get('first_n')}-{seg['last_n']})")
+                broken = True
+            continue
+        for raw in _raw_lines(path):
+            n = line_seq(raw)
+            if n is None:
+                continue                                  # registro previo a la cadena
+            if n < expected:
+                if started:
+                    errores.append(f"Registro {n} repetido o fuera de orden")
+                    broken = True
+                continue                                  # ya verificado
+            started = True
+            parts = split_chained(raw)
+            if parts is None:
+                errores.append(f"Registro {n}: formato alterado")
+                broken = True
+                continue
+            _, body, h = parts
+            if n != expected:
+                errores.append(f"Faltan registros {expected}-{n - 1}")
+                broken = True
+            elif hashlib.sha256(prev.encode("ascii") + body).hexdigest() != h:
+                errores.append(f"Registro {n}: contenido alterado (hash no coincide)")
+                broken = True
+            prev, expected = h, n + 1
+            verificados += 1
+            cp = checkpoints.get(n)
+            if cp is not None:
+                if cp != h:
+                    errores.append(f"Checkpoint {n} no coincide con el registro")
+                    broken = True
+                elif not broken:
+                    anchor = (n, h)
+                    cps_ok += 1
+
+    last = expected - 1
+    later = [n for n in checkpoints if n > last]
+    if later:
+        errores.append(f"Faltan registros al final: hay checkpoint firmado en {max(later)} y el último registro es {last}")
+    ok = not errores
+    if ok and anchor[0] > start_n:
+        _save_state(directory, key, *anchor)
+    return {"ok": ok, "errores": errores, "desde": start_n, "hasta": last, "verificados": verificados,
+            "checkpoints": cps_ok, "sin_checkpoint": last - anchor[0], "segundos": round(time.perf_counter() - t0, 3)}
+
+def texto_resultado(res):
+    rango = f"(n {res['desde'] + 1}–{res['hasta']})" if res["verificados"] else f"(sin registros nuevos después de n {res['desde']})"
+    lines = [("✔ Integridad verificada" if res["ok"] else "✖ Problemas de integridad"),
+             f"Registros verificados: {res['verificados']} {rango} en {res['segundos']} s",
+             f"Checkpoints firmados coincidentes: {res['checkpoints']}",
+             f"Registros posteriores al último checkpoint: {res['sin_checkpoint']}"]
+    lines += res["errores"][:50]
+    if len(res["errores"]) > 50:
+        lines.append(f"... y {len(res['errores']) - 50} problemas más")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    res = verificar(completo="--completo" in sys.argv[1:])
+    print(texto_resultado(res))
+    sys.exit(0 if res["ok"] else 1)
@@ -0,0 +1,216 @@
+# lotes_pagos.py
+# Lotes de cobro para clientes de flota: filas desde CSV o desde facturas abiertas de
+# cartera.json, despacho concurrente contra el procesador y resumen de conciliación.
+# La ventana vive en pasarela_pagos.py; aquí solo está la lógica (sin Tk).
+
+import os
+import csv
+import json
+import uuid
+from datetime import datetime
+
+from bloqueo_archivos import bloqueo
+from cartera_taller import cargar_cartera, bloqueo_cartera
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+BATCHES_FILE = os.path.join(BASE_DIR, "lotes_pagos.json")
+RECURRING_FILE = os.path.join(BASE_DIR, "lotes_recurrentes.json")
+
+BATCH_WORKERS = 16
+
+# Método (como aparece en la pasarela) -> tipo de solicitud del procesador
+METHOD_KINDS = {
+    "Tarjeta crédito": "card",
+    "Tarjeta débito": "card",
+    "PSE": "pse",
+    "Nequi": "wallet",
+    "Daviplata": "wallet",
+    "Transferencia Bancolombia": "transfer",
+    "Efectivo": "cash",
+}
+
+CSV_COLUMNS = ["cliente", "monto", "metodo", "referencia", "token"]
+
+def _read_json(path, default):
+    # ValueError si el archivo existe pero no se puede interpretar
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _load_json(path, default):
+    """Solo para consultar: un archivo ilegible se ve como default (nunca se guarda encima)."""
+    try:
+        return _read_json(path, default)
+    except (OSError, ValueError):
+        return default
+
+def _save_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def _update_json(path, default, cambio):
+    """
+    Relee el archivo bajo el candado, aplica cambio(datos) en sitio y guarda con
+    tmp + os.replace. Si el archivo no se puede leer se propaga el error en vez de
+    reemplazar el historial por default.
+    """
+    with bloqueo(path + ".lock"):
+        data = _read_json(path, default)
+        cambio(data)
+        _save_json(path, data)
+    return data
+
+# ==========================
+# FILAS DEL LOTE
+# ==========================
+def make_row(cliente, monto, metodo, referencia="", token="", extra=None):
+    return {"cliente": cliente, "monto": round(float(monto), 2), "metodo": metodo,
+            "referencia": referencia, "token": token or "", "extra": extra or {}}
+
+def validate_row(row, known_tokens=()):
+    """Devuelve None si la fila es válida, o el motivo del rechazo."""
+    if not row.get("cliente"):
+        return "Cliente vacío"
+    if row.get("monto", 0) <= 0:
+        return "Monto inválido"
+    kind = METHOD_KINDS.get(row.get("metodo"))
+    if kind is None:
+        return f"Método no soportado: {row.get('metodo')}"
+    if kind == "card" and row.get("token") not in known_tokens:
+        return "Token de tarjeta inexistente"
+    return None
+
+def parse_batch_csv(path, default_method="Transferencia Bancolombia"):
+    """
+    Columnas: cliente, monto, metodo, referencia, token (token solo para tarjetas).
+    Columnas adicionales (banco, celular, documento, ...) pasan a "extra".
+    """
+    rows = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for rec in csv.DictReader(f):
+            rec = {(k or "").strip().lower(): (v or "").strip() for k, v in rec.items()}
+            try:
+                monto = float(rec.get("monto", "0").replace(",", ""))
+            except ValueError:
+                monto = 0
+            extra = {k: v for k, v in rec.items() if k not in CSV_COLUMNS and v}
+            rows.append(make_row(rec.get("cliente", ""), monto, rec.get("metodo") or default_method,
+                                 rec.get("referencia", ""), rec.get("token", ""), extra))
+    return rows
+
+def open_receivables():
+    """Facturas de cartera con saldo pendiente: [(índice, registro)]."""
+    with bloqueo_cartera():
+        cartera = cargar_cartera()
+    return [(i, r) for i, r in enumerate(cartera) if r.get("saldo", 0) > 0 and r.get("estado") != "Pagada"]
+
+def rows_from_receivables(registros, metodo, token=""):
+    return [make_row(r.get("cliente", ""), r.get("saldo", 0), metodo, r.get("referencia", ""), token,
+                     {"documento": r.get("documento", "")})
+            for r in registros]
+
+def build_request(row, card_payload=None):
+    """Solicitud para PaymentDispatcher (mismo formato que los pagos individuales)."""
+    kind = METHOD_KINDS[row["metodo"]]
+    request = {"kind": kind, "method": row["metodo"], "amount": row["monto"],
+               "extra": dict(row.get("extra") or {}, ref=row.get("referencia", ""))}
+    if kind == "wallet":
+        request["extra"].setdefault("provider", row["metodo"])
+    if kind == "card" and card_payload:
+        request["card"] = card_payload.get("card")
+        request["exp"] = card_payload.get("exp", "")
+        request["token"] = row["token"]
+    return request
+
+def row_idempotency_key(batch_id, index):
+    # Reejecutar el mismo lote (p. ej. tras un cierre inesperado) no vuelve a cobrar
+    return f"{batch_id}:{index}"
+
+def new_batch_id():
+    return datetime.now().strftime("L%Y%m%d%H%M%S-") + uuid.uuid4().hex[:6]
+
+# ==========================
+# CONCILIACIÓN
+# ==========================
+def reconciliation_summary(batch_id, rows, results, started_at, finished_at):
+    """
+    rows y results alineados por posición; results[i] es el dict del procesador
+    (o un rechazo local). Devuelve el resumen que se guarda en lotes_pagos.json.
+    """
+    summary = {
+        "batch_id": batch_id,
+        "started_at": started_at.isoformat(),
+        "finished_at": finished_at.isoformat(),
+        "seconds": round((finished_at - started_at).total_seconds(), 2),
+        "rows": len(rows),
+        "approved": 0, "declined": 0, "error": 0, "replayed": 0,
+        "amount_requested": 0.0, "amount_approved": 0.0,
+        "by_method": {},
+        "failures": [],
+    }
+    for i, (row, res) in enumerate(zip(rows, results)):
+        status = res.get("status", "error")
+        summary[status if status in ("approved", "declined") else "error"] += 1
+        if res.get("replayed"):
+            summary["replayed"] += 1
+        summary["amount_requested"] += row["monto"]
+        m = summary["by_method"].setdefault(row["metodo"], {"count": 0, "approved": 0, "amount_approved": 0.0})
+        m["count"] += 1
+        if status == "approved":
+            summary["amount_approved"] += row["monto"]
+            m["approved"] += 1
+            m["amount_approved"] += row["monto"]
+        else:
+            summary["failures"].append({"row": i + 1, "cliente": row["cliente"], "referencia": row.get("referencia", ""),
+                                        "monto": row["monto"], "status": status, "message": res.get("message")})
+    summary["amount_requested"] = round(summary["amount_requested"], 2)
+    summary["amount_approved"] = round(summary["amount_approved"], 2)
+    if summary["seconds"] > 0:
+        summary["per_minute"] = round(len(rows) * 60 / summary["seconds"], 1)
+    return summary
+
+def summary_text(summary):
+    lines = [
+        f"Lote {summary['batch_id']}  ({summary['seconds']} s, {summary.get('per_minute', '-')} cobros/min)",
+        f"Filas: {summary['rows']}  |  Aprobados: {summary['approved']}  |  Rechazados: {summary['declined']}  |  Errores: {summary['error']}  |  Repetidos: {summary['replayed']}",
+        f"Solicitado: ${summary['amount_requested']:,.2f}  |  Aprobado: ${summary['amount_approved']:,.2f}",
+        "",
+        "Por método:",
+    ]
+    for metodo, m in summary["by_method"].items():
+        lines.append(f"• {metodo}: {m['approved']}/{m['count']} aprobados, ${m['amount_approved']:,.2f}")
+    if summary["failures"]:
+        lines.append("")
+        lines.append("No aprobados:")
+        for f in summary["failures"]:
+            lines.append(f"• Fila {f['row']}: {f['cliente']} {f['referencia']} ${f['monto']:,.2f} — {f['status']}: {f['message']}")
+    return "\n".join(lines)
+
+def save_batch_summary(summary):
+    _update_json(BATCHES_FILE, [], lambda batches: batches.append(summary))
+
+# ==========================
+# LOTES RECURRENTES
+# ==========================
+def load_recurring():
+    return _load_json(RECURRING_FILE, [])
+
+def save_recurring(nombre, dia, rows):
+    rec = {"id": uuid.uuid4().hex[:8], "nombre": nombre, "dia": int(dia), "rows": rows, "last_run": None}
+    _update_json(RECURRING_FILE, [], lambda recurring: recurring.append(rec))
+
+def due_recurring(today=None):
+    """Lotes cuyo día del mes ya llegó y que no se han ejecutado este mes."""
+    today = today or datetime.now().date()
+    month = today.strftime("%Y-%m")
+    return [r for r in load_recurring() if r["dia"] <= today.day and (r.get("last_run") or "")[:7] != month]
+
+def mark_recurring_run(rec_id):
+    def marcar(recurring):
+        for r in recurring:
+            if r["id"] == rec_id:
+                r["last_run"] = datetime.now().isoformat()
+    _update_json(RECURRING_FILE, [], marcar)
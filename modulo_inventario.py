@@ -4,17 +4,86 @@ import os, json
 from datetime import datetime
 import openpyxl
 
+from busqueda_taller import IndiceBusqueda
+
 # Ruta de persistencia y exportación
 BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
 DB_FILE = os.path.join(BASE_DIR, "inventario.json")
+MOVIMIENTOS_FILE = os.path.join(BASE_DIR, "movimientos_inventario.jsonl")   # una línea por transferencia
+MOVIMIENTOS_ANTERIOR = os.path.join(BASE_DIR, "movimientos_inventario.json")  # formato anterior (se migra)
 EXPORT_FILE = os.path.join(BASE_DIR, "inventario_taller.xlsx")
 
+# Sedes / bodegas. La primera recibe el stock de registros antiguos sin "Existencias".
+UBICACIONES = ["Sede Principal", "Sede 2"]
+
 def format_currency(v):
     try:
         return f"${int(v):,}"
     except Exception:
         return f"${v}"
 
+# -------------------------
+# Stock por ubicación
+# -------------------------
+class StockPorUbicacion:
+    """
+    Índice compuesto (Código, Ubicación) -> cantidad.
+    Los totales por SKU y por ubicación se ajustan por diferencia en cada
+    cambio, así que nunca hay que recorrer todo el inventario para leerlos.
+    """
+    def __init__(self):
+        self._stock = {}
+        self._ubicaciones_sku = {}
+        self._total_sku = {}
+        self._total_ubicacion = {}
+
+    def cantidad(self, codigo, ubicacion):
+        return self._stock.get((codigo, ubicacion), 0.0)
+
+    def total_sku(self, codigo):
+        return self._total_sku.get(codigo, 0.0)
+
+    def total_ubicacion(self, ubicacion):
+        return self._total_ubicacion.get(ubicacion, 0.0)
+
+    def existencias(self, codigo):
+        """Dict ubicación -> cantidad (solo ubicaciones con stock) para persistir."""
+        return {u: self._stock[(codigo, u)] for u in self._ubicaciones_sku.get(codigo, ())}
+
+    def fijar(self, codigo, ubicacion, cantidad):
+        cantidad = float(cantidad)
+        delta = cantidad - self._stock.get((codigo, ubicacion), 0.0)
+        if cantidad:
+            self._stock[(codigo, ubicacion)] = cantidad
+            self._ubicaciones_sku.setdefault(codigo, {})[ubicacion] = None
+        else:
+            self._stock.pop((codigo, ubicacion), None)
+            self._ubicaciones_sku.get(codigo, {}).pop(ubicacion, None)
+        self._total_sku[codigo] = self._total_sku.get(codigo, 0.0) + delta
+        self._total_ubicacion[ubicacion] = self._total_ubicacion.get(ubicacion, 0.0) + delta
+
+    def quitar_sku(self, codigo):
+        """Elimina todas las ubicaciones del SKU y devuelve lo que tenía."""
+        previas = self.existencias(codigo)
+        for u in previas:
+            self.fijar(codigo, u, 0)
+        self._total_sku.pop(codigo, None)
+        self._ubicaciones_sku.pop(codigo, None)
+        return previas
+
+    def transferir(self, codigo, origen, destino, cantidad):
+        if origen == destino:
+            raise ValueError("Origen y destino deben ser diferentes.")
+        if cantidad <= 0:
+            raise ValueError("La cantidad debe ser mayor que 0.")
+        disponible = self.cantidad(codigo, origen)
+        if cantidad > disponible:
+            raise ValueError(f"Stock insuficiente en {origen} (disponible: {disponible}).")
+        self.fijar(codigo, origen, disponible - cantidad)
+        self.fijar(codigo, destino, self.cantidad(codigo, destino) + cantidad)
+        return {"Código": codigo, "Origen": origen, "Destino": destino,
+                "Cantidad": cantidad, "fecha": datetime.now().isoformat()}
+
 class InventarioTaller:
     def __init__(self, root):
         self.root = root
@@ -24,6 +93,9 @@ class InventarioTaller:
         self.root.configure(bg="#0f172a")
 
         self.productos = []
+        self.stock = StockPorUbicacion()
+        self.indice = IndiceBusqueda()
+        self._id_por_codigo = {}    # Código -> id, junto al índice de stock
         self.edit_id = None
         self.next_id = 1
 
@@ -88,14 +160,31 @@ class InventarioTaller:
             entry.grid(row=i, column=1, sticky="w", padx=8, pady=6)
             self.entries[etiqueta] = entry
 
-        ttk.Label(left, text="Valor Total").grid(row=len(etiquetas), column=0, sticky="e", padx=8, pady=6)
+        ttk.Label(left, text="Ubicación").grid(row=len(etiquetas), column=0, sticky="e", padx=8, pady=6)
+        self.ubicacion_var = tk.StringVar(value=UBICACIONES[0])
+        self.ubicacion_cb = ttk.Combobox(left, values=UBICACIONES, textvariable=self.ubicacion_var, state="readonly", width=26)
+        self.ubicacion_cb.grid(row=len(etiquetas), column=1, sticky="w", padx=8, pady=6)
+        self.ubicacion_cb.bind("<<ComboboxSelected>>", self._on_ubicacion_change)
+
+        ttk.Label(left, text="Valor Total").grid(row=len(etiquetas)+1, column=0, sticky="e", padx=8, pady=6)
         self.valor_var = tk.StringVar(value=format_currency(0))
-        ttk.Label(left, textvariable=self.valor_var).grid(row=len(etiquetas), column=1, sticky="w")
+        ttk.Label(left, textvariable=self.valor_var).grid(row=len(etiquetas)+1, column=1, sticky="w")
+
+        ttk.Button(left, text="💾 Guardar", style="Menu.TButton", command=self._guardar_producto).grid(row=len(etiquetas)+2, column=1, sticky="w", pady=6)
+        ttk.Button(left, text="🧹 Limpiar", style="Menu.TButton", command=self._limpiar_formulario).grid(row=len(etiquetas)+3, column=1, sticky="w", pady=6)
+
+        # Totales por ubicación (mantenidos por el índice de stock)
+        self.totales_var = tk.StringVar(value="")
+        tk.Label(left, textvariable=self.totales_var, bg="#1e293b", fg="#e2e8f0", justify="left", anchor="w").grid(row=len(etiquetas)+4, column=0, columnspan=2, sticky="w", padx=8, pady=(12,6))
 
-        ttk.Button(left, text="💾 Guardar", style="Menu.TButton", command=self._guardar_producto).grid(row=len(etiquetas)+1, column=1, sticky="w", pady=6)
-        ttk.Button(left, text="🧹 Limpiar", style="Menu.TButton", command=self._limpiar_formulario).grid(row=len(etiquetas)+2, column=1, sticky="w", pady=6)
+        search_frame = tk.Frame(right, bg="#1e293b")
+        search_frame.pack(fill="x", pady=(0, 6))
+        ttk.Label(search_frame, text="🔎 Buscar").pack(side="left", padx=6)
+        self.busqueda_var = tk.StringVar()
+        self.busqueda_var.trace_add("write", lambda *_: self._aplicar_busqueda())
+        ttk.Entry(search_frame, textvariable=self.busqueda_var, width=40, style="Form.TEntry").pack(side="left", padx=6)
 
-        cols = ("Código","Producto","Cantidad","Precio Unitario","Valor Total")
+        cols = ("Código","Producto", *UBICACIONES, "Cantidad","Precio Unitario","Valor Total")
         self.tree = ttk.Treeview(right, columns=cols, show="headings", style="Treeview")
         for c in cols:
             self.tree.heading(c, text=c)
@@ -107,6 +196,7 @@ class InventarioTaller:
         ttk.Button(btn_frame, text="🆕 Nuevo", style="Menu.TButton", command=self._nuevo).pack(side="left", padx=6)
         ttk.Button(btn_frame, text="✏️ Modificar", style="Menu.TButton", command=self._cargar_seleccion_para_editar).pack(side="left", padx=6)
         ttk.Button(btn_frame, text="🗑️ Eliminar", style="Menu.TButton", command=self._eliminar_producto).pack(side="left", padx=6)
+        ttk.Button(btn_frame, text="🔁 Transferir", style="Menu.TButton", command=self._transferir).pack(side="left", padx=6)
         ttk.Button(btn_frame, text="📤 Exportar Excel", style="Menu.TButton", command=self._exportar_excel).pack(side="left", padx=6)
 
     # -------------------------
@@ -124,11 +214,47 @@ class InventarioTaller:
                 self.productos = json.load(f)
             ids = [p.get("id", 0) for p in self.productos]
             self.next_id = max(ids, default=0) + 1
+            fusionados = self._indexar_stock()
+            for p in self.productos:
+                self.indice.agregar(p.get("id"), p.get("Código", ""), p.get("Producto", ""))
             self._refrescar_treeview()
+            if fusionados:
+                self._guardar_a_archivo()
+                messagebox.showwarning("Códigos repetidos",
+                                       "Había productos con el mismo código; se unieron sumando sus existencias:\n"
+                                       + ", ".join(sorted(set(fusionados))[:20]))
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo leer la base de datos:\n{e}")
             self.productos = []
 
+    def _indexar_stock(self):
+        """
+        Arma el índice de stock y el de código -> id. Registros antiguos con el mismo
+        Código se unen en el primero sumando sus existencias (con la llave
+        (Código, ubicación) uno pisaba al otro y borrar uno vaciaba ambos).
+        Devuelve los códigos unidos.
+        """
+        self.stock = StockPorUbicacion()
+        self._id_por_codigo = {}
+        unicos, fusionados = [], []
+        for p in self.productos:
+            codigo = p.get("Código", "")
+            existencias = p.get("Existencias")
+            if existencias is None:
+                # Registro anterior a las sedes: todo el stock en la ubicación principal
+                existencias = {UBICACIONES[0]: p.get("Cantidad", 0)}
+            for u, cant in existencias.items():
+                self.stock.fijar(codigo, u, self.stock.cantidad(codigo, u) + float(cant or 0))
+            if codigo in self._id_por_codigo:
+                fusionados.append(codigo)
+                continue
+            self._id_por_codigo[codigo] = p.get("id")
+            unicos.append(p)
+        self.productos = unicos
+        for p in unicos:
+            self._sincronizar_producto(p)
+        return fusionados
+
     def _guardar_a_archivo(self):
         try:
             with open(DB_FILE, "w", encoding="utf-8") as f:
@@ -136,6 +262,27 @@ class InventarioTaller:
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo guardar la base de datos:\n{e}")
 
+    def _registrar_movimiento(self, mov):
+        # Solo se anexa una línea: una escritura fallida no toca los movimientos anteriores
+        try:
+            self._migrar_movimientos()
+            with open(MOVIMIENTOS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(mov, ensure_ascii=False) + "\n")
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo registrar el movimiento:\n{e}")
+
+    def _migrar_movimientos(self):
+        """Pasa una vez el movimientos_inventario.json anterior (lista JSON) al JSONL."""
+        if os.path.exists(MOVIMIENTOS_FILE) or not os.path.exists(MOVIMIENTOS_ANTERIOR):
+            return
+        with open(MOVIMIENTOS_ANTERIOR, "r", encoding="utf-8") as f:
+            movimientos = json.load(f)
+        tmp = MOVIMIENTOS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(m, ensure_ascii=False) + "\n" for m in movimientos)
+        os.replace(tmp, MOVIMIENTOS_FILE)
+        os.replace(MOVIMIENTOS_ANTERIOR, MOVIMIENTOS_ANTERIOR + ".migrado")
+
     # -------------------------
     # Lógica
     # -------------------------
@@ -148,6 +295,10 @@ class InventarioTaller:
         if not codigo or not producto:
             messagebox.showwarning("Validación", "Código y Producto son obligatorios.")
             return False
+        duplicado = self._id_por_codigo.get(codigo)
+        if duplicado is not None and duplicado != self.edit_id:
+            messagebox.showwarning("Validación", f"Ya existe un producto con el código {codigo}.")
+            return False
         try:
             c = float(cantidad)
             if c < 0: raise ValueError()
@@ -175,34 +326,62 @@ class InventarioTaller:
         producto = self.entries["Producto"].get().strip()
         cantidad = float(self.entries["Cantidad"].get().strip())
         precio = float(self.entries["Precio Unitario"].get().strip())
-        valor_total = int(round(cantidad * precio))
-
-        datos = {"Código": codigo, "Producto": producto,
-                 "Cantidad": cantidad, "Precio Unitario": precio,
-                 "Valor Total": valor_total}
+        ubicacion = self.ubicacion_var.get()
 
         if self.edit_id is None:
-            nuevo = {"id": self.next_id, **datos, "created_at": datetime.now().isoformat()}
+            self.stock.fijar(codigo, ubicacion, cantidad)
+            nuevo = {"id": self.next_id, "Código": codigo, "Producto": producto,
+                     "Precio Unitario": precio, "created_at": datetime.now().isoformat()}
+            self._sincronizar_producto(nuevo)
             self.productos.append(nuevo)
+            self._id_por_codigo[codigo] = nuevo["id"]
             self.next_id += 1
+            self.tree.insert("", "end", iid=str(nuevo["id"]), values=self._valores_fila(nuevo))
+            self.indice.agregar(nuevo["id"], codigo, producto)
             messagebox.showinfo("Guardado", "Producto creado correctamente.")
         else:
-            for p in self.productos:
-                if p.get("id") == self.edit_id:
-                    p.update(datos)
-                    p["updated_at"] = datetime.now().isoformat()
-                    break
+            p = next((x for x in self.productos if x.get("id") == self.edit_id), None)
+            if p is not None:
+                anterior = p.get("Código", "")
+                if anterior != codigo:
+                    # Cambio de código: mover las existencias al nuevo SKU
+                    for u, cant in self.stock.quitar_sku(anterior).items():
+                        self.stock.fijar(codigo, u, cant)
+                    self._id_por_codigo.pop(anterior, None)
+                    self._id_por_codigo[codigo] = p["id"]
+                self.stock.fijar(codigo, ubicacion, cantidad)
+                p.update({"Código": codigo, "Producto": producto, "Precio Unitario": precio})
+                self._sincronizar_producto(p)
+                p["updated_at"] = datetime.now().isoformat()
+                self.tree.item(str(p["id"]), values=self._valores_fila(p))
+                self.indice.agregar(p["id"], codigo, producto)
             messagebox.showinfo("Actualizado", "Producto actualizado correctamente.")
             self.edit_id = None
 
         self._guardar_a_archivo()
-        self._refrescar_treeview()
+        self._actualizar_totales()
         self._limpiar_formulario()
 
+    def _sincronizar_producto(self, p):
+        """Copia al registro las existencias y el total del índice (Cantidad = suma de sedes)."""
+        codigo = p.get("Código", "")
+        p["Existencias"] = self.stock.existencias(codigo)
+        p["Cantidad"] = self.stock.total_sku(codigo)
+        p["Valor Total"] = self._calcular_valor(p["Cantidad"], p.get("Precio Unitario", 0))
+
+    def _on_ubicacion_change(self, event=None):
+        # Al editar, mostrar la cantidad de la sede elegida
+        if self.edit_id is None:
+            return
+        codigo = self.entries["Código"].get().strip()
+        self.entries["Cantidad"].delete(0, tk.END)
+        self.entries["Cantidad"].insert(0, str(self.stock.cantidad(codigo, self.ubicacion_var.get())))
+
     def _limpiar_formulario(self):
         for k in self.entries:
             self.entries[k].delete(0, tk.END)
         self.valor_var.set(format_currency(0))
+        self.ubicacion_var.set(UBICACIONES[0])
         self.edit_id = None
                  
         for sel in self.tree.selection():
@@ -212,17 +391,35 @@ class InventarioTaller:
         self._limpiar_formulario()
         self.entries["Código"].focus_set()
 
+    def _valores_fila(self, p):
+        codigo = p.get("Código", "")
+        por_sede = [f"{self.stock.cantidad(codigo, u)}" for u in UBICACIONES]
+        return (codigo, p.get("Producto", ""), *por_sede,
+                f"{self.stock.total_sku(codigo)}",
+                format_currency(p.get("Precio Unitario", 0)), format_currency(p.get("Valor Total", 0)))
+
+    def _actualizar_totales(self):
+        lineas = [f"{u}: {self.stock.total_ubicacion(u):g} und." for u in UBICACIONES]
+        self.totales_var.set("\n".join(lineas))
+
     def _refrescar_treeview(self):
         for i in self.tree.get_children():
             self.tree.delete(i)
         for p in self.productos:
-            iid = str(p.get("id"))
-            cantidad = p.get("Cantidad", 0)
-            precio = p.get("Precio Unitario", 0)
-            valor = p.get("Valor Total", 0)
-            self.tree.insert("", "end", iid=iid,
-                             values=(p.get("Código", ""), p.get("Producto", ""),
-                                     f"{cantidad}", format_currency(precio), format_currency(valor)))
+            self.tree.insert("", "end", iid=str(p.get("id")), values=self._valores_fila(p))
+        self._actualizar_totales()
+        self._aplicar_busqueda()
+
+    def _aplicar_busqueda(self):
+        """Deja visibles solo las filas que coinciden (código o nombre), en orden de relevancia."""
+        texto = self.busqueda_var.get().strip()
+        if not texto:
+            for i, p in enumerate(self.productos):
+                self.tree.reattach(str(p.get("id")), "", i)
+            return
+        self.tree.detach(*self.tree.get_children())
+        for i, (pid, _) in enumerate(self.indice.buscar(texto, limite=200)):
+            self.tree.reattach(str(pid), "", i)
 
     def _cargar_seleccion_para_editar(self):
         sel = self.tree.selection()
@@ -244,7 +441,8 @@ class InventarioTaller:
         # cargar en formulario
         self.entries["Código"].delete(0, tk.END); self.entries["Código"].insert(0, producto.get("Código", ""))
         self.entries["Producto"].delete(0, tk.END); self.entries["Producto"].insert(0, producto.get("Producto", ""))
-        self.entries["Cantidad"].delete(0, tk.END); self.entries["Cantidad"].insert(0, str(producto.get("Cantidad", "")))
+        self.ubicacion_var.set(UBICACIONES[0])
+        self.entries["Cantidad"].delete(0, tk.END); self.entries["Cantidad"].insert(0, str(self.stock.cantidad(producto.get("Código", ""), UBICACIONES[0])))
         self.entries["Precio Unitario"].delete(0, tk.END); self.entries["Precio Unitario"].insert(0, str(producto.get("Precio Unitario", "")))
         self.valor_var.set(format_currency(producto.get("Valor Total", 0)))
         self.edit_id = pid
@@ -264,12 +462,68 @@ class InventarioTaller:
         if not messagebox.askyesno("Confirmar", "¿Desea eliminar el producto seleccionado? Esta acción no se puede deshacer."):
             return
 
+        eliminado = next((p for p in self.productos if p.get("id") == pid), None)
+        if eliminado is not None:
+            self.stock.quitar_sku(eliminado.get("Código", ""))
+            self._id_por_codigo.pop(eliminado.get("Código", ""), None)
+        self.indice.quitar(pid)
         self.productos = [p for p in self.productos if p.get("id") != pid]
         self._guardar_a_archivo()
-        self._refrescar_treeview()
+        self.tree.delete(iid)
+        self._actualizar_totales()
         self._limpiar_formulario()
         messagebox.showinfo("Eliminado", "Producto eliminado correctamente.")
 
+    def _transferir(self):
+        sel = self.tree.selection()
+        if not sel:
+            messagebox.showwarning("Atención", "Seleccione un producto para transferir.")
+            return
+        pid = int(sel[0])
+        producto = next((p for p in self.productos if p.get("id") == pid), None)
+        if producto is None:
+            messagebox.showerror("Error", "Producto no encontrado en la base de datos.")
+            return
+        codigo = producto.get("Código", "")
+
+        top = tk.Toplevel(self.root)
+        top.title(f"Transferir - {codigo}")
+        top.configure(bg="#0f172a")
+
+        tk.Label(top, text=f"{codigo} | {producto.get('Producto', '')}", bg="#0f172a", fg="#e2e8f0").grid(row=0, column=0, columnspan=2, sticky="w", padx=12, pady=6)
+        origen_var = tk.StringVar(value=UBICACIONES[0])
+        destino_var = tk.StringVar(value=UBICACIONES[-1])
+        cantidad_var = tk.StringVar(value="1")
+        for i, (txt, widget) in enumerate([
+            ("Origen", ttk.Combobox(top, values=UBICACIONES, textvariable=origen_var, state="readonly", width=20)),
+            ("Destino", ttk.Combobox(top, values=UBICACIONES, textvariable=destino_var, state="readonly", width=20)),
+            ("Cantidad", ttk.Entry(top, textvariable=cantidad_var, width=12)),
+        ], start=1):
+            tk.Label(top, text=txt, bg="#0f172a", fg="#e2e8f0").grid(row=i, column=0, sticky="e", padx=12, pady=4)
+            widget.grid(row=i, column=1, sticky="w", padx=12, pady=4)
+
+        def do_transferir():
+            try:
+                cantidad = float(cantidad_var.get())
+            except ValueError:
+                messagebox.showwarning("Validación", "Cantidad debe ser un número válido.", parent=top)
+                return
+            try:
+                mov = self.stock.transferir(codigo, origen_var.get(), destino_var.get(), cantidad)
+            except ValueError as e:
+                messagebox.showwarning("Validación", str(e), parent=top)
+                return
+            producto["Existencias"] = self.stock.existencias(codigo)
+            producto["updated_at"] = mov["fecha"]
+            self._guardar_a_archivo()
+            self._registrar_movimiento(mov)
+            self.tree.item(str(pid), values=self._valores_fila(producto))
+            self._actualizar_totales()
+            messagebox.showinfo("Transferencia", f"{cantidad:g} und. de {codigo} de {mov['Origen']} a {mov['Destino']}.", parent=top)
+            top.destroy()
+
+        ttk.Button(top, text="Transferir", style="Menu.TButton", command=do_transferir).grid(row=4, column=1, sticky="w", padx=12, pady=8)
+
     def _exportar_excel(self):
         if not self.productos:
             messagebox.showwarning("Atención", "No hay productos para exportar.")
@@ -284,14 +538,16 @@ class InventarioTaller:
             ws = wb.active
             ws.title = "Inventario"
 
-            encabezados = ["ID", "Código", "Producto", "Cantidad", "Precio Unitario", "Valor Total", "Creado", "Actualizado"]
+            encabezados = ["ID", "Código", "Producto", *UBICACIONES, "Cantidad", "Precio Unitario", "Valor Total", "Creado", "Actualizado"]
             ws.append(encabezados)
 
             for p in self.productos:
+                codigo = p.get("Código", "")
                 ws.append([
                     p.get("id"),
-                    p.get("Código", ""),
+                    codigo,
                     p.get("Producto", ""),
+                    *[self.stock.cantidad(codigo, u) for u in UBICACIONES],
                     p.get("Cantidad", 0),
                     p.get("Precio Unitario", 0),
                     p.get("Valor Total", 0),
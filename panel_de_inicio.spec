@@ -5,7 +5,7 @@ a = Analysis(
     ['panel_de_inicio.py'],
     pathex=[],
     binaries=[],
-    datas=[('python_ordenes_taller.py', '.'), ('ventas_taller.py', '.'), ('clientes_taller.py', '.'), ('proveedores_taller.py', '.'), ('modulo_inventario.py', '.'), ('seguridad_taller.py', '.'), ('pasarela_pagos.py', '.'), ('nomina_taller.py', '.'), ('compras_taller.py', '.'), ('cartera_taller.py', '.'), ('reportes_taller.py', '.'), ('config_taller.py', '.'), ('panel_de_inicio_fondo.png', '.'), ('licencias.json', '.'), ('security_core.py', '.')],
+    datas=[('python_ordenes_taller.py', '.'), ('ventas_taller.py', '.'), ('clientes_taller.py', '.'), ('proveedores_taller.py', '.'), ('modulo_inventario.py', '.'), ('seguridad_taller.py', '.'), ('pasarela_pagos.py', '.'), ('nomina_taller.py', '.'), ('compras_taller.py', '.'), ('cartera_taller.py', '.'), ('reportes_taller.py', '.'), ('config_taller.py', '.'), ('panel_de_inicio_fondo.png', '.'), ('licencias.json', '.'), ('security_core.py', '.'), ('busqueda_taller.py', '.'), ('procesador_pagos.py', '.'), ('vault_core.py', '.'), ('lotes_pagos.py', '.'), ('conciliacion_pagos.py', '.'), ('cierre_caja.py', '.'), ('historial_pagos.py', '.'), ('exportacion_pagos.py', '.'), ('tarjetas_lote.py', '.'), ('bin_marcas.py', '.'), ('auditoria_log.py', '.'), ('indice_auditoria.py', '.'), ('visor_auditoria.py', '.'), ('integridad_auditoria.py', '.'), ('analitica_sesiones.py', '.'), ('gestor_llaves.py', '.'), ('contrasenas_filtradas.py', '.'), ('bloqueo_archivos.py', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -4,37 +4,46 @@
 # Conserva integración con security_core (audit, telemetry) y cifrado con contraseña maestra.
 
 import os
+import csv
 import json
 import uuid
-import secrets
-import time
-import base64
-import hashlib
-from datetime import datetime, timedelta
+import queue
+import threading
+from datetime import datetime
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-
-import openpyxl
-
-from security_core import audit, module_opened, module_closed, button_clicked, view_attempt, copy_to_clipboard_then_clear
+from cryptography.fernet import InvalidToken
+
+from security_core import audit, module_opened, module_closed, button_clicked, view_attempt, copy_to_clipboard_then_clear, get_current_user
+from vault_core import RecordVault
+from procesador_pagos import PaymentDispatcher, IdempotencyStore, make_processor, new_idempotency_key
+import lotes_pagos
+import conciliacion_pagos
+import cierre_caja
+from historial_pagos import TransactionIndex, PAGE_SIZE
+import exportacion_pagos
+import tarjetas_lote
+from bin_marcas import detect_brand, bin_table
+from visor_auditoria import VisorAuditoria
+from gestor_llaves import store_fernet, touch_session, legacy_fernet, run_with_busy, STORE_PAGOS
+from bloqueo_archivos import bloqueo
 
 # ---- Config ----
 BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
-PAYMENT_FILE = os.path.join(BASE_DIR, "payment_methods.json.enc")
+PAYMENT_FILE = os.path.join(BASE_DIR, "payment_methods.json.enc")  # formato anterior (migrado a la bóveda)
+PAYMENT_VAULT_FILE = os.path.join(BASE_DIR, "payment_methods.vault")
 TRANSACTIONS_FILE = os.path.join(BASE_DIR, "transactions.json")
-MASTER_FILE = os.path.join(BASE_DIR, "master_auth.json")
-LEGACY_KEY_FILE = os.path.join(BASE_DIR, "security.key")
-AUDIT_LOG = os.path.join(BASE_DIR, "security_audit.log")
+IDEMPOTENCY_FILE = os.path.join(BASE_DIR, "idempotency_keys.jsonl")
 
-KDF_ITERATIONS = 300_000
-MAX_MASTER_ATTEMPTS = 5
-LOCKOUT_SECONDS = 300
-SESSION_TIMEOUT_SECONDS = 600
+# Procesador: None usa el sandbox local en proceso; una URL usa el procesador HTTP
+# (p. ej. "http://127.0.0.1:8765/charges" con `python procesador_pagos.py --sandbox`)
+PROCESSOR_URL = os.environ.get("TALLER_PROCESSOR_URL") or None
+PROCESSOR_TIMEOUT_SECONDS = 5
+PROCESSOR_RETRIES = 2
+PROCESSOR_WORKERS = 8
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
 
 # ---- Helpers ----
 def ensure_base_dir():
@@ -48,119 +57,12 @@ def _set_private_file_permissions(path):
     except Exception:
         pass
 
-def _derive_fernet_key(password: str, enc_salt_b64: str, iterations: int):
-    enc_salt = base64.b64decode(enc_salt_b64)
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=enc_salt,
-        iterations=iterations,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password.encode("utf-8")))
-    return key
-
-# Master session cache
-_master_failed_count = 0
-_lockout_until = None
-_session_fernet = None
-_session_expires = None
-
-def master_exists():
-    return os.path.exists(MASTER_FILE)
-
-def create_master_interactive(parent):
-    ensure_base_dir()
-    p1 = simpledialog.askstring("Crear contraseña maestra", "Ingrese contraseña maestra:", show="*", parent=parent)
-    if not p1:
-        return False
-    p2 = simpledialog.askstring("Confirmar contraseña maestra", "Reingrese la contraseña maestra:", show="*", parent=parent)
-    if p1 != p2:
-        messagebox.showerror("Error", "Las contraseñas no coinciden.")
-        return False
-    salt = secrets.token_bytes(16)
-    dk = hashlib.pbkdf2_hmac("sha256", p1.encode("utf-8"), salt, KDF_ITERATIONS)
-    enc_salt = secrets.token_bytes(16)
-    data = {
-        "salt": base64.b64encode(salt).decode("ascii"),
-        "hash": base64.b64encode(dk).decode("ascii"),
-        "enc_salt": base64.b64encode(enc_salt).decode("ascii"),
-        "iterations": KDF_ITERATIONS
-    }
-    with open(MASTER_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f)
-    _set_private_file_permissions(MASTER_FILE)
-    audit("master_created", "")
-    return True
-
 def verify_master_and_get_fernet(parent, purpose="acción sensible", require_create=True):
-    global _master_failed_count, _lockout_until, _session_fernet, _session_expires
-    ensure_base_dir()
-    now = datetime.now()
-    if _session_fernet is not None and _session_expires and now < _session_expires:
-        return _session_fernet
-    if _lockout_until and now < _lockout_until:
-        secs = int((_lockout_until - now).total_seconds())
-        messagebox.showerror("Bloqueado", f"Demasiados intentos fallidos. Intenta nuevamente en {secs} segundos.")
-        return None
-    if not master_exists():
-        if require_create and messagebox.askyesno("Contraseña maestra no encontrada", "No existe una contraseña maestra. ¿Desea crearla ahora?"):
-            ok = create_master_interactive(parent)
-            if not ok:
-                return None
-        else:
-            return None
-    try:
-        with open(MASTER_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        salt = base64.b64decode(data["salt"])
-        stored_hash = base64.b64decode(data["hash"])
-        enc_salt_b64 = data["enc_salt"]
-        iterations = int(data.get("iterations", KDF_ITERATIONS))
-    except Exception as e:
-        messagebox.showerror("Error", f"No se pudo leer configuración de la maestra: {e}")
-        audit("master_read_failed", str(e))
-        return None
-    attempt = simpledialog.askstring("Contraseña maestra", f"Ingrese la contraseña maestra para {purpose}:", show="*", parent=parent)
-    if attempt is None:
-        return None
-    dk = hashlib.pbkdf2_hmac("sha256", attempt.encode("utf-8"), salt, iterations)
-    if not secrets.compare_digest(dk, stored_hash):
-        _master_failed_count += 1
-        audit("master_failed", purpose)
-        if _master_failed_count >= MAX_MASTER_ATTEMPTS:
-            _lockout_until = datetime.now() + timedelta(seconds=LOCKOUT_SECONDS)
-            _master_failed_count = 0
-            messagebox.showerror("Bloqueado", f"Demasiados intentos fallidos. Bloqueado por {LOCKOUT_SECONDS} segundos.")
-        else:
-            remaining = MAX_MASTER_ATTEMPTS - _master_failed_count
-            messagebox.showerror("Error", f"Contraseña maestra incorrecta. Intentos restantes: {remaining}")
-        return None
-    try:
-        key = _derive_fernet_key(attempt, enc_salt_b64, iterations)
-        f = Fernet(key)
-        _session_fernet = f
-        _session_expires = datetime.now() + timedelta(seconds=SESSION_TIMEOUT_SECONDS)
-        _master_failed_count = 0
-        audit("master_verified", purpose)
-        return f
-    except Exception as e:
-        audit("master_derive_failed", str(e))
-        messagebox.showerror("Error", f"No se pudo derivar la clave: {e}")
-        return None
-
-# Legacy helper
-def _legacy_key_exists():
-    return os.path.exists(LEGACY_KEY_FILE)
-
-def _load_legacy_fernet():
-    try:
-        with open(LEGACY_KEY_FILE, "rb") as f:
-            key = f.read()
-        return Fernet(key)
-    except Exception:
-        return None
+    """Fernet de la clave de datos de la pasarela (almacén "pagos" de gestor_llaves)."""
+    return store_fernet(parent, STORE_PAGOS, purpose, require_create)
 
 def _migrate_payment_file_if_needed(fernet_new):
+    # Formato muy anterior: blob cifrado con la antigua security.key (hoy la guarda gestor_llaves)
     if not os.path.exists(PAYMENT_FILE):
         return
     try:
@@ -170,106 +72,238 @@ def _migrate_payment_file_if_needed(fernet_new):
         return
     except Exception:
         pass
-    if _legacy_key_exists():
-        legacy_f = _load_legacy_fernet()
-        if legacy_f:
+    legacy_f = legacy_fernet()
+    if legacy_f:
+        try:
+            with open(PAYMENT_FILE, "rb") as f:
+                enc = f.read()
+            data = legacy_f.decrypt(enc)
+            bak = PAYMENT_FILE + ".bak-" + datetime.now().strftime("%Y%m%d%H%M%S")
             try:
-                with open(PAYMENT_FILE, "rb") as f:
-                    enc = f.read()
-                data = legacy_f.decrypt(enc)
-                bak = PAYMENT_FILE + ".bak-" + datetime.now().strftime("%Y%m%d%H%M%S")
+                os.replace(PAYMENT_FILE, bak)
+            except Exception:
                 try:
-                    os.replace(PAYMENT_FILE, bak)
-                except Exception:
-                    try:
-                        import shutil
-                        shutil.copy2(PAYMENT_FILE, bak)
-                    except Exception:
-                        pass
-                new_enc = fernet_new.encrypt(data)
-                with open(PAYMENT_FILE, "wb") as f:
-                    f.write(new_enc)
-                _set_private_file_permissions(PAYMENT_FILE)
-                audit("migrated_payment_file", f"backup={os.path.basename(bak)}")
-                try:
-                    os.remove(LEGACY_KEY_FILE)
-                    audit("legacy_key_removed", "")
+                    import shutil
+                    shutil.copy2(PAYMENT_FILE, bak)
                 except Exception:
                     pass
-            except Exception as e:
-                audit("migration_failed", str(e))
-                return
+            new_enc = fernet_new.encrypt(data)
+            with open(PAYMENT_FILE, "wb") as f:
+                f.write(new_enc)
+            _set_private_file_permissions(PAYMENT_FILE)
+            audit("migrated_payment_file", f"backup={os.path.basename(bak)}")
+        except Exception as e:
+            audit("migration_failed", str(e))
+            return
 
 # Storage helpers using session fernet
 def _fernet_for_storage(parent):
     f = verify_master_and_get_fernet(parent, "operaciones de la pasarela")
     return f
 
-def load_payment_methods(parent):
-    ensure_base_dir()
-    if not os.path.exists(PAYMENT_FILE):
-        return []
+def _load_payment_blob(parent):
+    """Lee el formato anterior (un solo blob cifrado con toda la lista). Solo para migrar."""
     f = _fernet_for_storage(parent)
     if f is None:
-        messagebox.showwarning("Acceso denegado", "No se proporcionó la contraseña maestra. No se pueden cargar métodos tokenizados.")
-        return []
+        messagebox.showwarning("Acceso denegado", "No se proporcionó la contraseña maestra. No se pueden migrar métodos tokenizados.")
+        return None
     try:
         with open(PAYMENT_FILE, "rb") as fh:
             enc = fh.read()
         data = f.decrypt(enc)
-        arr = json.loads(data.decode("utf-8"))
-        return arr
+        return json.loads(data.decode("utf-8"))
     except InvalidToken:
         try:
             _migrate_payment_file_if_needed(f)
             with open(PAYMENT_FILE, "rb") as fh:
                 enc = fh.read()
             data = f.decrypt(enc)
-            arr = json.loads(data.decode("utf-8"))
-            return arr
+            return json.loads(data.decode("utf-8"))
         except Exception as e:
             audit("load_payment_methods_failed", str(e))
             messagebox.showerror("Error", "No se pudo desencriptar métodos tokenizados. Verifica la contraseña maestra o la key legacy.")
-            return []
+            return None
     except Exception as e:
         audit("load_payment_methods_failed", str(e))
-        return []
+        return None
+
+# Bóveda por registro: cada tarjeta conserva su propio "enc" (Fernet) y el índice
+# token -> offset guarda en claro solo máscara/BIN/marca/fecha.
+_card_vault = None
+
+def card_vault():
+    global _card_vault
+    if _card_vault is None:
+        ensure_base_dir()
+        _card_vault = RecordVault(PAYMENT_VAULT_FILE)
+    return _card_vault
 
-def save_payment_methods(parent, arr):
+def _migrate_payment_blob_to_vault(parent):
+    if not os.path.exists(PAYMENT_FILE):
+        return
+    arr = _load_payment_blob(parent)
+    if arr is None:
+        return
+    vault = card_vault()
+    for m in arr:
+        if m.get("token") and m.get("token") not in vault:
+            vault.put(m["token"], {"mask": m.get("mask"), "brand": m.get("brand", ""), "created_at": m.get("created_at")}, m.get("enc"))
+    vault.checkpoint()
+    bak = PAYMENT_FILE + ".migrated-" + datetime.now().strftime("%Y%m%d%H%M%S")
+    os.replace(PAYMENT_FILE, bak)
+    audit("payment_vault_migrated", f"records={len(arr)} backup={os.path.basename(bak)}")
+
+def load_payment_methods(parent):
+    """Metadatos de los métodos tokenizados (sin desencriptar nada)."""
     ensure_base_dir()
-    f = _fernet_for_storage(parent)
-    if f is None:
-        messagebox.showwarning("Acceso denegado", "No se proporcionó la contraseña maestra. No se pueden guardar métodos tokenizados.")
-        return False
     try:
-        data = json.dumps(arr, ensure_ascii=False, indent=2).encode("utf-8")
-        enc = f.encrypt(data)
-        with open(PAYMENT_FILE, "wb") as fh:
-            fh.write(enc)
-        _set_private_file_permissions(PAYMENT_FILE)
-        return True
+        _migrate_payment_blob_to_vault(parent)
+        return [dict(meta, token=token) for token, meta in card_vault().items()]
     except Exception as e:
-        audit("save_payment_methods_failed", str(e))
-        messagebox.showerror("Error", f"No se pudo guardar métodos tokenizados: {e}")
-        return False
+        audit("load_payment_methods_failed", str(e))
+        return []
 
-def load_transactions():
-    ensure_base_dir()
+def card_brand_meta(card):
+    """BIN (primeros 6, como en el voucher), marca y tipo según la tabla BIN vigente."""
+    bin6 = "".join(ch for ch in card if ch.isdigit())[:6]
+    brand, card_type = detect_brand(bin6)
+    return {"bin": bin6, "brand": brand, "card_type": card_type}
+
+def add_payment_method(token, mask, card, enc):
+    meta = {"mask": mask, **card_brand_meta(card), "created_at": datetime.now().isoformat()}
+    card_vault().put(token, meta, enc)
+    return dict(meta, token=token)
+
+def add_payment_methods_bulk(cards, fernet, progress=None):
+    """
+    cards: [(numero, exp, mask, brand, card_type)] ya validadas. Cifra cada tarjeta
+    y las escribe a la bóveda en una sola pasada. Devuelve los metadatos agregados.
+    """
+    created = datetime.now().isoformat()
+    items, methods = [], []
+    for card, exp, mask, brand, card_type in cards:
+        token = str(uuid.uuid4())
+        meta = {"mask": mask, "bin": card[:6], "brand": brand, "card_type": card_type, "created_at": created}
+        enc = fernet.encrypt(json.dumps({"card": card, "exp": exp}).encode("utf-8")).decode("utf-8")
+        items.append((token, meta, enc))
+        methods.append(dict(meta, token=token))
+    card_vault().put_many(items)
+    return methods
+
+def backfill_card_brands(fernet=None):
+    """
+    Aplica la tabla BIN vigente a los métodos guardados. Los que ya tienen "bin" se
+    reclasifican sin descifrar; los anteriores a la tabla (sin "bin") necesitan
+    fernet para leer el número una sola vez. Solo reescribe los que cambian (el
+    blob cifrado se copia tal cual). Devuelve (actualizados, pendientes).
+    """
+    vault = card_vault()
+    items, pending = [], 0
+    for token, meta in vault.items():
+        if meta.get("bin"):
+            brand, card_type = detect_brand(meta["bin"])
+            new_meta = dict(meta, brand=brand, card_type=card_type)
+        elif fernet is None:
+            pending += 1
+            continue
+        else:
+            try:
+                payload = fernet.decrypt(vault.get_blob(token).encode("utf-8"))
+                new_meta = dict(meta, **card_brand_meta(json.loads(payload.decode("utf-8")).get("card", "")))
+            except Exception as e:
+                audit("card_brand_backfill_failed", f"token={token} error={e}")
+                continue
+        if new_meta != meta:
+            items.append((token, new_meta, vault.get_blob(token)))
+    if items:
+        vault.put_many(items)
+        audit("card_brand_backfill", f"updated={len(items)} pending={pending} table_version={bin_table().version}")
+    return len(items), pending
+
+def delete_payment_method(token):
+    return card_vault().delete(token)
+
+def payment_method_blob(token):
+    return card_vault().get_blob(token)
+
+def _read_transactions():
+    """Historial completo; ValueError si el archivo existe pero no se puede interpretar."""
     if not os.path.exists(TRANSACTIONS_FILE):
         return []
+    with open(TRANSACTIONS_FILE, "r", encoding="utf-8") as f:
+        txs = json.load(f)
+    if not isinstance(txs, list):
+        raise ValueError("transactions.json no contiene una lista de transacciones")
+    return txs
+
+def load_transactions():
+    """Para mostrar y consultar: un archivo ilegible se audita y se ve como vacío."""
+    ensure_base_dir()
     try:
-        with open(TRANSACTIONS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
+        return _read_transactions()
+    except (OSError, ValueError) as e:
+        audit("transactions_read_failed", str(e))
         return []
 
+# Índice del navegador de transacciones: se construye una vez y save_transactions lo
+# mantiene; si transactions.json cambia por fuera (mtime distinto) se reconstruye.
+_tx_index = None
+_tx_index_mtime = None
+
+def transaction_index():
+    global _tx_index, _tx_index_mtime
+    mtime = os.path.getmtime(TRANSACTIONS_FILE) if os.path.exists(TRANSACTIONS_FILE) else None
+    if _tx_index is None or mtime != _tx_index_mtime:
+        _tx_index = TransactionIndex(load_transactions())
+        _tx_index_mtime = mtime
+    return _tx_index
+
+def _index_new_transactions(new_txs):
+    global _tx_index_mtime
+    if _tx_index is None:
+        return
+    for tx in new_txs:
+        _tx_index.add(tx)
+    _tx_index_mtime = os.path.getmtime(TRANSACTIONS_FILE)
+
 def save_transaction(tx):
+    save_transactions([tx])
+
+def save_transactions(new_txs):
+    """
+    Agrega varias transacciones con una sola lectura/escritura del archivo (lotes).
+    La pasarela y la ventana de lotes pueden escribir a la vez: se relee y se
+    reemplaza (temporal + os.replace) con el candado del archivo tomado. Si el
+    archivo existente no se puede leer, se lanza el error en vez de pisar el
+    historial con solo las filas nuevas.
+    """
     ensure_base_dir()
-    txs = load_transactions()
-    txs.append(tx)
-    with open(TRANSACTIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(txs, f, ensure_ascii=False, indent=2)
-    _set_private_file_permissions(TRANSACTIONS_FILE)
+    with bloqueo(TRANSACTIONS_FILE + ".lock"):
+        txs = _read_transactions()
+        txs.extend(new_txs)
+        tmp = TRANSACTIONS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(txs, f, ensure_ascii=False, indent=2)
+        _set_private_file_permissions(tmp)
+        os.replace(tmp, TRANSACTIONS_FILE)
+        try:
+            cierre_caja.registrar(new_txs, txs)
+        except Exception as e:
+            audit("settlement_update_failed", str(e))
+        _index_new_transactions(new_txs)
+
+def reconcile_receivables(txs):
+    """Aplica a cartera los pagos aprobados recién guardados. Nunca interrumpe el cobro."""
+    if not any(t.get("status") == "approved" for t in txs):
+        return None
+    try:
+        result = conciliacion_pagos.conciliar(txs)
+    except Exception as e:
+        audit("reconcile_failed", str(e))
+        return None
+    if result["aplicadas"]:
+        audit("reconcile_applied", f"abonos={len(result['aplicadas'])} sin_conciliar={len(result['sin_conciliar'])}")
+    return result
 
 # ---- UI: Pasarela de Pagos (original colors preserved) ----
 PAYMENT_METHODS = [
@@ -290,8 +324,22 @@ class PasarelaPagos:
         self.root.geometry("1000x700")
         self.root.minsize(900, 600)
         module_opened("PasarelaPagos", "window_created")
+        try:
+            idempotency = IdempotencyStore(IDEMPOTENCY_FILE, IDEMPOTENCY_TTL_SECONDS)
+        except Exception as e:
+            audit("idempotency_load_failed", str(e))
+            idempotency = IdempotencyStore(None, IDEMPOTENCY_TTL_SECONDS)
+        self.dispatcher = PaymentDispatcher(make_processor(PROCESSOR_URL), workers=PROCESSOR_WORKERS,
+                                            timeout=PROCESSOR_TIMEOUT_SECONDS, retries=PROCESSOR_RETRIES,
+                                            idempotency=idempotency)
+        self._pending = 0
+        self._attempt_key = None      # llave del intento de pago actual (se renueva al cambiar el formulario)
+        self._inflight_keys = set()
         self._setup_styles()
         self._build_ui()
+        self._watch_payment_form()
+        self.root.bind("<KeyPress>", lambda e: touch_session(), add="+")
+        self.root.bind("<ButtonPress>", lambda e: touch_session(), add="+")
         self._load_data()
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
 
@@ -336,6 +384,10 @@ class PasarelaPagos:
         # Botones acción
         ttk.Button(frame, text="Procesar pago", style="Menu.TButton", command=self._on_process_payment).grid(row=9, column=1, pady=10, sticky="w")
         ttk.Button(frame, text="Tokenizar tarjeta (guardar)", style="Menu.TButton", command=self._on_tokenize_card).grid(row=9, column=2, pady=10, sticky="w")
+        self.busy_var = tk.StringVar(value="")
+        tk.Label(frame, textvariable=self.busy_var, bg="#0f172a", fg="#fbbf24").grid(row=10, column=1, columnspan=2, sticky="w")
+        ttk.Button(frame, text="Pagos por lote (flotas)", style="Menu.TButton", command=self._open_batch_window).grid(row=11, column=1, pady=6, sticky="w")
+        ttk.Button(frame, text="Cierre de caja", style="Menu.TButton", command=self._open_cash_close).grid(row=11, column=2, pady=6, sticky="w")
 
         # Right: métodos tokenizados y transacciones
         tk.Label(frame, text="Métodos tokenizados:", bg="#0f172a", fg="#e2e8f0").grid(row=1, column=3, sticky="w", padx=12)
@@ -343,7 +395,25 @@ class PasarelaPagos:
         self.methods_tree.heading("token", text="Token"); self.methods_tree.heading("mask", text="Tarjeta"); self.methods_tree.heading("brand", text="Marca")
         self.methods_tree.grid(row=2, column=3, rowspan=4, padx=12, sticky="nsew")
 
-        tk.Label(frame, text="Transacciones:", bg="#0f172a", fg="#e2e8f0").grid(row=6, column=3, sticky="w", padx=12, pady=(8,0))
+        tx_bar = tk.Frame(frame, bg="#0f172a")
+        tx_bar.grid(row=6, column=3, sticky="ew", padx=12, pady=(8,0))
+        tk.Label(tx_bar, text="Transacciones:", bg="#0f172a", fg="#e2e8f0").grid(row=0, column=0, sticky="w")
+        self.tx_filter_vars = {f: tk.StringVar() for f in ("cliente", "method", "status", "desde", "hasta")}
+        tk.Label(tx_bar, text="Cliente", bg="#0f172a", fg="#e2e8f0").grid(row=0, column=1, sticky="e", padx=(8,2))
+        ttk.Entry(tx_bar, textvariable=self.tx_filter_vars["cliente"], width=16).grid(row=0, column=2, sticky="w")
+        tk.Label(tx_bar, text="Método", bg="#0f172a", fg="#e2e8f0").grid(row=0, column=3, sticky="e", padx=(8,2))
+        ttk.Combobox(tx_bar, values=[""] + PAYMENT_METHODS, textvariable=self.tx_filter_vars["method"], state="readonly", width=20).grid(row=0, column=4, sticky="w")
+        tk.Label(tx_bar, text="Estado", bg="#0f172a", fg="#e2e8f0").grid(row=0, column=5, sticky="e", padx=(8,2))
+        ttk.Combobox(tx_bar, values=["", "approved", "declined", "error"], textvariable=self.tx_filter_vars["status"], state="readonly", width=10).grid(row=0, column=6, sticky="w")
+        tk.Label(tx_bar, text="Desde", bg="#0f172a", fg="#e2e8f0").grid(row=1, column=1, sticky="e", padx=(8,2))
+        ttk.Entry(tx_bar, textvariable=self.tx_filter_vars["desde"], width=12).grid(row=1, column=2, sticky="w")
+        tk.Label(tx_bar, text="Hasta", bg="#0f172a", fg="#e2e8f0").grid(row=1, column=3, sticky="e", padx=(8,2))
+        ttk.Entry(tx_bar, textvariable=self.tx_filter_vars["hasta"], width=12).grid(row=1, column=4, sticky="w")
+        ttk.Button(tx_bar, text="Filtrar", style="Menu.TButton", command=self._refresh_transactions_ui).grid(row=1, column=5, columnspan=2, sticky="w", padx=8, pady=4)
+        ttk.Button(tx_bar, text="◀ Más recientes", style="Menu.TButton", command=self._tx_newer_page).grid(row=2, column=1, columnspan=2, sticky="w", padx=(8,0))
+        ttk.Button(tx_bar, text="Más antiguas ▶", style="Menu.TButton", command=self._tx_older_page).grid(row=2, column=3, columnspan=2, sticky="w")
+        self.tx_count_var = tk.StringVar(value="")
+        tk.Label(tx_bar, textvariable=self.tx_count_var, bg="#0f172a", fg="#fbbf24").grid(row=2, column=5, columnspan=2, sticky="w", padx=8)
         self.tx_tree = ttk.Treeview(frame, columns=("id","cliente","amount","method","status","time"), show="headings", height=10)
         for c, txt in [("id","ID"),("cliente","Cliente"),("amount","Monto"),("method","Método"),("status","Estado"),("time","Fecha")]:
             self.tx_tree.heading(c, text=txt); self.tx_tree.column(c, width=130)
@@ -354,6 +424,8 @@ class PasarelaPagos:
 
         ttk.Button(frame, text="Exportar transacciones (Excel)", style="Menu.TButton", command=self._on_export_transactions).grid(row=12, column=3, sticky="w", padx=12, pady=6)
         ttk.Button(frame, text="Ver audit log", style="Menu.TButton", command=lambda: self._open_audit()).grid(row=12, column=3, sticky="e", padx=12, pady=6)
+        ttk.Button(frame, text="Descifrar exportación", style="Menu.TButton", command=self._on_decrypt_export).grid(row=13, column=3, sticky="w", padx=12, pady=6)
+        ttk.Button(frame, text="Importar tarjetas (CSV)", style="Menu.TButton", command=self._on_import_cards).grid(row=13, column=3, sticky="e", padx=12, pady=6)
 
         frame.grid_columnconfigure(3, weight=1)
         frame.grid_rowconfigure(7, weight=1)
@@ -373,6 +445,8 @@ class PasarelaPagos:
         # Número, exp, cvv
         tk.Label(panel, text="Número de tarjeta:", bg="#0f172a", fg="#e2e8f0").grid(row=1, column=0, sticky="e", padx=6, pady=6)
         self.card_number_var = tk.StringVar(); ttk.Entry(panel, textvariable=self.card_number_var, width=36).grid(row=1, column=1, sticky="w")
+        self.selected_token = None
+        self.card_number_var.trace_add("write", self._on_card_number_change)
 
         tk.Label(panel, text="MM/AA:", bg="#0f172a", fg="#e2e8f0").grid(row=2, column=0, sticky="e", padx=6, pady=6)
         self.expiry_var = tk.StringVar(); ttk.Entry(panel, textvariable=self.expiry_var, width=12).grid(row=2, column=1, sticky="w")
@@ -447,27 +521,144 @@ class PasarelaPagos:
     # ---- Data load/refresh ----
     def _load_data(self):
         try:
-            self.methods = load_payment_methods(self.root)
+            self._apply_bin_table()
+            methods = load_payment_methods(self.root)
         except Exception as e:
             audit("load_methods_exception", str(e))
-            self.methods = []
-        self._refresh_methods_ui()
+            methods = []
+        self._refresh_methods_ui(methods)
         self._refresh_transactions_ui()
 
-    def _refresh_methods_ui(self):
+    # ---- Tabla BIN ----
+    def _apply_bin_table(self, fernet=None):
+        """Reclasifica las tarjetas guardadas si la tabla BIN cambió o quedan métodos sin BIN."""
+        version = bin_table().check_reload()
+        stale = version != getattr(self, "_bin_version", None)
+        if not stale and not (fernet is not None and getattr(self, "_brands_pending", 0)):
+            return 0
+        updated, self._brands_pending = backfill_card_brands(fernet)
+        self._bin_version = version
+        return updated
+
+    def _unlock(self, purpose):
+        # Con la clave maestra a mano se completa el backfill de marcas de una vez
+        f = verify_master_and_get_fernet(self.root, purpose)
+        if f is not None:
+            try:
+                if self._apply_bin_table(f):
+                    self._refresh_methods_ui(load_payment_methods(self.root))
+            except Exception as e:
+                audit("card_brand_backfill_failed", str(e))
+        return f
+
+    @staticmethod
+    def _brand_label(m):
+        return f"{m.get('brand', '')} {m.get('card_type', '')}".strip()
+
+    # ---- Índices de métodos tokenizados ----
+    @staticmethod
+    def _last4(mask):
+        return ''.join(filter(str.isdigit, mask or ""))[-4:]
+
+    def _index_methods(self, methods):
+        # token -> método (en orden de alta) y últimos 4 -> [tokens] (varias tarjetas pueden compartirlos)
+        self.methods_by_token = {}
+        self.tokens_by_last4 = {}
+        self._saved_card_tokens = []
+        self._saved_card_labels = []
+        for m in methods:
+            self._index_method(m)
+
+    def _index_method(self, m):
+        self.methods_by_token[m["token"]] = m
+        self.tokens_by_last4.setdefault(self._last4(m.get("mask")), []).append(m["token"])
+        # La posición en el combobox se traduce a token con _saved_card_tokens
+        self._saved_card_tokens.append(m["token"])
+        self._saved_card_labels.append(self._saved_card_label(m))
+
+    @staticmethod
+    def _saved_card_label(m):
+        return f"{m.get('mask')}  ({m.get('token')[:8]})"
+
+    def _add_method(self, m):
+        self._index_method(m)
+        self.methods_tree.insert("", "end", iid=m["token"], values=(m["token"], m.get("mask"), self._brand_label(m)))
+        self._set_saved_cards_cb()
+
+    def _remove_method(self, token):
+        m = self.methods_by_token.pop(token, None)
+        if m is None:
+            return
+        tokens = self.tokens_by_last4.get(self._last4(m.get("mask")), [])
+        if token in tokens:
+            tokens.remove(token)
+        pos = self._saved_card_tokens.index(token)
+        del self._saved_card_tokens[pos]
+        del self._saved_card_labels[pos]
+        if self.methods_tree.exists(token):
+            self.methods_tree.delete(token)
+        if self.selected_token == token:
+            self.selected_token = None
+        self._set_saved_cards_cb()
+
+    def _refresh_methods_ui(self, methods):
+        self._index_methods(methods)
         self.methods_tree.delete(*self.methods_tree.get_children())
-        for m in self.methods:
-            self.methods_tree.insert("", "end", iid=m.get("token"), values=(m.get("token"), m.get("mask"), m.get("brand","")))
-        cb_vals = [f"{m.get('mask')}  ({m.get('token')[:8]})" for m in self.methods]
-        # Card panel combobox
+        for m in methods:
+            self.methods_tree.insert("", "end", iid=m.get("token"), values=(m.get("token"), m.get("mask"), self._brand_label(m)))
+        self._set_saved_cards_cb()
+
+    def _set_saved_cards_cb(self):
+        # Las etiquetas se mantienen por alta/baja; Tk solo acepta la lista completa de valores
         if hasattr(self, "saved_cards_cb"):
-            self.saved_cards_cb['values'] = cb_vals
+            self.saved_cards_cb['values'] = self._saved_card_labels
+
+    def _on_card_number_change(self, *args):
+        # Si el operador edita el número, deja de usarse la tarjeta tokenizada elegida
+        if self.selected_token is None:
+            return
+        m = self.methods_by_token.get(self.selected_token)
+        if m is None or self.card_number_var.get().strip() != m.get("mask"):
+            self.selected_token = None
+
+    def _tx_filters(self):
+        filters = {f: v.get().strip() for f, v in self.tx_filter_vars.items() if v.get().strip()}
+        for f in ("desde", "hasta"):
+            if f in filters:
+                try:
+                    datetime.strptime(filters[f], "%Y-%m-%d")
+                except ValueError:
+                    messagebox.showwarning("Validación", "Fechas en formato YYYY-MM-DD.")
+                    filters.pop(f)
+        return filters
 
     def _refresh_transactions_ui(self):
+        # Vuelve a la primera página (más recientes) con los filtros actuales
+        self._tx_active_filters = self._tx_filters()
+        self._tx_cursors = [None]
+        self._show_tx_page()
+
+    def _show_tx_page(self):
+        index = transaction_index()
+        filters = self._tx_active_filters
+        txs, self._tx_next_cursor = index.page(filters, self._tx_cursors[-1], PAGE_SIZE)
         self.tx_tree.delete(*self.tx_tree.get_children())
-        txs = load_transactions()
-        for t in txs[-300:]:
-            self.tx_tree.insert("", "end", values=(t.get("id"), t.get("cliente"), f"{t.get('amount'):.2f}", t.get("method"), t.get("status"), t.get("time")))
+        for t in txs:
+            self.tx_tree.insert("", "end", values=(t.get("id"), t.get("cliente"), f"{t.get('amount') or 0:.2f}", t.get("method"), t.get("status"), t.get("time")))
+        offset = (len(self._tx_cursors) - 1) * PAGE_SIZE
+        first = offset + 1 if txs else 0
+        self.tx_count_var.set(f"{first}–{offset + len(txs)} de {index.count(filters)}")
+
+    def _tx_older_page(self):
+        if self._tx_next_cursor is None:
+            return
+        self._tx_cursors.append(self._tx_next_cursor)
+        self._show_tx_page()
+
+    def _tx_newer_page(self):
+        if len(self._tx_cursors) > 1:
+            self._tx_cursors.pop()
+            self._show_tx_page()
 
     # ---- Method switching ----
     def _on_method_change(self, event=None):
@@ -504,39 +695,76 @@ class PasarelaPagos:
         if not luhn_checksum(card):
             messagebox.showwarning("Validación", "Número de tarjeta inválido (Luhn).")
             return
-        f = verify_master_and_get_fernet(self.root, "tokenizar tarjeta")
+        f = self._unlock("tokenizar tarjeta")
         if f is None:
             return
         token = str(uuid.uuid4())
         masked = mask_card(card)
-        brand = "CARD"
         payload = {"card": card, "exp": exp}
         try:
             enc = f.encrypt(json.dumps(payload).encode("utf-8"))
-            methods = load_payment_methods(self.root) or []
-            methods.append({
-                "token": token,
-                "mask": masked,
-                "brand": brand,
-                "enc": enc.decode("utf-8"),
-                "created_at": datetime.now().isoformat()
-            })
-            ok = save_payment_methods(self.root, methods)
-            if ok:
-                audit("tokenize_card", f"token={token} mask={masked}")
-                button_clicked("PasarelaPagos", "Tokenizar tarjeta", f"mask={masked}")
-                messagebox.showinfo("Tokenizado", f"Tarjeta tokenizada: {masked}")
-                self.card_number_var.set("")
-                self.cvv_var.set("")
-                self.expiry_var.set("")
-                self.methods = methods
-                self._refresh_methods_ui()
-            else:
-                messagebox.showerror("Error", "No se pudo guardar la tarjeta tokenizada.")
+            method = add_payment_method(token, masked, card, enc.decode("utf-8"))
+            audit("tokenize_card", f"token={token} mask={masked} brand={method['brand']}")
+            button_clicked("PasarelaPagos", "Tokenizar tarjeta", f"mask={masked}")
+            messagebox.showinfo("Tokenizado", f"Tarjeta tokenizada: {masked}")
+            self.card_number_var.set("")
+            self.cvv_var.set("")
+            self.expiry_var.set("")
+            self._add_method(method)
         except Exception as e:
             audit("tokenize_failed", str(e))
             messagebox.showerror("Error", f"No se pudo tokenizar la tarjeta: {e}")
 
+    def _on_import_cards(self):
+        # Lista heredada: columnas "numero"/"card" y "exp"/"vencimiento"
+        fname = filedialog.askopenfilename(filetypes=[("CSV", "*.csv")])
+        if not fname:
+            return
+        f = self._unlock("importar tarjetas")
+        if f is None:
+            return
+        try:
+            with open(fname, "r", encoding="utf-8-sig", newline="") as fh:
+                rows = [{(k or "").strip().lower(): (v or "").strip() for k, v in r.items()} for r in csv.DictReader(fh)]
+            numbers = [r.get("numero") or r.get("card") or "" for r in rows]
+            exps = [r.get("exp") or r.get("vencimiento") or "" for r in rows]
+            res = run_with_busy(self.root, f"Validando {len(numbers)} tarjetas...", tarjetas_lote.validate_bulk, numbers)
+        except Exception as e:
+            audit("import_cards_failed", str(e))
+            messagebox.showerror("Error", f"No se pudo leer el archivo: {e}")
+            return
+        invalid = res["invalid"]
+        report = None
+        if invalid:
+            # Fila 2 = primera fila de datos (la 1 es el encabezado)
+            report = os.path.splitext(fname)[0] + "_invalidas.csv"
+            with open(report, "w", encoding="utf-8-sig", newline="") as fh:
+                w = csv.writer(fh)
+                w.writerow(["fila", "tarjeta", "motivo"])
+                for i, reason in invalid:
+                    w.writerow([i + 2, res["masked"][i], reason])
+        valid_idx = [int(i) for i in res["valid"].nonzero()[0]]
+        msg = f"Válidas: {len(valid_idx)}\nInválidas: {len(invalid)}"
+        if report:
+            msg += f"\nDetalle de inválidas en:\n{report}"
+        if not valid_idx:
+            messagebox.showwarning("Importar tarjetas", msg)
+            return
+        if not messagebox.askyesno("Importar tarjetas", msg + "\n\n¿Guardar las tarjetas válidas en la bóveda?"):
+            return
+        cards = [(res["card"][i], exps[i], str(res["masked"][i]), str(res["brand"][i]), str(res["card_type"][i]))
+                 for i in valid_idx]
+        try:
+            added = run_with_busy(self.root, f"Cifrando {len(cards)} tarjetas...", add_payment_methods_bulk, cards, f)
+        except Exception as e:
+            audit("import_cards_failed", str(e))
+            messagebox.showerror("Error", f"No se pudieron guardar las tarjetas: {e}")
+            return
+        self._refresh_methods_ui(list(self.methods_by_token.values()) + added)
+        audit("import_cards", f"file={os.path.basename(fname)} added={len(added)} invalid={len(invalid)}")
+        button_clicked("PasarelaPagos", "Importar tarjetas", f"added={len(added)}")
+        messagebox.showinfo("Importar tarjetas", f"{len(added)} tarjetas tokenizadas.")
+
     def _get_selected_method_token(self):
         sel = self.methods_tree.selection()
         if not sel:
@@ -544,19 +772,19 @@ class PasarelaPagos:
         return sel[0]
 
     def _on_view_card(self):
-        f = verify_master_and_get_fernet(self.root, "ver tarjeta tokenizada")
+        f = self._unlock("ver tarjeta tokenizada")
         if f is None:
             return
         token = self._get_selected_method_token()
         if token is None:
             messagebox.showwarning("Selecciona", "Selecciona un método tokenizado.")
             return
-        m = next((x for x in (self.methods or []) if x.get("token") == token), None)
+        m = self.methods_by_token.get(token)
         if not m:
             messagebox.showerror("Error", "Método no encontrado.")
             return
         try:
-            dec = f.decrypt(m.get("enc").encode("utf-8"))
+            dec = f.decrypt(payment_method_blob(token).encode("utf-8"))
             payload = json.loads(dec.decode("utf-8"))
             audit("view_card", f"token={token}")
             view_attempt("PasarelaPagos", f"token={token}", success=True)
@@ -578,7 +806,7 @@ class PasarelaPagos:
             messagebox.showerror("Error", f"No se pudo desencriptar la tarjeta: {e}")
 
     def _on_delete_method(self):
-        f = verify_master_and_get_fernet(self.root, "eliminar método tokenizado")
+        f = self._unlock("eliminar método tokenizado")
         if f is None:
             return
         token = self._get_selected_method_token()
@@ -589,15 +817,12 @@ class PasarelaPagos:
             view_attempt("PasarelaPagos", f"token={token}", success=False, reason="user_cancel")
             return
         try:
-            methods = load_payment_methods(self.root) or []
-            methods = [m for m in methods if m.get("token") != token]
-            ok = save_payment_methods(self.root, methods)
+            ok = delete_payment_method(token)
             if ok:
                 audit("delete_method", f"token={token}")
                 button_clicked("PasarelaPagos", "Eliminar método", f"token={token}")
                 messagebox.showinfo("Eliminado", "Método eliminado.")
-                self.methods = methods
-                self._refresh_methods_ui()
+                self._remove_method(token)
             else:
                 messagebox.showerror("Error", "No se pudo eliminar el método.")
         except Exception as e:
@@ -609,8 +834,9 @@ class PasarelaPagos:
         if idx < 0:
             messagebox.showwarning("Selecciona", "Selecciona una tarjeta en el desplegable.")
             return
-        m = self.methods[idx]
+        m = self.methods_by_token[self._saved_card_tokens[idx]]
         self.card_number_var.set(m.get("mask"))
+        self.selected_token = m["token"]
         self.expiry_var.set("")
         self.cvv_var.set("")
         self.save_card_var.set(False)
@@ -619,6 +845,23 @@ class PasarelaPagos:
         messagebox.showinfo("Tarjeta cargada", "La tarjeta tokenizada se ha cargado para uso. Para ver el número real use 'Ver tarjeta (temporal)'.")
 
     # ---- Processing ----
+    def _watch_payment_form(self):
+        # Cualquier cambio en el formulario es un intento de pago nuevo
+        form_vars = [self.client_var, self.amount_var, self.method_var, self.card_number_var, self.expiry_var,
+                     self.cvv_var, self.pse_bank_var, self.pse_account_type_var, self.pse_doc_var,
+                     self.wallet_provider_var, self.wallet_phone_var, self.wallet_ref_var,
+                     self.transfer_bank_var, self.transfer_ref_var, self.cash_note_var]
+        for var in form_vars:
+            var.trace_add("write", self._reset_attempt_key)
+
+    def _reset_attempt_key(self, *args):
+        self._attempt_key = None
+
+    def _current_attempt_key(self):
+        if self._attempt_key is None:
+            self._attempt_key = new_idempotency_key()
+        return self._attempt_key
+
     def _on_process_payment(self):
         client = self.client_var.get().strip()
         try:
@@ -635,75 +878,136 @@ class PasarelaPagos:
         button_clicked("PasarelaPagos", "Procesar pago", f"client={client} amount={amount} method={method}")
 
         if method in ("Tarjeta crédito","Tarjeta débito"):
-            ok, result, mask = self._process_card(amount)
+            built = self._card_request(amount)
         elif method == "PSE":
-            ok, result, mask = self._process_pse(amount)
+            built = self._pse_request(amount)
         elif method in ("Nequi","Daviplata"):
-            ok, result, mask = self._process_wallet(amount, provider=method)
+            built = self._wallet_request(amount, provider=method)
         elif method == "Transferencia Bancolombia":
-            ok, result, mask = self._process_transfer(amount)
+            built = self._transfer_request(amount)
         elif method == "Efectivo":
-            ok, result, mask = self._process_cash(amount)
+            built = self._cash_request(amount)
         else:
             messagebox.showerror("Error", "Método de pago no soportado.")
             return
 
+        request, mask, rejection = built
+        if rejection is not None:
+            # Validación local fallida: se registra sin llamar al procesador
+            self._finish_payment(client, method, mask, rejection, None)
+            return
+        request["method"] = method
+        key = self._current_attempt_key()
+        if key in self._inflight_keys:
+            # Doble clic o reintento mientras el mismo intento sigue en el procesador
+            audit("process_payment_duplicate_click", f"key={key}")
+            messagebox.showinfo("Pago en proceso", "Este pago ya se está procesando. Espera el resultado.")
+            return
+        # El dispatcher trabaja sobre una copia: la llave se guarda aquí para liberarla y registrarla
+        request["idempotency_key"] = key
+        future = self.dispatcher.submit(request, idempotency_key=key)
+        self._inflight_keys.add(key)
+        self._pending += 1
+        self._update_busy()
+        self._poll_payment(future, client, method, mask, request)
+
+    def _poll_payment(self, future, client, method, mask, request):
+        # El cobro corre en el pool; Tk solo consulta el Future (no es thread-safe)
+        if not future.done():
+            self.root.after(50, self._poll_payment, future, client, method, mask, request)
+            return
+        self._inflight_keys.discard(request.get("idempotency_key"))
+        self._pending -= 1
+        self._update_busy()
+        try:
+            result = future.result()
+        except Exception as e:
+            audit("process_payment_exception", str(e))
+            result = self._local_decline("96", f"Error del procesador: {e}")
+        self._finish_payment(client, method, mask, result, request)
+
+    def _update_busy(self):
+        self.busy_var.set(f"Procesando {self._pending} pago(s)..." if self._pending else "")
+
+    def _finish_payment(self, client, method, mask, result, request):
+        ok = result.get("status") == "approved"
+        if result.get("replayed"):
+            # Mismo intento ya resuelto: mostrar el resultado original, sin cobrar ni registrar de nuevo
+            audit("process_payment_replayed", f"id={result.get('id')} key={request.get('idempotency_key')}")
+            messagebox.showinfo("Pago ya procesado", f"Este pago ya fue procesado ({result.get('status')}). ID: {result.get('id')}")
+            return
+        if result.get("status") == "declined":
+            # Un rechazo es definitivo para esa llave; volver a intentar es un intento nuevo
+            self._reset_attempt_key()
         tx = {
             "id": result.get("id"),
             "cliente": client,
-            "amount": amount,
+            "amount": result.get("amount"),
             "method": method,
             "status": result.get("status"),
             "processor_code": result.get("processor_code"),
             "message": result.get("message"),
             "time": datetime.now().isoformat(),
             "card_mask": mask,
-            "extra": result.get("extra", {})
+            "extra": result.get("extra", {}),
+            "idempotency_key": request.get("idempotency_key") if request else None
         }
-        save_transaction(tx)
-        audit("process_payment_result", f"id={tx['id']} status={tx['status']} client={client} amount={amount} method={method}")
-        self._refresh_transactions_ui()
+        try:
+            save_transaction(tx)
+        except Exception as e:
+            # El cobro ya ocurrió: queda completo en el audit log para registrarlo a mano
+            audit("transaction_save_failed", json.dumps({"error": str(e), "tx": tx}, ensure_ascii=False))
+            messagebox.showerror("Error", f"El pago se procesó ({tx['status']}, ID: {tx['id']}) pero no se pudo guardar en el historial: {e}")
+        else:
+            audit("process_payment_result", f"id={tx['id']} status={tx['status']} client={client} amount={tx['amount']} method={method}")
+            reconcile_receivables([tx])
+            self._refresh_transactions_ui()
         if ok:
             messagebox.showinfo("Pago aprobado", f"Pago aprobado. ID: {tx['id']}")
         else:
             messagebox.showwarning("Pago rechazado", f"Pago rechazado: {result.get('message')}")
 
         # Guardar tarjeta tras cobro si aplica
-        if method in ("Tarjeta crédito","Tarjeta débito"):
-            tokenized = any(self.card_number_var.get().strip() == (m.get("mask") or "") for m in (self.methods or []))
-            if self.save_card_var.get() and not tokenized:
-                self._tokenize_after_charge()
+        if request is not None and request.get("kind") == "card" and request.get("save_card") and not request.get("token"):
+            self._tokenize_after_charge(request.get("card"), request.get("exp"))
+
+    @staticmethod
+    def _local_decline(code, message, amount=None):
+        return {"id": str(uuid.uuid4()), "status": "declined", "processor_code": code, "message": message, "amount": amount}
 
-    # ---- Method-specific processors ----
-    def _process_card(self, amount: float):
-        token = None
+    # ---- Request builders (validación en el hilo de Tk; devuelven request, mask, rechazo) ----
+    def _card_request(self, amount: float):
+        token = self.selected_token
         entered = self.card_number_var.get().strip()
-        selected_method = None
-        for m in (self.methods or []):
-            if entered and m.get("mask") == entered:
-                token = m.get("token")
-                selected_method = m
-                break
+        if token is None and "*" in entered:
+            # Máscara escrita a mano: solo vale si los últimos 4 identifican una sola tarjeta
+            candidates = self.tokens_by_last4.get(self._last4(entered), [])
+            if len(candidates) == 1:
+                token = candidates[0]
+            else:
+                messagebox.showwarning("Tarjeta tokenizada", "Selecciona la tarjeta en 'Tarjeta guardada' y pulsa 'Usar tarjeta seleccionada'.")
+                return None, None, self._local_decline("05", "Tarjeta tokenizada ambigua", amount)
 
         full_card = None
+        exp = self.expiry_var.get().strip()
         if token:
-            f = verify_master_and_get_fernet(self.root, "procesar pago con tarjeta tokenizada")
+            f = self._unlock("procesar pago con tarjeta tokenizada")
             if f is None:
-                return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "99", "message": "Acceso denegado"}, None
+                return None, None, self._local_decline("99", "Acceso denegado", amount)
             try:
-                dec = f.decrypt(selected_method.get("enc").encode("utf-8"))
+                dec = f.decrypt(payment_method_blob(token).encode("utf-8"))
                 payload = json.loads(dec.decode("utf-8"))
                 full_card = payload.get("card")
+                exp = payload.get("exp", "")
             except Exception as e:
                 audit("process_failed_decrypt", str(e))
                 messagebox.showerror("Error", "No se pudo acceder a la tarjeta tokenizada.")
-                return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "99", "message": "Token inválido"}, None
+                return None, None, self._local_decline("99", "Token inválido", amount)
         else:
             full_card = ''.join(filter(str.isdigit, self.card_number_var.get()))
             if not luhn_checksum(full_card):
                 messagebox.showwarning("Validación", "Número de tarjeta inválido (Luhn).")
-                return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "05", "message": "Tarjeta inválida"}, None
-            exp = self.expiry_var.get().strip()
+                return None, None, self._local_decline("05", "Tarjeta inválida", amount)
             if "/" in exp:
                 mm, yy = exp.split("/", 1)
                 try:
@@ -712,170 +1016,667 @@ class PasarelaPagos:
                         raise ValueError()
                 except Exception:
                     messagebox.showwarning("Validación", "Formato de expiración inválido (MM/AA).")
-                    return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "05", "message": "Expiración inválida"}, None
+                    return None, None, self._local_decline("05", "Expiración inválida", amount)
 
-        ok, result = simulate_charge(full_card, amount)
-        mask = mask_card(full_card) if full_card else None
-        return ok, result, mask
+        request = {"kind": "card", "amount": amount, "card": full_card, "exp": exp, "token": token,
+                   "save_card": self.save_card_var.get(), "extra": {}}
+        return request, mask_card(full_card), None
 
-    def _process_pse(self, amount: float):
+    def _pse_request(self, amount: float):
         bank = self.pse_bank_var.get().strip()
         acc_type = self.pse_account_type_var.get().strip()
         doc = self.pse_doc_var.get().strip()
         if not bank or not acc_type or not doc:
             messagebox.showwarning("Validación", "Completa banco, tipo de cuenta y documento.")
-            return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "05", "message": "Datos PSE incompletos"}, None
-        time.sleep(0.8)
-        ok = secrets.randbelow(100) >= 8
-        result = {
-            "id": str(uuid.uuid4()),
-            "status": "approved" if ok else "declined",
-            "processor_code": "00" if ok else "05",
-            "message": "Aprobado PSE" if ok else "Rechazado por banco",
-            "amount": amount,
-            "extra": {"bank": bank, "account_type": acc_type, "doc": doc}
-        }
-        return ok, result, f"PSE-{bank}"
+            return None, None, self._local_decline("05", "Datos PSE incompletos", amount)
+        request = {"kind": "pse", "amount": amount, "extra": {"bank": bank, "account_type": acc_type, "doc": doc}}
+        return request, f"PSE-{bank}", None
 
-    def _process_wallet(self, amount: float, provider: str):
+    def _wallet_request(self, amount: float, provider: str):
         phone = self.wallet_phone_var.get().strip()
         ref = self.wallet_ref_var.get().strip()
         if not phone or len(''.join(filter(str.isdigit, phone))) < 10:
             messagebox.showwarning("Validación", "Número de celular inválido.")
-            return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "05", "message": "Celular inválido"}, None
+            return None, None, self._local_decline("05", "Celular inválido", amount)
         if not ref:
             messagebox.showwarning("Validación", "Ingresa una referencia de pago.")
-            return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "05", "message": "Referencia requerida"}, None
-        time.sleep(0.7)
-        ok = secrets.randbelow(100) >= 7
-        result = {
-            "id": str(uuid.uuid4()),
-            "status": "approved" if ok else "declined",
-            "processor_code": "00" if ok else "05",
-            "message": f"Aprobado {provider}" if ok else f"Rechazado por {provider}",
-            "amount": amount,
-            "extra": {"provider": provider, "phone": phone, "ref": ref}
-        }
-        return ok, result, f"{provider}-{phone[-4:]}"
+            return None, None, self._local_decline("05", "Referencia requerida", amount)
+        request = {"kind": "wallet", "amount": amount, "extra": {"provider": provider, "phone": phone, "ref": ref}}
+        return request, f"{provider}-{phone[-4:]}", None
 
-    def _process_transfer(self, amount: float):
+    def _transfer_request(self, amount: float):
         bank = self.transfer_bank_var.get().strip()
         ref = self.transfer_ref_var.get().strip()
         if not bank or not ref:
             messagebox.showwarning("Validación", "Completa banco y referencia/comprobante.")
-            return False, {"id": str(uuid.uuid4()), "status": "declined", "processor_code": "05", "message": "Datos de transferencia incompletos"}, None
-        time.sleep(0.5)
-        ok = True  # Transferencia marcada como recibida manualmente
-        result = {
-            "id": str(uuid.uuid4()),
-            "status": "approved" if ok else "declined",
-            "processor_code": "00" if ok else "05",
-            "message": "Comprobante verificado",
-            "amount": amount,
-            "extra": {"bank": bank, "ref": ref}
-        }
-        return ok, result, f"TR-{bank}"
+            return None, None, self._local_decline("05", "Datos de transferencia incompletos", amount)
+        # Transferencia marcada como recibida manualmente; el procesador solo registra el comprobante
+        request = {"kind": "transfer", "amount": amount, "extra": {"bank": bank, "ref": ref}}
+        return request, f"TR-{bank}", None
 
-    def _process_cash(self, amount: float):
+    def _cash_request(self, amount: float):
         note = self.cash_note_var.get().strip()
-        time.sleep(0.2)
-        ok = True
-        result = {
-            "id": str(uuid.uuid4()),
-            "status": "approved",
-            "processor_code": "00",
-            "message": "Pago en efectivo registrado",
-            "amount": amount,
-            "extra": {"note": note}
-        }
-        return ok, result, "EFECTIVO"
+        request = {"kind": "cash", "amount": amount, "extra": {"note": note}}
+        return request, "EFECTIVO", None
 
-    def _tokenize_after_charge(self):
-        f = verify_master_and_get_fernet(self.root, "guardar tarjeta tras cobro")
+    def _tokenize_after_charge(self, full_card, exp):
+        f = self._unlock("guardar tarjeta tras cobro")
         if f is None:
             return
-        full_card = ''.join(filter(str.isdigit, self.card_number_var.get()))
         token_new = str(uuid.uuid4())
         masked = mask_card(full_card)
-        brand = "CARD"
-        payload = {"card": full_card, "exp": self.expiry_var.get().strip()}
+        payload = {"card": full_card, "exp": exp}
         try:
             enc = f.encrypt(json.dumps(payload).encode("utf-8"))
-            methods = load_payment_methods(self.root) or []
-            methods.append({
-                "token": token_new,
-                "mask": masked,
-                "brand": brand,
-                "enc": enc.decode("utf-8"),
-                "created_at": datetime.now().isoformat()
-            })
-            ok2 = save_payment_methods(self.root, methods)
-            if ok2:
-                audit("tokenize_card_on_charge", f"token={token_new} mask={masked}")
-                button_clicked("PasarelaPagos", "Guardar tarjeta tras cobro", f"mask={masked}")
-                messagebox.showinfo("Guardado", f"Tarjeta guardada tokenizada como {masked}")
-                self.methods = methods
-                self._refresh_methods_ui()
-            else:
-                messagebox.showerror("Error", "No se pudo guardar la tarjeta tokenizada.")
+            method = add_payment_method(token_new, masked, full_card, enc.decode("utf-8"))
+            audit("tokenize_card_on_charge", f"token={token_new} mask={masked} brand={method['brand']}")
+            button_clicked("PasarelaPagos", "Guardar tarjeta tras cobro", f"mask={masked}")
+            messagebox.showinfo("Guardado", f"Tarjeta guardada tokenizada como {masked}")
+            self._add_method(method)
         except Exception as e:
             audit("tokenize_on_charge_failed", str(e))
 
     # ---- Export & audit ----
-    def _on_export_transactions(self):
-        f = verify_master_and_get_fernet(self.root, "exportar transacciones")
-        if f is None:
+    def _on_export_transactions(self):
+        f = self._unlock("exportar transacciones")
+        if f is None:
+            return
+        index = transaction_index()
+        filters = self._tx_active_filters
+        total = index.count(filters)
+        if not total:
+            messagebox.showwarning("Sin datos", "No hay transacciones para exportar.")
+            return
+        fname = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel","*.xlsx"), ("CSV","*.csv")])
+        if not fname:
+            return
+        fmt = "csv" if fname.lower().endswith(".csv") else "xlsx"
+        encrypt = messagebox.askyesno("Cifrado", "¿Cifrar el archivo exportado con la clave maestra?\n"
+                                      "(Contiene documentos y celulares de clientes)")
+        if encrypt:
+            fname += exportacion_pagos.ENCRYPTED_SUFFIX
+        ExportProgressWindow(self.root, f"Exportando {total} transacciones...", total,
+                             exportacion_pagos.export_transactions,
+                             (index.scan(filters), fname, fmt, f if encrypt else None),
+                             on_done=lambda n: self._export_done(fname, n, encrypt),
+                             on_error=lambda e: self._export_failed(fname, e))
+
+    def _export_done(self, fname, n, encrypted):
+        audit("export_transactions", f"{fname} rows={n} encrypted={encrypted}")
+        button_clicked("PasarelaPagos", "Exportar transacciones", fname)
+        messagebox.showinfo("Exportado", f"{n} transacciones exportadas a:\n{fname}")
+
+    def _export_failed(self, fname, error):
+        try:
+            os.remove(fname)   # no dejar archivos a medias
+        except OSError:
+            pass
+        if isinstance(error, exportacion_pagos.ExportCancelled):
+            audit("export_cancelled", fname)
+            return
+        audit("export_failed", str(error))
+        messagebox.showerror("Error", f"No se pudo exportar: {error}")
+
+    def _on_decrypt_export(self):
+        src = filedialog.askopenfilename(filetypes=[("Exportación cifrada", "*" + exportacion_pagos.ENCRYPTED_SUFFIX)])
+        if not src:
+            return
+        f = self._unlock("descifrar exportación")
+        if f is None:
+            return
+        dst = src[:-len(exportacion_pagos.ENCRYPTED_SUFFIX)] if src.endswith(exportacion_pagos.ENCRYPTED_SUFFIX) else src + ".dec"
+        dst = filedialog.asksaveasfilename(initialfile=os.path.basename(dst))
+        if not dst:
+            return
+        try:
+            run_with_busy(self.root, "Descifrando...", exportacion_pagos.decrypt_export, src, dst, f)
+        except InvalidToken:
+            messagebox.showerror("Error", "El archivo no corresponde a la clave maestra actual o está dañado.")
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo descifrar: {e}")
+            return
+        audit("export_decrypted", dst)
+        messagebox.showinfo("Descifrado", f"Archivo descifrado en:\n{dst}")
+
+    def _open_batch_window(self):
+        button_clicked("PasarelaPagos", "Pagos por lote", "")
+        LotePagosWindow(self)
+
+    def _open_cash_close(self):
+        button_clicked("PasarelaPagos", "Cierre de caja", "")
+        CierreCajaWindow(self)
+
+    def _open_audit(self):
+        ensure_base_dir()
+        VisorAuditoria(self.root, "PasarelaPagos")
+        button_clicked("PasarelaPagos", "Ver audit log", "")
+
+    def _on_close(self):
+        if self._pending and not messagebox.askyesno("Pagos en curso", f"Hay {self._pending} pago(s) en proceso. ¿Cerrar de todas formas?"):
             return
-        txs = load_transactions()
-        if not txs:
-            messagebox.showwarning("Sin datos", "No hay transacciones para exportar.")
+        module_closed("PasarelaPagos", "window_closed")
+        self.dispatcher.shutdown(wait=False)
+        self.root.destroy()
+
+# ---- UI: Pagos por lote (clientes de flota) ----
+class LotePagosWindow:
+    """
+    Cobro masivo desde CSV, facturas abiertas de cartera o un lote recurrente.
+    Las filas se despachan a un pool propio (BATCH_WORKERS) para no bloquear los
+    pagos individuales; cada fila lleva una llave de idempotencia "<lote>:<fila>",
+    así que volver a ejecutar el mismo lote solo reintenta las filas con error.
+    Las filas terminadas se guardan en cada ronda de _poll (una escritura de
+    transactions.json por ronda), así un cierre a mitad no pierde cobros.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.rows = []
+        self.batch_id = None
+        self.recurring_id = None
+        self.dispatcher = None
+        self.running = False
+        self.top = tk.Toplevel(app.root)
+        self.top.title("Pagos por lote")
+        self.top.geometry("1000x650")
+        self.top.configure(bg="#0f172a")
+        self._build_ui()
+        self.top.protocol("WM_DELETE_WINDOW", self._on_close)
+        due = lotes_pagos.due_recurring()
+        if due:
+            self.status_var.set(f"Hay {len(due)} lote(s) recurrente(s) pendiente(s) este mes: " + ", ".join(r["nombre"] for r in due))
+
+    def _build_ui(self):
+        bar = tk.Frame(self.top, bg="#0f172a")
+        bar.pack(fill="x", padx=10, pady=8)
+        ttk.Button(bar, text="Cargar CSV", style="Menu.TButton", command=self._load_csv).pack(side="left", padx=4)
+        ttk.Button(bar, text="Facturas abiertas (cartera)", style="Menu.TButton", command=self._load_receivables).pack(side="left", padx=4)
+        ttk.Button(bar, text="Lotes recurrentes", style="Menu.TButton", command=self._load_recurring).pack(side="left", padx=4)
+        ttk.Button(bar, text="Guardar como recurrente", style="Menu.TButton", command=self._save_recurring).pack(side="left", padx=4)
+        ttk.Button(bar, text="Ejecutar lote", style="Menu.TButton", command=self._run).pack(side="right", padx=4)
+
+        cols = ("n", "cliente", "referencia", "monto", "metodo", "estado")
+        self.tree = ttk.Treeview(self.top, columns=cols, show="headings", height=14)
+        for c, txt, w in [("n", "#", 50), ("cliente", "Cliente", 180), ("referencia", "Referencia", 140),
+                          ("monto", "Monto", 110), ("metodo", "Método", 170), ("estado", "Estado", 300)]:
+            self.tree.heading(c, text=txt)
+            self.tree.column(c, width=w)
+        self.tree.pack(fill="both", expand=True, padx=10)
+
+        prog = tk.Frame(self.top, bg="#0f172a")
+        prog.pack(fill="x", padx=10, pady=6)
+        self.progress = ttk.Progressbar(prog, mode="determinate")
+        self.progress.pack(side="left", fill="x", expand=True)
+        self.status_var = tk.StringVar(value="")
+        tk.Label(self.top, textvariable=self.status_var, bg="#0f172a", fg="#fbbf24", anchor="w").pack(fill="x", padx=10)
+
+        self.summary_txt = tk.Text(self.top, height=10, bg="#1e293b", fg="#e2e8f0")
+        self.summary_txt.pack(fill="x", padx=10, pady=(4, 10))
+        self.summary_txt.config(state="disabled")
+
+    # ---- Carga de filas ----
+    def _set_rows(self, rows, batch_id=None, recurring_id=None):
+        if self.running:
+            messagebox.showwarning("Lote en curso", "Espera a que termine el lote actual.", parent=self.top)
             return
-        fname = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel","*.xlsx")])
+        self.rows = rows
+        self.batch_id = batch_id or lotes_pagos.new_batch_id()
+        self.recurring_id = recurring_id
+        self.tree.delete(*self.tree.get_children())
+        known = self.app.methods_by_token
+        invalid = 0
+        for i, row in enumerate(rows):
+            reason = lotes_pagos.validate_row(row, known)
+            invalid += reason is not None
+            self.tree.insert("", "end", iid=str(i), values=(i + 1, row["cliente"], row.get("referencia", ""),
+                                                            f"{row['monto']:,.2f}", row["metodo"],
+                                                            f"Inválida: {reason}" if reason else "Pendiente"))
+        self.progress.configure(maximum=max(1, len(rows)), value=0)
+        self.status_var.set(f"Lote {self.batch_id}: {len(rows)} fila(s), {invalid} inválida(s)")
+
+    def _load_csv(self):
+        fname = filedialog.askopenfilename(parent=self.top, filetypes=[("CSV", "*.csv")])
         if not fname:
             return
         try:
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Transacciones"
-            ws.append(["ID","Cliente","Monto","Método","Estado","Mensaje","Fecha","Tarjeta/Ref","Extra"])
-            for t in txs:
-                ws.append([
-                    t.get("id"),
-                    t.get("cliente"),
-                    t.get("amount"),
-                    t.get("method"),
-                    t.get("status"),
-                    t.get("message"),
-                    t.get("time"),
-                    t.get("card_mask"),
-                    json.dumps(t.get("extra", {}), ensure_ascii=False)
-                ])
-            wb.save(fname)
-            audit("export_transactions", fname)
-            button_clicked("PasarelaPagos", "Exportar transacciones", fname)
-            messagebox.showinfo("Exportado", f"Transacciones exportadas a:\n{fname}")
+            rows = lotes_pagos.parse_batch_csv(fname)
         except Exception as e:
-            audit("export_failed", str(e))
-            messagebox.showerror("Error", f"No se pudo exportar: {e}")
+            messagebox.showerror("Error", f"No se pudo leer el CSV: {e}", parent=self.top)
+            return
+        button_clicked("PasarelaPagos", "Lote desde CSV", f"rows={len(rows)}")
+        self._set_rows(rows)
 
-    def _open_audit(self):
-        ensure_base_dir()
-        if not os.path.exists(AUDIT_LOG):
-            messagebox.showinfo("Audit log", "No hay registros de auditoría aún.")
-            return
-        with open(AUDIT_LOG, "r", encoding="utf-8") as f:
-            data = f.read()
-        top = tk.Toplevel(self.root)
-        top.title("Audit log")
-        txt = tk.Text(top, width=120, height=30)
-        txt.pack(fill="both", expand=True)
-        txt.insert("1.0", data)
-        txt.config(state="disabled")
-        button_clicked("PasarelaPagos", "Ver audit log", "")
+    def _load_receivables(self):
+        abiertas = lotes_pagos.open_receivables()
+        if not abiertas:
+            messagebox.showinfo("Cartera", "No hay facturas con saldo pendiente.", parent=self.top)
+            return
+        dlg = tk.Toplevel(self.top)
+        dlg.title("Facturas abiertas")
+        dlg.configure(bg="#0f172a")
+        tree = ttk.Treeview(dlg, columns=("cliente", "referencia", "saldo", "vencimiento", "estado"), show="headings", height=14, selectmode="extended")
+        for c, txt in [("cliente", "Cliente"), ("referencia", "Referencia"), ("saldo", "Saldo"), ("vencimiento", "Vence"), ("estado", "Estado")]:
+            tree.heading(c, text=txt)
+            tree.column(c, width=130)
+        for i, r in abiertas:
+            tree.insert("", "end", iid=str(i), values=(r.get("cliente"), r.get("referencia"), f"{r.get('saldo', 0):,.2f}",
+                                                      r.get("vencimiento"), r.get("estado")))
+        tree.pack(fill="both", expand=True, padx=10, pady=8)
+
+        opts = tk.Frame(dlg, bg="#0f172a")
+        opts.pack(fill="x", padx=10)
+        tk.Label(opts, text="Método:", bg="#0f172a", fg="#e2e8f0").pack(side="left")
+        method_var = tk.StringVar(value="Tarjeta crédito")
+        ttk.Combobox(opts, values=PAYMENT_METHODS, textvariable=method_var, state="readonly", width=26).pack(side="left", padx=6)
+        tk.Label(opts, text="Tarjeta guardada:", bg="#0f172a", fg="#e2e8f0").pack(side="left")
+        tokens = list(self.app._saved_card_tokens)
+        card_cb = ttk.Combobox(opts, values=list(self.app._saved_card_labels), state="readonly", width=32)
+        card_cb.pack(side="left", padx=6)
+
+        registros = dict(abiertas)
+
+        def agregar():
+            sel = tree.selection()
+            if not sel:
+                messagebox.showwarning("Selecciona", "Selecciona una o más facturas.", parent=dlg)
+                return
+            idx = card_cb.current()
+            token = tokens[idx] if idx >= 0 else ""
+            rows = lotes_pagos.rows_from_receivables([registros[int(iid)] for iid in sel], method_var.get(), token)
+            button_clicked("PasarelaPagos", "Lote desde cartera", f"rows={len(rows)}")
+            dlg.destroy()
+            self._set_rows(rows)
+
+        ttk.Button(dlg, text="Agregar seleccionadas", style="Menu.TButton", command=agregar).pack(pady=8)
+
+    def _load_recurring(self):
+        recurring = lotes_pagos.load_recurring()
+        if not recurring:
+            messagebox.showinfo("Lotes recurrentes", "No hay lotes recurrentes guardados.", parent=self.top)
+            return
+        due_ids = {r["id"] for r in lotes_pagos.due_recurring()}
+        dlg = tk.Toplevel(self.top)
+        dlg.title("Lotes recurrentes")
+        dlg.configure(bg="#0f172a")
+        tree = ttk.Treeview(dlg, columns=("nombre", "dia", "filas", "ultima", "estado"), show="headings", height=10, selectmode="browse")
+        for c, txt in [("nombre", "Nombre"), ("dia", "Día"), ("filas", "Filas"), ("ultima", "Última ejecución"), ("estado", "Estado")]:
+            tree.heading(c, text=txt)
+            tree.column(c, width=140)
+        by_id = {}
+        for r in recurring:
+            by_id[r["id"]] = r
+            tree.insert("", "end", iid=r["id"], values=(r["nombre"], r["dia"], len(r["rows"]), (r.get("last_run") or "-")[:16],
+                                                       "Pendiente" if r["id"] in due_ids else "Al día"))
+        tree.pack(fill="both", expand=True, padx=10, pady=8)
+
+        def cargar():
+            sel = tree.selection()
+            if not sel:
+                return
+            r = by_id[sel[0]]
+            last = r.get("last_run")
+            if last and last[:7] == datetime.now().strftime("%Y-%m") and \
+                    (datetime.now() - datetime.fromisoformat(last)).total_seconds() >= IDEMPOTENCY_TTL_SECONDS:
+                # Dentro del TTL las llaves del mes reproducen las filas ya cobradas (retomar un
+                # corte); pasado el TTL ya no protegen y repetir volvería a cobrar
+                messagebox.showwarning("Lote recurrente", f"'{r['nombre']}' ya se ejecutó este mes ({last[:16]}).", parent=dlg)
+                return
+            dlg.destroy()
+            # Una llave por lote y mes: repetir la corrida del mes no vuelve a cobrar
+            batch_id = f"R{r['id']}-{datetime.now().strftime('%Y%m')}"
+            self._set_rows([dict(row) for row in r["rows"]], batch_id=batch_id, recurring_id=r["id"])
+
+        ttk.Button(dlg, text="Cargar lote", style="Menu.TButton", command=cargar).pack(pady=8)
+
+    def _save_recurring(self):
+        if not self.rows:
+            messagebox.showwarning("Sin filas", "Carga un lote antes de guardarlo como recurrente.", parent=self.top)
+            return
+        nombre = simpledialog.askstring("Lote recurrente", "Nombre del lote:", parent=self.top)
+        if not nombre:
+            return
+        dia = simpledialog.askinteger("Lote recurrente", "Día del mes para cobrar (1-28):", parent=self.top, minvalue=1, maxvalue=28)
+        if dia is None:
+            return
+        try:
+            lotes_pagos.save_recurring(nombre, dia, self.rows)
+        except Exception as e:
+            audit("batch_recurring_save_failed", f"name={nombre} err={e}")
+            messagebox.showerror("Error", f"No se pudo guardar el lote recurrente: {e}", parent=self.top)
+            return
+        audit("batch_recurring_saved", f"name={nombre} day={dia} rows={len(self.rows)}")
+        messagebox.showinfo("Guardado", f"Lote '{nombre}' se cobrará el día {dia} de cada mes.", parent=self.top)
+
+    # ---- Ejecución ----
+    def _run(self):
+        if self.running:
+            return
+        if not self.rows:
+            messagebox.showwarning("Sin filas", "Carga filas desde CSV, cartera o un lote recurrente.", parent=self.top)
+            return
+        known = self.app.methods_by_token
+        f = None
+        if any(lotes_pagos.METHOD_KINDS.get(r["metodo"]) == "card" for r in self.rows):
+            f = verify_master_and_get_fernet(self.top, "cobro por lote con tarjetas tokenizadas")
+            if f is None:
+                return
+        if self.dispatcher is None:
+            self.dispatcher = PaymentDispatcher(make_processor(PROCESSOR_URL), workers=lotes_pagos.BATCH_WORKERS,
+                                                timeout=PROCESSOR_TIMEOUT_SECONDS, retries=PROCESSOR_RETRIES,
+                                                idempotency=self.app.dispatcher.idempotency)
+        if self.recurring_id:
+            # Se marca antes de cobrar: un corte a mitad también cuenta como la corrida del mes
+            try:
+                lotes_pagos.mark_recurring_run(self.recurring_id)
+            except Exception as e:
+                audit("batch_recurring_mark_failed", f"id={self.recurring_id} err={e}")
+                messagebox.showerror("Error", f"No se pudo marcar el lote recurrente; no se cobró: {e}", parent=self.top)
+                return
+        audit("batch_payment_start", f"batch={self.batch_id} rows={len(self.rows)}")
+        self.running = True
+        self.started_at = datetime.now()
+        self.results = [None] * len(self.rows)
+        self.requests = [None] * len(self.rows)
+        self.done = queue.Queue()   # índices terminados (lo llenan los hilos del pool)
+        self.remaining = 0
+        self.finished = 0
+        self._unsaved = []          # filas terminadas que aún no están en transactions.json
+        self._saved_txs = []
+        self._reconciled = {"aplicadas": [], "sin_conciliar": []}
+        self.progress.configure(maximum=max(1, len(self.rows)), value=0)
+        for i, row in enumerate(self.rows):
+            reason = lotes_pagos.validate_row(row, known)
+            if reason:
+                self.results[i] = self.app._local_decline("05", reason, row["monto"])
+                self._mark_row(i)
+                continue
+            payload = None
+            if lotes_pagos.METHOD_KINDS[row["metodo"]] == "card":
+                try:
+                    payload = json.loads(f.decrypt(payment_method_blob(row["token"]).encode("utf-8")).decode("utf-8"))
+                except Exception as e:
+                    audit("batch_decrypt_failed", f"token={row['token']} err={e}")
+                    self.results[i] = self.app._local_decline("99", "Token inválido", row["monto"])
+                    self._mark_row(i)
+                    continue
+            request = lotes_pagos.build_request(row, payload)
+            key = lotes_pagos.row_idempotency_key(self.batch_id, i)
+            request["idempotency_key"] = key
+            self.requests[i] = request
+            future = self.dispatcher.submit(request, idempotency_key=key)
+            self.remaining += 1
+            future.add_done_callback(lambda fut, i=i: self.done.put((i, fut)))
+        self._poll()
+
+    def _mark_row(self, i):
+        res = self.results[i]
+        estado = {"approved": "Aprobado", "declined": "Rechazado", "error": "Error"}.get(res.get("status"), res.get("status"))
+        if res.get("replayed"):
+            estado += " (ya cobrado)"
+        if self.tree.exists(str(i)):
+            self.tree.set(str(i), "estado", f"{estado}: {res.get('message')}")
+        self._unsaved.append(i)
+        self.finished += 1
+        self.progress.configure(value=self.finished)
+
+    def _poll(self):
+        # Solo se tocan las filas que terminaron desde la última consulta
+        if not self.running:
+            return          # ventana cerrada: _drain_on_close ya guardó lo terminado
+        while True:
+            try:
+                i, fut = self.done.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.results[i] = fut.result()
+            except Exception as e:
+                audit("batch_payment_exception", str(e))
+                self.results[i] = self.app._local_decline("96", f"Error del procesador: {e}", self.rows[i]["monto"])
+            self.remaining -= 1
+            self._mark_row(i)
+        try:
+            self._persist()
+        except Exception as e:
+            # Las filas quedan pendientes y se reintenta en la siguiente ronda
+            audit("batch_payment_save_failed", f"batch={self.batch_id} err={e}")
+        if self.remaining > 0:
+            self.status_var.set(f"Lote {self.batch_id}: {len(self.rows) - self.remaining}/{len(self.rows)} procesados")
+            self.top.after(100, self._poll)
+            return
+        self._finish()
+
+    def _transaction(self, i, now):
+        row, res, request = self.rows[i], self.results[i], self.requests[i]
+        m = self.app.methods_by_token.get(row.get("token")) if lotes_pagos.METHOD_KINDS.get(row["metodo"]) == "card" else None
+        return {
+            "id": res.get("id"),
+            "cliente": row["cliente"],
+            "amount": res.get("amount") if res.get("amount") is not None else row["monto"],
+            "method": row["metodo"],
+            "status": res.get("status"),
+            "processor_code": res.get("processor_code"),
+            "message": res.get("message"),
+            "time": now,
+            "card_mask": m.get("mask") if m else (row.get("referencia") or row["metodo"]),
+            "extra": res.get("extra", {}),
+            "idempotency_key": request.get("idempotency_key") if request else None,
+            "batch_id": self.batch_id,
+        }
+
+    def _persist(self):
+        """Guarda y concilia las filas terminadas desde la última ronda."""
+        if not self._unsaved:
+            return
+        index = transaction_index()
+        now = datetime.now().isoformat()
+        # Una fila reproducida ya se guardó... salvo que la corrida anterior se cortara antes
+        txs = [self._transaction(i, now) for i in self._unsaved
+               if not (self.results[i].get("replayed") and index.has_id(self.results[i].get("id")))]
+        if txs:
+            save_transactions(txs)
+        self._unsaved = []
+        self._saved_txs.extend(txs)
+        reconciled = reconcile_receivables(txs)
+        if reconciled is not None:
+            self._reconciled["aplicadas"] += reconciled["aplicadas"]
+            self._reconciled["sin_conciliar"] += reconciled["sin_conciliar"]
+
+    def _finish(self):
+        finished_at = datetime.now()
+        try:
+            self._persist()
+            summary = lotes_pagos.reconciliation_summary(self.batch_id, self.rows, self.results, self.started_at, finished_at)
+            lotes_pagos.save_batch_summary(summary)
+        except Exception as e:
+            audit("batch_payment_save_failed", f"batch={self.batch_id} err={e}")
+            messagebox.showerror("Error", f"No se pudieron guardar los resultados del lote: {e}", parent=self.top)
+            self.running = False
+            return
+        audit("batch_payment_result", f"batch={self.batch_id} rows={summary['rows']} approved={summary['approved']} "
+                                      f"declined={summary['declined']} error={summary['error']} amount={summary['amount_approved']}")
+        self.running = False
+        self.status_var.set(f"Lote {self.batch_id} terminado en {summary['seconds']} s")
+        self.summary_txt.config(state="normal")
+        self.summary_txt.delete("1.0", "end")
+        self.summary_txt.insert("1.0", lotes_pagos.summary_text(summary))
+        if self._reconciled["aplicadas"] or self._reconciled["sin_conciliar"]:
+            self.summary_txt.insert("end", "\n\nCartera:\n" + conciliacion_pagos.resumen(self._reconciled))
+        self.summary_txt.config(state="disabled")
+        self.app._refresh_transactions_ui()
 
     def _on_close(self):
-        module_closed("PasarelaPagos", "window_closed")
-        self.root.destroy()
+        if self.running and not messagebox.askyesno("Lote en curso", "El lote sigue en proceso. ¿Cerrar de todas formas?", parent=self.top):
+            return
+        if self.dispatcher is not None:
+            if self.running:
+                # Las filas sin empezar se descartan; las que ya están en el procesador se
+                # esperan y se guardan, para que ningún cobro aprobado quede sin registrar
+                run_with_busy(self.top, "Esperando cobros en curso...", self.dispatcher.shutdown, True, True)
+                self._drain_on_close()
+                self.running = False
+            else:
+                self.dispatcher.shutdown(wait=False)
+        self.top.destroy()
+
+    def _drain_on_close(self):
+        while True:
+            try:
+                i, fut = self.done.get_nowait()
+            except queue.Empty:
+                break
+            if fut.cancelled():
+                continue
+            try:
+                self.results[i] = fut.result()
+            except Exception as e:
+                self.results[i] = self.app._local_decline("96", f"Error del procesador: {e}", self.rows[i]["monto"])
+            self._unsaved.append(i)
+        try:
+            self._persist()
+            audit("batch_payment_closed", f"batch={self.batch_id} saved={len(self._saved_txs)} rows={len(self.rows)}")
+        except Exception as e:
+            audit("batch_payment_save_failed", f"batch={self.batch_id} err={e}")
+            messagebox.showerror("Error", f"No se pudieron guardar los resultados del lote: {e}", parent=self.top)
+
+# ---- UI: Cierre de caja ----
+class CierreCajaWindow:
+    """Reporte instantáneo del día (totales en línea de cierre_caja) y cierre con arqueo de efectivo."""
+    def __init__(self, app):
+        self.app = app
+        self.top = tk.Toplevel(app.root)
+        self.top.title("Cierre de caja")
+        self.top.geometry("720x620")
+        self.top.configure(bg="#0f172a")
+        form = tk.Frame(self.top, bg="#0f172a")
+        form.pack(fill="x", padx=10, pady=8)
+        self.fecha_var = tk.StringVar(value=datetime.now().date().isoformat())
+        self.base_var = tk.StringVar(value="0")
+        self.contado_var = tk.StringVar(value="")
+        for col, (label, var, w) in enumerate([("Fecha (YYYY-MM-DD):", self.fecha_var, 12), ("Base inicial:", self.base_var, 12),
+                                               ("Efectivo contado:", self.contado_var, 12)]):
+            tk.Label(form, text=label, bg="#0f172a", fg="#e2e8f0").grid(row=0, column=col * 2, sticky="e", padx=4)
+            ttk.Entry(form, textvariable=var, width=w).grid(row=0, column=col * 2 + 1, sticky="w", padx=4)
+        btns = tk.Frame(self.top, bg="#0f172a")
+        btns.pack(fill="x", padx=10)
+        ttk.Button(btns, text="Ver reporte", style="Menu.TButton", command=self._show_report).pack(side="left", padx=4)
+        ttk.Button(btns, text="Cerrar caja", style="Menu.TButton", command=self._close_day).pack(side="left", padx=4)
+        ttk.Button(btns, text="Historial de cierres", style="Menu.TButton", command=self._show_history).pack(side="left", padx=4)
+        self.txt = tk.Text(self.top, bg="#1e293b", fg="#e2e8f0", height=24)
+        self.txt.pack(fill="both", expand=True, padx=10, pady=10)
+        self._show_report()
+
+    def _read_form(self, require_count=False):
+        fecha = self.fecha_var.get().strip()
+        try:
+            datetime.strptime(fecha, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showwarning("Validación", "Fecha inválida (YYYY-MM-DD).", parent=self.top)
+            return None
+        try:
+            base = float(self.base_var.get() or 0)
+            contado = self.contado_var.get().strip()
+            contado = float(contado) if contado else None
+        except ValueError:
+            messagebox.showwarning("Validación", "Base y efectivo contado deben ser numéricos.", parent=self.top)
+            return None
+        if require_count and contado is None:
+            messagebox.showwarning("Validación", "Ingresa el efectivo contado para cerrar la caja.", parent=self.top)
+            return None
+        return fecha, base, contado
+
+    def _report(self, fecha, base, contado):
+        return cierre_caja.reporte_cierre(fecha, cierre_caja.totales_dia(fecha, load_transactions), base, contado)
+
+    def _set_text(self, text):
+        self.txt.config(state="normal")
+        self.txt.delete("1.0", "end")
+        self.txt.insert("1.0", text)
+        self.txt.config(state="disabled")
+
+    def _show_report(self):
+        form = self._read_form()
+        if form is None:
+            return
+        self._set_text(cierre_caja.texto_reporte(self._report(*form)))
+
+    def _close_day(self):
+        form = self._read_form(require_count=True)
+        if form is None:
+            return
+        rep = self._report(*form)
+        if rep.get("diferencia") and not messagebox.askyesno(
+                "Diferencia en caja", f"Hay una diferencia de ${rep['diferencia']:,.2f}. ¿Cerrar de todas formas?", parent=self.top):
+            return
+        try:
+            snap = cierre_caja.guardar_cierre(rep, get_current_user())
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo guardar el cierre: {e}", parent=self.top)
+            return
+        audit("cash_close", f"fecha={rep['fecha']} aprobados={rep['aprobados']} esperado={rep['efectivo_esperado']} diferencia={rep.get('diferencia')}")
+        button_clicked("PasarelaPagos", "Cerrar caja", f"fecha={rep['fecha']}")
+        self._set_text(cierre_caja.texto_reporte(snap))
+        messagebox.showinfo("Cierre", f"Caja del {rep['fecha']} cerrada.", parent=self.top)
+
+    def _show_history(self):
+        cierres = cierre_caja.historial_cierres()
+        if not cierres:
+            self._set_text("No hay cierres guardados.")
+            return
+        lines = [f"{c['fecha']}  aprob. {c['aprobados']}  rech. {c['rechazados']}  total ${c['total_aprobado']:,.2f}  "
+                 f"efectivo esperado ${c['efectivo_esperado']:,.2f}  diferencia ${c.get('diferencia', 0):,.2f}  ({c.get('usuario') or '-'})"
+                 for c in cierres]
+        self._set_text("\n".join(lines))
+
+# ---- UI: progreso de exportación ----
+class ExportProgressWindow:
+    """
+    Ejecuta fn(*args, progress=..., cancel=...) en un hilo; el hilo solo publica el
+    contador de filas y Tk lo consulta cada 100 ms para la barra de progreso.
+    """
+    def __init__(self, root, text, total, fn, args, on_done, on_error):
+        self.total = max(1, total)
+        self.done_rows = 0
+        self.outcome = None
+        self.cancel = threading.Event()
+        self.on_done = on_done
+        self.on_error = on_error
+        self.top = tk.Toplevel(root)
+        self.top.title("Exportación")
+        self.top.configure(bg="#0f172a")
+        self.top.transient(root)
+        self.top.protocol("WM_DELETE_WINDOW", self.cancel.set)
+        tk.Label(self.top, text=text, bg="#0f172a", fg="#e2e8f0").pack(padx=20, pady=(16, 6))
+        self.bar = ttk.Progressbar(self.top, mode="determinate", length=360, maximum=self.total)
+        self.bar.pack(padx=20, pady=6)
+        self.status_var = tk.StringVar(value="")
+        tk.Label(self.top, textvariable=self.status_var, bg="#0f172a", fg="#fbbf24").pack(padx=20)
+        ttk.Button(self.top, text="Cancelar", style="Menu.TButton", command=self.cancel.set).pack(pady=10)
+
+        def work():
+            try:
+                self.outcome = ("ok", fn(*args, progress=self._progress, cancel=self.cancel))
+            except BaseException as e:
+                self.outcome = ("error", e)
+
+        threading.Thread(target=work, name="exportacion", daemon=True).start()
+        self._poll()
+
+    def _progress(self, n):
+        self.done_rows = n   # asignación simple desde el hilo; Tk la lee en _poll
+
+    def _poll(self):
+        self.bar.configure(value=min(self.done_rows, self.total))
+        self.status_var.set(f"{self.done_rows:,} / {self.total:,} filas" + (" — cancelando..." if self.cancel.is_set() else ""))
+        if self.outcome is None:
+            self.top.after(100, self._poll)
+            return
+        self.top.destroy()
+        kind, value = self.outcome
+        if kind == "ok":
+            self.on_done(value)
+        else:
+            self.on_error(value)
 
 # ---- small utils reused ----
 def luhn_checksum(card_number: str) -> bool:
@@ -899,19 +1700,6 @@ def mask_card(card_number: str) -> str:
         return s
     return "**** **** **** " + s[-4:]
 
-def simulate_charge(card_full: str, amount: float):
-    time.sleep(0.6)
-    tx_id = str(uuid.uuid4())
-    ok = secrets.randbelow(100) >= 5
-    result = {
-        "id": tx_id,
-        "status": "approved" if ok else "declined",
-        "processor_code": "00" if ok else "05",
-        "message": "Aprobado" if ok else "Rechazado por emisor",
-        "amount": amount
-    }
-    return ok, result
-
 # ---- Run standalone ----
 if __name__ == "__main__":
     ensure_base_dir()
@@ -0,0 +1,358 @@
+# procesador_pagos.py
+# Interfaz de procesador de pagos para pasarela_pagos: procesador simulado (local),
+# procesador HTTP y despachador con pool de hilos, timeouts y reintentos.
+# Incluye un servidor sandbox HTTP que imita una pasarela (latencia y rechazos):
+#   python procesador_pagos.py --sandbox --port 8765
+
+import os
+import json
+import time
+import uuid
+import secrets
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from security_core import audit
+from bloqueo_archivos import bloqueo
+
+DEFAULT_TIMEOUT_SECONDS = 5.0
+DEFAULT_RETRIES = 2
+DEFAULT_WORKERS = 8
+RETRY_BACKOFF_SECONDS = 0.5
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+
+# Latencia (s), % de rechazo y mensajes por tipo de método (valores del sandbox original)
+PROFILES = {
+    "card": {"latency": 0.6, "decline_pct": 5, "approved": "Aprobado", "declined": "Rechazado por emisor"},
+    "pse": {"latency": 0.8, "decline_pct": 8, "approved": "Aprobado PSE", "declined": "Rechazado por banco"},
+    "wallet": {"latency": 0.7, "decline_pct": 7, "approved": "Aprobado {provider}", "declined": "Rechazado por {provider}"},
+    "transfer": {"latency": 0.5, "decline_pct": 0, "approved": "Comprobante verificado", "declined": "Comprobante rechazado"},
+    "cash": {"latency": 0.2, "decline_pct": 0, "approved": "Pago en efectivo registrado", "declined": "Pago rechazado"},
+}
+
+class ProcessorError(Exception):
+    """Falla transitoria (timeout, conexión, 5xx). El despachador reintenta."""
+
+def build_result(request, approved, message, tx_id=None):
+    return {
+        "id": tx_id or str(uuid.uuid4()),
+        "status": "approved" if approved else "declined",
+        "processor_code": "00" if approved else "05",
+        "message": message,
+        "amount": request.get("amount"),
+        "extra": request.get("extra", {}),
+    }
+
+def simulate(request, latency_scale=1.0, max_wait=None):
+    """Decisión del sandbox para una solicitud; usada por el procesador local y el servidor HTTP."""
+    profile = PROFILES.get(request.get("kind"), PROFILES["card"])
+    latency = profile["latency"] * latency_scale
+    if max_wait is not None and latency > max_wait:
+        time.sleep(max_wait)
+        raise ProcessorError("timeout")
+    time.sleep(latency)
+    ok = secrets.randbelow(100) >= profile["decline_pct"]
+    provider = request.get("extra", {}).get("provider", "")
+    message = (profile["approved"] if ok else profile["declined"]).format(provider=provider)
+    return build_result(request, ok, message)
+
+# ---- Procesadores ----
+class PaymentProcessor:
+    """
+    Interfaz: charge(request, timeout) -> result dict (mismo formato que transactions.json).
+    request = {"kind": card|pse|wallet|transfer|cash, "method", "amount", "card"?, "extra"}.
+    Se ejecuta en un hilo del despachador, nunca en el hilo de Tk.
+    """
+    name = "base"
+
+    def charge(self, request, timeout):
+        raise NotImplementedError
+
+class SimulatedProcessor(PaymentProcessor):
+    name = "sandbox-local"
+
+    def __init__(self, latency_scale=1.0):
+        self.latency_scale = latency_scale
+
+    def charge(self, request, timeout):
+        return simulate(request, self.latency_scale, max_wait=timeout)
+
+class HttpProcessor(PaymentProcessor):
+    name = "http"
+
+    def __init__(self, url):
+        self.url = url
+
+    def charge(self, request, timeout):
+        body = json.dumps(request).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if request.get("idempotency_key"):
+            headers["Idempotency-Key"] = request["idempotency_key"]
+        req = urllib.request.Request(self.url, data=body, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code >= 500:
+                raise ProcessorError(f"HTTP {e.code}")
+            raise
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise ProcessorError(str(e))
+
+def make_processor(url=None, latency_scale=1.0):
+    return HttpProcessor(url) if url else SimulatedProcessor(latency_scale)
+
+# ---- Idempotencia ----
+class IdempotencyStore:
+    """
+    Índice persistente llave de idempotencia -> resultado final del cobro.
+    En memoria es un dict (consulta O(1)); en disco, un JSONL de solo-anexar
+    que se compacta al cargar o cuando acumula demasiadas entradas vencidas.
+    La ventana de lotes y la principal comparten el archivo: anexar, compactar y
+    leer lo que otro escribió se hacen con el candado "<archivo>.lock", y una llave
+    que no está en memoria se busca en la cola nueva del archivo antes de darla
+    por desconocida.
+    """
+    def __init__(self, path=None, ttl_seconds=IDEMPOTENCY_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}   # key -> (expires_at, result)
+        self._lines = 0      # líneas en disco (vivas + vencidas/reemplazadas)
+        self._pos = 0        # bytes del archivo ya leídos
+        self._ino = None
+        self._lock = threading.Lock()
+        if path:
+            self._flock = bloqueo(path + ".lock")
+            with self._flock:
+                self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.path:
+                with self._flock:
+                    self._refresh()
+                entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key, result):
+        expires = time.time() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires, result)
+            if not self.path:
+                return
+            with self._flock:
+                self._refresh()
+                with open(self.path, "ab") as f:
+                    f.write((json.dumps({"key": key, "expires": expires, "result": result}, ensure_ascii=False) + "\n").encode("utf-8"))
+                    self._pos = f.tell()
+                self._lines += 1
+                if self._lines > 2 * len(self._entries) + 1000:
+                    self._evict_expired()
+                    self._compact()
+
+    def _evict_expired(self):
+        now = time.time()
+        for k in [k for k, (exp, _) in self._entries.items() if exp < now]:
+            del self._entries[k]
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        self._refresh()
+        self._evict_expired()
+        if self._lines > len(self._entries):
+            self._compact()
+
+    def _refresh(self):
+        """Lee lo anexado desde la última lectura (todo, si otro proceso compactó). Con el candado tomado."""
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self._ino or st.st_size < self._pos:
+                self._ino, self._pos, self._lines = st.st_ino, 0, 0
+            if st.st_size == self._pos:
+                return
+            f.seek(self._pos)
+            data = f.read(st.st_size - self._pos)
+        completo = data.rfind(b"\n") + 1
+        for line in data[:completo].splitlines():
+            self._lines += 1
+            try:
+                rec = json.loads(line)
+                self._entries[rec["key"]] = (rec["expires"], rec["result"])
+            except Exception:
+                continue
+        self._pos += completo
+
+    def _compact(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for key, (expires, result) in self._entries.items():
+                f.write(json.dumps({"key": key, "expires": expires, "result": result}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        try:
+            if os.name == "posix":
+                os.chmod(self.path, 0o600)
+        except Exception:
+            pass
+        st = os.stat(self.path)
+        self._ino, self._pos, self._lines = st.st_ino, st.st_size, len(self._entries)
+
+def new_idempotency_key():
+    return str(uuid.uuid4())
+
+# ---- Despachador ----
+class PaymentDispatcher:
+    """
+    Envía cobros a un pool de hilos. Cada intento tiene su timeout y las fallas
+    transitorias (ProcessorError) se reintentan con espera exponencial; un
+    rechazo del emisor es una respuesta válida y no se reintenta.
+    Con llave de idempotencia, un cobro ya resuelto devuelve su resultado
+    original (marcado "replayed") sin tocar el procesador, y uno en curso
+    devuelve el mismo Future.
+    """
+    def __init__(self, processor, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT_SECONDS, retries=DEFAULT_RETRIES,
+                 idempotency=None):
+        self.processor = processor
+        self.timeout = timeout
+        self.retries = retries
+        self.idempotency = idempotency if idempotency is not None else IdempotencyStore()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pagos")
+
+    def submit(self, request, idempotency_key=None):
+        """Devuelve un Future cuyo resultado es el dict del procesador."""
+        if not idempotency_key:
+            return self._pool.submit(self._charge_with_retries, request)
+        cached = self.idempotency.get(idempotency_key)
+        if cached is not None:
+            done = Future()
+            done.set_result(dict(cached, replayed=True))
+            return done
+        with self._lock:
+            future = self._inflight.get(idempotency_key)
+            if future is not None:
+                return future
+            # Pudo terminar entre la consulta de arriba y tomar el candado
+            cached = self.idempotency.get(idempotency_key)
+            if cached is not None:
+                done = Future()
+                done.set_result(dict(cached, replayed=True))
+                return done
+            request = dict(request, idempotency_key=idempotency_key)
+            future = self._pool.submit(self._charge_with_retries, request)
+            self._inflight[idempotency_key] = future
+        future.add_done_callback(lambda _f, k=idempotency_key: self._inflight.pop(k, None))
+        return future
+
+    def _charge_with_retries(self, request):
+        last_error = None
+        key = request.get("idempotency_key")
+        for attempt in range(self.retries + 1):
+            try:
+                result = self.processor.charge(request, self.timeout)
+                result.setdefault("extra", request.get("extra", {}))
+                result["attempts"] = attempt + 1
+                if key and result.get("status") in ("approved", "declined"):
+                    # Solo se memorizan respuestas finales; un "error" se puede reintentar.
+                    # Si no se puede guardar, el cobro igual ocurrió: se devuelve su resultado
+                    try:
+                        self.idempotency.put(key, result)
+                    except Exception as e:
+                        audit("idempotency_store_failed", f"key={key} status={result.get('status')} error={e}")
+                return result
+            except ProcessorError as e:
+                last_error = e
+                if attempt < self.retries:
+                    time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+        result = build_result(request, False, f"Procesador no disponible: {last_error}")
+        result["status"] = "error"
+        result["processor_code"] = "91"
+        result["attempts"] = self.retries + 1
+        return result
+
+    def shutdown(self, wait=False, cancel=None):
+        """cancel (por defecto: not wait) descarta las solicitudes que aún no empezaron."""
+        self._pool.shutdown(wait=wait, cancel_futures=(not wait) if cancel is None else cancel)
+
+# ---- Servidor sandbox HTTP ----
+class _SandboxHandler(BaseHTTPRequestHandler):
+    latency_scale = 1.0
+    failure_pct = 0  # % de respuestas 503 para probar reintentos
+    responses = None  # Idempotency-Key -> respuesta (como una pasarela real)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+        except Exception:
+            self._reply(400, {"error": "JSON inválido"})
+            return
+        key = self.headers.get("Idempotency-Key")
+        if key and key in self.responses:
+            self._reply(200, self.responses[key])
+            return
+        if self.failure_pct and secrets.randbelow(100) < self.failure_pct:
+            self._reply(503, {"error": "sandbox no disponible"})
+            return
+        result = simulate(request, self.latency_scale)
+        if key:
+            self.responses[key] = result
+        self._reply(200, result)
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        # No registrar solicitudes: el cuerpo de un cobro con tarjeta contiene el número
+        pass
+
+def start_sandbox_server(host="127.0.0.1", port=8765, latency_scale=1.0, failure_pct=0):
+    """Arranca el sandbox en un hilo daemon y devuelve el servidor (server.shutdown() para detenerlo)."""
+    handler = type("SandboxHandler", (_SandboxHandler,), {"latency_scale": latency_scale, "failure_pct": failure_pct, "responses": {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    t = threading.Thread(target=server.serve_forever, name="sandbox-pagos", daemon=True)
+    t.start()
+    return server
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Sandbox HTTP de la pasarela de pagos")
+    parser.add_argument("--sandbox", action="store_true", help="arrancar el servidor sandbox")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--failure-pct", type=int, default=0)
+    args = parser.parse_args()
+    if args.sandbox:
+        srv = start_sandbox_server(args.host, args.port, args.latency_scale, args.failure_pct)
+        print(f"Sandbox de pagos en http://{args.host}:{args.port}/charges (Ctrl+C para salir)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            srv.shutdown()
+    else:
+        parser.print_help()
@@ -5,6 +5,8 @@ import os
 from datetime import datetime
 import openpyxl
 
+from busqueda_taller import IndiceBusqueda, cargar_inventario, vincular_combobox
+
 # ==========================
 # CONFIGURACIÓN
 # ==========================
@@ -53,6 +55,14 @@ def format_currency(v):
     except Exception:
         return f"${v}"
 
+def repuestos_disponibles():
+    """Repuestos fijos + productos del inventario, por etiqueta del combobox."""
+    por_etiqueta = {r["nombre"]: r for r in REPUESTOS}
+    for p in cargar_inventario():
+        etiqueta = f'{p.get("Producto", "")} ({p.get("Código", "")})'
+        por_etiqueta.setdefault(etiqueta, {"nombre": p.get("Producto", ""), "precio": p.get("Precio Unitario", 0)})
+    return por_etiqueta
+
 # ==========================
 # PERSISTENCIA
 # ==========================
@@ -128,6 +138,12 @@ class OrdenesTallerApp:
         self.repuestos_seleccionados = []
         self.edit_index = None  # Índice de orden que se está editando (None si es nueva)
 
+        # Buscador de repuestos (trigramas, sin tildes)
+        self.repuestos = repuestos_disponibles()
+        self.indice_repuestos = IndiceBusqueda()
+        for etiqueta in self.repuestos:
+            self.indice_repuestos.agregar(etiqueta, etiqueta)
+
         self._estilos()
         self._layout()
         self.update_totales()  # mostrar valores iniciales
@@ -208,8 +224,9 @@ class OrdenesTallerApp:
         ttk.Combobox(left, values=ESTADOS, textvariable=self.estado, state="readonly").grid(row=9, column=1, padx=5, pady=3)
 
         ttk.Label(left, text="Repuesto").grid(row=10, column=0, sticky="w", padx=5)
-        self.rep_cb = ttk.Combobox(left, values=[r["nombre"] for r in REPUESTOS], state="readonly")
-        if REPUESTOS:
+        self.rep_cb = ttk.Combobox(left, values=list(self.repuestos))
+        vincular_combobox(self.rep_cb, self.indice_repuestos, list(self.repuestos))
+        if self.repuestos:
             self.rep_cb.current(0)
         self.rep_cb.grid(row=10, column=1, padx=5, pady=3)
 
@@ -265,8 +282,18 @@ class OrdenesTallerApp:
         self.update_totales()
 
     def agregar_repuesto(self):
-        nombre = self.rep_cb.get()
-        rep = next((r for r in REPUESTOS if r["nombre"] == nombre), None)
+        etiqueta = self.rep_cb.get()
+        rep = self.repuestos.get(etiqueta)
+        if rep is None and etiqueta.strip():
+            # Texto libre: la mejor coincidencia solo se agrega si el usuario la confirma
+            mejor = self.indice_repuestos.buscar(etiqueta, limite=1)
+            if not mejor:
+                messagebox.showwarning("Repuestos", "Repuesto no encontrado; elige uno de la lista.")
+                return
+            if not messagebox.askyesno("Repuestos", f"«{etiqueta}» no está en la lista.\n¿Agregar «{mejor[0][0]}»?"):
+                return
+            self.rep_cb.set(mejor[0][0])
+            rep = self.repuestos.get(mejor[0][0])
         if rep:
             self.repuestos_seleccionados.append(rep)
             self._actualizar_rep_display()
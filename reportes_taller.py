@@ -2,9 +2,11 @@
 # Módulo de reportes ejecutivos: ventas, órdenes, cartera y compras
 # Mantiene estilo: fondo oscuro (#0f172a), paneles (#1e293b), botones naranjas ("Menu.TButton")
 # Gráficos con matplotlib embebidos en Tkinter
+# "Uso del sistema": sesiones, permanencia por módulo y clics (analitica_sesiones)
 
 import os
 import json
+import threading
 from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
@@ -17,12 +19,15 @@ matplotlib.use("Agg")  # backend no interactivo para evitar conflictos
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+from analitica_sesiones import analizar, texto_resumen, top_modulos, top_botones, DIAS
+
 BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
 VENTAS_FILE = os.path.join(BASE_DIR, "ventas.json")
 ORDENES_FILE = os.path.join(BASE_DIR, "ordenes_taller.json")
 CARTERA_FILE = os.path.join(BASE_DIR, "cartera.json")
 COMPRAS_FILE = os.path.join(BASE_DIR, "compras.json")
 EXPORT_XLSX = os.path.join(BASE_DIR, "reportes_ejecutivos.xlsx")
+AUDIT_DIR = os.path.join(BASE_DIR, "auditoria")
 
 def _ensure_base_dir():
     if not os.path.exists(BASE_DIR):
@@ -165,6 +170,7 @@ class ReportesTallerApp:
 
         ttk.Button(left, text="🔄 Actualizar", style="Menu.TButton", command=self._load_data).pack(padx=10, pady=6, anchor="w")
         ttk.Button(left, text="📊 Exportar Excel", style="Menu.TButton", command=self._exportar).pack(padx=10, pady=6, anchor="w")
+        ttk.Button(left, text="👥 Uso del sistema", style="Menu.TButton", command=self._uso_sistema).pack(padx=10, pady=6, anchor="w")
 
         # Derecha: gráficos
         right = tk.Frame(main, bg="#1e293b")
@@ -244,6 +250,86 @@ class ReportesTallerApp:
         self.fig.tight_layout()
         self.canvas.draw()
 
+    def _uso_sistema(self):
+        # El análisis es incremental, pero la primera corrida recorre todo el historial:
+        # corre fuera del hilo de Tk
+        top = tk.Toplevel(self.root)
+        top.title("👥 Uso del sistema")
+        top.geometry("1150x680")
+        top.configure(bg="#0f172a")
+
+        left = tk.Frame(top, bg="#1e293b")
+        left.pack(side="left", fill="y", padx=10, pady=10)
+        txt = tk.Text(left, width=52, height=34, bg="#0b1220", fg="#e2e8f0")
+        txt.pack(padx=10, pady=10)
+        txt.insert("1.0", "Analizando el audit log...")
+        txt.config(state="disabled")
+
+        right = tk.Frame(top, bg="#1e293b")
+        right.pack(side="right", fill="both", expand=True, padx=10, pady=10)
+        fig = Figure(figsize=(7, 6), facecolor="#0f172a")
+        canvas = FigureCanvasTkAgg(fig, master=right)
+        canvas.get_tk_widget().pack(fill="both", expand=True)
+
+        resultado = {}
+
+        def trabajo():
+            try:
+                resultado["st"] = analizar(AUDIT_DIR)
+            except Exception as e:
+                resultado["error"] = e
+        hilo = threading.Thread(target=trabajo, daemon=True)
+        hilo.start()
+
+        def esperar():
+            if not top.winfo_exists():
+                return                  # se cerró la ventana mientras se analizaba
+            if hilo.is_alive():
+                top.after(100, esperar)
+                return
+            if "error" in resultado:
+                messagebox.showerror("Error", f"No se pudo analizar el audit log: {resultado['error']}", parent=top)
+                return
+            self._mostrar_uso(resultado["st"], txt, fig, canvas)
+        esperar()
+
+    def _mostrar_uso(self, st, txt, fig, canvas):
+        txt.config(state="normal")
+        txt.delete("1.0", "end")
+        txt.insert("1.0", texto_resumen(st))
+        txt.config(state="disabled")
+
+        fig.clear()
+        ax1 = fig.add_subplot(311, facecolor="#0f172a")
+        ax2 = fig.add_subplot(312, facecolor="#0f172a")
+        ax3 = fig.add_subplot(313, facecolor="#0f172a")
+        for ax in [ax1, ax2, ax3]:
+            ax.tick_params(colors="#e2e8f0")
+            for side in ("bottom", "top", "left", "right"):
+                ax.spines[side].set_color("#94a3b8")
+
+        # Permanencia por módulo (minutos)
+        mods = [m for m in top_modulos(st, 8) if m[1] > 0]
+        ax1.barh([m[0] for m in mods] or ["Sin datos"], [round(m[1] / 60, 1) for m in mods] or [0], color="#f59e0b")
+        ax1.invert_yaxis()
+        ax1.set_title("Permanencia por módulo (min)", color="#e2e8f0")
+
+        # Botones más usados
+        bots = top_botones(st, 8)
+        ax2.barh([f"{m} / {b}"[:40] for m, b, _ in bots] or ["Sin datos"], [q for _, _, q in bots] or [0], color="#f59e0b")
+        ax2.invert_yaxis()
+        ax2.set_title("Botones más usados (clics)", color="#e2e8f0")
+
+        # Clics por día de la semana y hora
+        ax3.imshow(st["horas"], aspect="auto", cmap="YlOrBr")
+        ax3.set_yticks(range(len(DIAS)))
+        ax3.set_yticklabels(DIAS)
+        ax3.set_xticks(range(0, 24, 2))
+        ax3.set_title("Clics por día y hora", color="#e2e8f0")
+
+        fig.tight_layout()
+        canvas.draw()
+
     def _exportar(self):
         resumen = {
             "ventas": _ventas_stats(),
@@ -1,15 +1,39 @@
 # security_core.py
 import os
 import json
+import queue
+import atexit
 import getpass
 import threading
+import time
 from datetime import datetime
 from typing import Optional
 
+from auditoria_log import SegmentLog, build_record
+from indice_auditoria import SegmentIndex
+from integridad_auditoria import Checkpointer
+
 BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
-AUDIT_LOG = os.path.join(BASE_DIR, "security_audit.log")
+AUDIT_LOG = os.path.join(BASE_DIR, "security_audit.log")     # legacy text log (migrated once)
+AUDIT_DIR = os.path.join(BASE_DIR, "auditoria")              # JSONL segments + manifest
+AUDIT_KEY_FILE = os.path.join(BASE_DIR, "audit_checkpoint.key")  # HMAC key for signed checkpoints
+
+# Audit writer: the caller only enqueues; a background thread builds the JSON
+# records and writes them with one append per batch.
+AUDIT_FLUSH_INTERVAL = 0.2      # idle poll: after this many quiet seconds unsynced lines are fsynced
+AUDIT_BATCH_MAX = 1000          # lines per write
+# fsync policy: "batch" (every write), "interval" (at most every AUDIT_FSYNC_INTERVAL s while
+# writing, and as soon as the writer goes idle) or "never" (leave it to the OS)
+AUDIT_FSYNC = os.environ.get("TALLER_AUDIT_FSYNC", "interval")
+AUDIT_FSYNC_INTERVAL = 2.0
+# A batch whose write fails is kept and retried (oldest lines dropped past AUDIT_RETRY_MAX)
+AUDIT_RETRY_DELAY = 1.0
+AUDIT_RETRY_MAX = 100_000
 
-_SESSION = {"user": None, "started_at": None, "session_id": None}
+# Los módulos que abre el panel (subprocesos) heredan la sesión por el entorno
+SESSION_ENV_ID = "TALLER_SESSION_ID"
+SESSION_ENV_USER = "TALLER_SESSION_USER"
+_SESSION = {"user": os.environ.get(SESSION_ENV_USER), "started_at": None, "session_id": os.environ.get(SESSION_ENV_ID)}
 
 def ensure_base_dir():
     if not os.path.exists(BASE_DIR):
@@ -18,22 +42,193 @@ def ensure_base_dir():
 def _now_iso():
     return datetime.now().isoformat(sep=" ", timespec="seconds")
 
-def audit(event: str, details: str = ""):
+class _FlushRequest:
+    __slots__ = ("done", "close", "ok")
+
+    def __init__(self, close):
+        self.done = threading.Event()
+        self.close = close
+        self.ok = True
+
+class _AuditWriter:
     """
-    Write a structured audit line:
-      timestamp | event | user | details
-    details is a free text (prefer JSON for structured data).
+    Group commit for the audit log: events wait in a queue and the writer thread
+    appends everything pending in a single write, then fsyncs per AUDIT_FSYNC.
+    The active segment stays open between batches (reopened if AUDIT_DIR changes);
+    rotation and compression happen here too, off the caller's thread. Every
+    CHECKPOINT_EVERY records and on every explicit flush the chain head is fsynced
+    and signed (integridad_auditoria). When the queue goes quiet the writer fsyncs
+    whatever is still unsynced and retries a batch whose write failed.
     """
-    ensure_base_dir()
-    user = get_current_user()
-    ts = _now_iso()
-    line = f"{ts} | {event} | {user} | {details}\n"
-    try:
-        with open(AUDIT_LOG, "a", encoding="utf-8") as f:
-            f.write(line)
-    except Exception:
-        # Do not crash the app for logging failures
-        pass
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._log = None
+        self._checkpoints = None
+        self._dir = None
+        self._last_sync = 0.0
+        self._unsynced = False
+        self._retry = []
+        self._retry_at = 0.0
+
+    def put(self, item):
+        self._queue.put(item)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=5.0, close=False):
+        """Block until every line queued before this call is on disk (close: release the file)."""
+        if self._thread is None:
+            return True
+        req = _FlushRequest(close)
+        self._queue.put(req)
+        return req.done.wait(timeout) and req.ok
+
+    def _run(self):
+        while True:
+            try:
+                self._step()
+            except Exception:
+                # One bad batch must not end the thread: every later flush would time out
+                self._close()
+
+    def _step(self):
+        waiters = []
+        try:
+            item = self._queue.get(timeout=AUDIT_FLUSH_INTERVAL)
+        except queue.Empty:
+            self._idle()
+            return
+        ok = False
+        try:
+            # Lines from a failed write go first so the log keeps their order
+            batch, self._retry = self._retry, []
+            while True:
+                if isinstance(item, _FlushRequest):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= AUDIT_BATCH_MAX:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            ok = True
+            if batch:
+                ok = self._write(batch, checkpoint=bool(waiters))
+            elif waiters:
+                self._checkpoint()
+            if any(w.close for w in waiters):
+                self._close()
+        finally:
+            for w in waiters:
+                w.ok = ok
+                w.done.set()
+
+    def _idle(self):
+        if self._retry and time.monotonic() >= self._retry_at:
+            batch, self._retry = self._retry, []
+            self._write(batch)
+        elif self._unsynced and self._log is not None:
+            try:
+                self._log.sync()
+                self._last_sync = time.monotonic()
+                self._unsynced = False
+            except Exception:
+                self._close()
+
+    def _write(self, events, checkpoint=False):
+        """Append events; on failure keep them for a later retry and return False."""
+        try:
+            if self._log is None or self._dir != AUDIT_DIR:
+                self._close()
+                ensure_base_dir()
+                self._dir = AUDIT_DIR
+                # Both or neither: a half-open writer would fail on every later batch
+                checkpoints = Checkpointer(AUDIT_DIR, AUDIT_KEY_FILE)
+                # The query index of each sealed segment is built here, off the UI thread
+                self._log = SegmentLog(AUDIT_DIR, legacy_log=AUDIT_LOG, on_seal=SegmentIndex.load_or_build)
+                self._checkpoints = checkpoints
+            now = time.monotonic()
+            sync = AUDIT_FSYNC == "batch" or (AUDIT_FSYNC == "interval" and now - self._last_sync >= AUDIT_FSYNC_INTERVAL)
+            synced = self._log.append(_records(events), sync=sync)
+        except Exception:
+            # Do not crash the app for logging failures: reopen and retry the batch later
+            self._close()
+            self._retry = (events + self._retry)[-AUDIT_RETRY_MAX:]
+            self._retry_at = time.monotonic() + AUDIT_RETRY_DELAY
+            return False
+        if synced:
+            self._last_sync, self._unsynced = now, False
+        else:
+            self._unsynced = AUDIT_FSYNC != "never"
+        if checkpoint or self._checkpoints.last_n + self._checkpoints.every <= self._log.last_n:
+            self._checkpoint()
+        return True
+
+    def _checkpoint(self):
+        # The signed head must never point past what is on disk: sync first. Under the
+        # log lock, so checkpoints from several processes are signed in chain order
+        if self._log is None or self._checkpoints is None or self._log.last_n <= self._checkpoints.last_n:
+            return
+        try:
+            with self._log.lock:
+                if self._unsynced:
+                    self._log.sync()
+                    self._last_sync = time.monotonic()
+                    self._unsynced = False
+                self._checkpoints.record(self._log.last_n, self._log.last_hash, force=True)
+        except Exception:
+            pass
+
+    def _close(self):
+        if self._log is not None:
+            self._checkpoint()
+            try:
+                self._log.close()
+            except Exception:
+                pass
+        self._log = None
+        self._unsynced = False
+
+def _records(events):
+    # An event that cannot be turned into a record is dropped, not retried forever
+    out = []
+    for ev in events:
+        try:
+            out.append(build_record(*ev))
+        except Exception:
+            pass
+    return out
+
+_audit_writer = _AuditWriter()
+
+def audit(event: str, details: str = "", **fields):
+    """
+    Queue an audit record (built and written by the background writer):
+      {"ts", "event", "user", "session", "module", "data", "msg"}
+    details may be JSON or "key=value ..." (parsed into typed data) or free text
+    (kept as msg); keyword fields go straight into data.
+    """
+    ts = datetime.now().isoformat(timespec="milliseconds")
+    _audit_writer.put((ts, event, get_current_user(), _SESSION.get("session_id"), details, fields))
+
+def flush_audit(timeout: float = 5.0, close: bool = False) -> bool:
+    """
+    Wait until pending audit records are written (call before reading AUDIT_DIR).
+    close=True also releases the file handle (exit, or before moving the log).
+    """
+    return _audit_writer.flush(timeout, close)
+
+atexit.register(flush_audit, close=True)
 
 def get_current_user():
     # Prefer session user if set, otherwise OS user
@@ -60,14 +255,19 @@ def start_user_session(user: Optional[str] = None):
             _SESSION["user"] = "unknown"
     _SESSION["started_at"] = _now_iso()
     _SESSION["session_id"] = f"{_SESSION['user']}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    os.environ[SESSION_ENV_ID] = _SESSION["session_id"]
+    os.environ[SESSION_ENV_USER] = _SESSION["user"]
     audit("session_started", json.dumps({"session_id": _SESSION["session_id"], "user": _SESSION["user"], "started_at": _SESSION["started_at"]}))
 
 def end_user_session():
     sid = _SESSION.get("session_id")
     audit("session_ended", json.dumps({"session_id": sid}))
+    flush_audit()
     _SESSION["user"] = None
     _SESSION["started_at"] = None
     _SESSION["session_id"] = None
+    os.environ.pop(SESSION_ENV_ID, None)
+    os.environ.pop(SESSION_ENV_USER, None)
 
 # ---- Module / navigation helpers ----
 def module_opened(module_name: str, details: str = ""):
@@ -0,0 +1,151 @@
+# tarjetas_lote.py
+# Validación masiva de tarjetas con NumPy (importación de listas heredadas a la bóveda):
+# limpieza de separadores, Luhn y enmascarado por arreglos, sin recorrer dígito a
+# dígito en Python; marca/tipo con la misma tabla BIN (trie) de bin_marcas.
+# Equivale a luhn_checksum/mask_card de la pasarela.
+#
+#   python tarjetas_lote.py --benchmark 200000
+
+import numpy as np
+
+from bin_marcas import bin_table
+
+CHUNK = 100_000
+MAX_CHARS = 24                 # caracteres por entrada (19 dígitos + separadores)
+MIN_LEN, MAX_LEN = 12, 19
+MASK_PREFIX = "**** **** **** "
+_SEPARATORS = (ord(" "), ord("-"))
+
+def classify_bins(bin6, table=None):
+    """
+    (marca, tipo) por BIN de 6 dígitos (arreglo de enteros). Una lista real repite
+    pocos BIN, así que se consulta el trie una vez por BIN distinto y se expande.
+    """
+    table = table or bin_table()
+    uniq, inverse = np.unique(bin6, return_inverse=True)
+    found = [table.lookup(f"{b:06d}") for b in uniq.tolist()]
+    brands = np.array([b for b, _ in found] or [""])
+    types = np.array([t for _, t in found] or [""])
+    return brands[inverse], types[inverse]
+
+_DOUBLE = np.array([0, 2, 4, 6, 8, 1, 3, 5, 7, 9], dtype=np.int16)   # 2*d - 9 si pasa de 9
+_POW10 = 10 ** np.arange(6, dtype=np.int64)
+
+def _validate_chunk(numbers, table):
+    n = len(numbers)
+    # Cada entrada como fila de códigos Unicode (n, MAX_CHARS); relleno = 0
+    codes = np.array(numbers, dtype=f"U{MAX_CHARS}").view(np.uint32).reshape(n, MAX_CHARS)
+    truncated = np.fromiter(map(len, numbers), dtype=np.int32, count=n) > MAX_CHARS
+    blank = np.fromiter((not s.strip() for s in numbers), dtype=bool, count=n)
+    is_digit = (codes >= 48) & (codes <= 57)
+    is_sep = (codes == _SEPARATORS[0]) | (codes == _SEPARATORS[1])
+    bad_chars = ((codes != 0) & ~is_digit & ~is_sep).any(axis=1)
+    digits = np.where(is_digit, codes - 48, 0).astype(np.int16)
+
+    # Posición de cada dígito contada desde la derecha y desde la izquierda,
+    # ignorando separadores (sumas acumuladas; no hace falta compactar la fila)
+    from_right = np.cumsum(is_digit[:, ::-1], axis=1, dtype=np.int16)[:, ::-1] - 1
+    from_left = np.cumsum(is_digit, axis=1, dtype=np.int16)
+    length = from_left[:, -1]
+
+    # Luhn: duplicar las posiciones impares desde la derecha
+    doubled = is_digit & (from_right % 2 == 1)
+    luhn_sum = np.where(doubled, _DOUBLE[digits], digits).sum(axis=1)
+    luhn_ok = (luhn_sum % 10 == 0) & (length > 0)
+
+    bad_len = (length < MIN_LEN) | (length > MAX_LEN)
+    valid = ~bad_chars & ~truncated & ~bad_len & luhn_ok
+
+    # Últimos 4 como número -> 4 códigos de carácter -> "U4"
+    in_last4 = is_digit & (from_right < 4)
+    last4 = (np.where(in_last4, digits * _POW10[np.clip(from_right, 0, 3)], 0)).sum(axis=1, dtype=np.int64)
+    last4_chars = (48 + (last4[:, None] // _POW10[3::-1][None, :]) % 10).astype(np.uint32)
+    masked = np.char.add(MASK_PREFIX, np.ascontiguousarray(last4_chars).view("U4").ravel())
+    # BIN: primeros 6 dígitos como entero
+    in_bin = is_digit & (from_left <= 6)
+    bin6 = np.where(in_bin, digits * _POW10[np.clip(6 - from_left, 0, 5)], 0).sum(axis=1, dtype=np.int64)
+    bin6 = bin6 * _POW10[np.clip(6 - length, 0, 5)]     # tarjetas de menos de 6 dígitos
+    brand, card_type = classify_bins(bin6, table)
+
+    # De menor a mayor prioridad: cada asignación pisa a las anteriores
+    reason = np.full(n, "", dtype=object)
+    reason[~luhn_ok] = "Luhn"
+    reason[bad_len] = "Largo inválido"
+    reason[bad_chars] = "Caracteres inválidos"
+    reason[truncated] = f"Demasiado larga (más de {MAX_CHARS} caracteres)"
+    reason[blank] = "Vacía"
+    return valid, masked, brand, card_type, reason
+
+def validate_bulk(numbers, table=None):
+    """
+    numbers: secuencia de str. Devuelve un dict con arreglos alineados por fila:
+      valid (bool), masked (str), brand (str), card_type (str),
+      card (solo dígitos; "" si es inválida)
+    y "invalid": [(fila, motivo)] para reportar al usuario.
+    """
+    numbers = ["" if x is None else str(x) for x in numbers]
+    parts = {"valid": [], "masked": [], "brand": [], "card_type": [], "card": []}
+    invalid = []
+    for start in range(0, len(numbers), CHUNK):
+        chunk = numbers[start:start + CHUNK]
+        valid, masked, brand, card_type, reason = _validate_chunk(chunk, table)
+        # Solo las válidas se limpian (métodos de str en C; únicos separadores posibles)
+        cards = np.full(len(chunk), "", dtype=object)
+        for i in np.flatnonzero(valid).tolist():
+            cards[i] = chunk[i].replace(" ", "").replace("-", "")
+        parts["valid"].append(valid)
+        parts["masked"].append(masked)
+        parts["brand"].append(brand)
+        parts["card_type"].append(card_type)
+        parts["card"].append(cards)
+        for i in np.flatnonzero(~valid).tolist():
+            invalid.append((start + i, reason[i]))
+    out = {k: (np.concatenate(v) if v else np.array([])) for k, v in parts.items()}
+    out["invalid"] = invalid
+    return out
+
+# ==========================
+# BENCHMARK
+# ==========================
+def _sample(n, seed=7):
+    """Tarjetas sintéticas: ~90% válidas, con espacios/guiones como en listas reales."""
+    rng = np.random.default_rng(seed)
+    bodies = rng.integers(0, 10, size=(n, 15))
+    bodies[:, 0] = rng.choice([4, 5, 3, 6], size=n)
+    out = []
+    for row, bad in zip(bodies.tolist(), (rng.random(n) < 0.1).tolist()):
+        s = "".join(map(str, row))
+        total = 0
+        for i, ch in enumerate(reversed(s)):   # dígito de control
+            dd = int(ch) * (2 if i % 2 == 0 else 1)
+            total += dd - 9 if dd > 9 else dd
+        check = (10 - total % 10) % 10
+        if bad:
+            check = (check + 1) % 10
+        s += str(check)
+        out.append(" ".join(s[i:i + 4] for i in range(0, 16, 4)) if row[1] % 2 else s)
+    return out
+
+def benchmark(n=200_000):
+    import time
+    from pasarela_pagos import luhn_checksum, mask_card
+    cards = _sample(n)
+    t0 = time.perf_counter()
+    scalar_valid = [luhn_checksum(c) for c in cards]
+    scalar_mask = [mask_card(c) for c in cards]
+    t1 = time.perf_counter()
+    res = validate_bulk(cards)
+    t2 = time.perf_counter()
+    diff_valid = sum(1 for a, b in zip(scalar_valid, res["valid"].tolist()) if a != b)
+    diff_mask = sum(1 for a, b in zip(scalar_mask, res["masked"].tolist()) if a != b)
+    print(f"{n} tarjetas")
+    print(f"  escalar (luhn_checksum + mask_card): {t1 - t0:.3f} s")
+    print(f"  NumPy (validate_bulk, incluye BIN):  {t2 - t1:.3f} s  ({(t1 - t0) / max(t2 - t1, 1e-9):.1f}x)")
+    print(f"  inválidas: {len(res['invalid'])}; diferencias con el escalar: validez {diff_valid}, máscara {diff_mask}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Validación masiva de tarjetas")
+    parser.add_argument("--benchmark", type=int, default=200_000, metavar="N")
+    args = parser.parse_args()
+    benchmark(args.benchmark)
@@ -0,0 +1,241 @@
+# vault_core.py
+# Bóveda por registro: cada registro guarda su propio blob cifrado (el llamador cifra),
+# junto a metadatos en claro (nunca datos sensibles) para listar sin desencriptar.
+# Archivo JSONL de solo-anexar + índice llave -> (offset, largo) en memoria,
+# con checkpoint del índice en "<archivo>.idx" para no releer todo al abrir.
+# Si otro proceso escribe la misma bóveda, refresh() incorpora su cola (o relee
+# todo si compactó); las escrituras y get_blob refrescan antes de usar offsets.
+# Escrituras, compactación y lecturas por offset se hacen con el candado entre
+# procesos "<archivo>.lock", así ningún append se pierde en un os.replace ajeno.
+# El .idx guarda el inode del archivo que describe y solo se usa si coincide.
+
+import os
+import json
+import threading
+
+from bloqueo_archivos import bloqueo
+
+def _set_private_file_permissions(path):
+    try:
+        if os.name == "posix":
+            os.chmod(path, 0o600)
+    except Exception:
+        pass
+
+class RecordVault:
+    """
+    put/delete/get_blob tocan un solo registro: un append o un seek+read.
+    Los registros reemplazados o borrados se recogen con compact(), que copia
+    los blobs tal cual (sin descifrar).
+    """
+    CHECKPOINT_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._offsets = {}   # key -> (offset, length)
+        self._meta = {}      # key -> dict de metadatos en claro
+        self._dead = 0       # líneas obsoletas en disco
+        self._since_checkpoint = 0
+        self._end = 0        # bytes del archivo ya aplicados al índice
+        self._ino = None
+        self._lock = threading.Lock()
+        self._flock = bloqueo(path + ".lock")
+        with self._flock:
+            self._open()
+
+    # ---- lectura ----
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def keys(self):
+        return list(self._offsets)
+
+    def meta(self, key):
+        return self._meta.get(key)
+
+    def items(self):
+        """[(key, meta)] en orden de inserción, sin tocar el disco."""
+        return [(k, self._meta[k]) for k in self._offsets]
+
+    def get_blob(self, key):
+        with self._lock, self._flock:
+            self._refresh_locked()
+            pos = self._offsets.get(key)
+            if pos is None:
+                return None
+            with open(self.path, "rb") as f:
+                f.seek(pos[0])
+                rec = json.loads(f.read(pos[1]).decode("utf-8"))
+        return rec.get("blob")
+
+    # ---- escritura ----
+    def put(self, key, meta, blob):
+        self._append({"op": "put", "key": key, "meta": meta, "blob": blob})
+
+    def put_many(self, items):
+        """Importación masiva: [(key, meta, blob)] con una sola apertura del archivo."""
+        with self._lock, self._flock:
+            self._refresh_locked()
+            recs = [{"op": "put", "key": key, "meta": meta, "blob": blob} for key, meta, blob in items]
+            lines = [(json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8") for rec in recs]
+            with open(self.path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(b"".join(lines))
+            _set_private_file_permissions(self.path)
+            if self._ino is None:
+                self._ino = os.stat(self.path).st_ino
+            if offset != self._end:
+                self._replay(self._end, repair=False)    # otro proceso escribió entretanto
+            else:
+                for rec, line in zip(recs, lines):
+                    self._apply(rec, offset, len(line))
+                    offset += len(line)
+                self._end = offset
+            self._checkpoint_locked()
+
+    def delete(self, key):
+        self.refresh()
+        if key not in self._offsets:
+            return False
+        self._append({"op": "del", "key": key})
+        return True
+
+    def _append(self, rec):
+        line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, self._flock:
+            self._refresh_locked()
+            with open(self.path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(line)
+            _set_private_file_permissions(self.path)
+            if self._ino is None:
+                self._ino = os.stat(self.path).st_ino
+            if offset != self._end:
+                self._replay(self._end, repair=False)    # otro proceso escribió entretanto
+            else:
+                self._apply(rec, offset, len(line))
+                self._end = offset + len(line)
+            self._since_checkpoint += 1
+            if self._dead > max(100, len(self._offsets)):
+                self._compact_locked()
+            elif self._since_checkpoint >= self.CHECKPOINT_EVERY:
+                self._checkpoint_locked()
+
+    def _apply(self, rec, offset, length):
+        key = rec.get("key")
+        if rec.get("op") == "put":
+            if key in self._offsets:
+                self._dead += 1
+            self._offsets[key] = (offset, length)
+            self._meta[key] = rec.get("meta") or {}
+        elif rec.get("op") == "del":
+            if key in self._offsets:
+                del self._offsets[key]
+                del self._meta[key]
+                self._dead += 1
+            self._dead += 1
+
+    # ---- apertura / mantenimiento ----
+    def _open(self):
+        if not os.path.exists(self.path):
+            return
+        st = os.stat(self.path)
+        self._ino, size = st.st_ino, st.st_size
+        start = 0
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    idx = json.load(f)
+                # Un .idx de otro archivo (compactado o restaurado) no sirve aunque el tamaño encaje
+                if idx.get("ino") == st.st_ino and idx.get("size", 0) <= size:
+                    self._offsets = {k: tuple(v) for k, v in idx["offsets"].items()}
+                    self._meta = idx["meta"]
+                    self._dead = idx.get("dead", 0)
+                    start = idx["size"]
+            except Exception:
+                self._offsets, self._meta, self._dead, start = {}, {}, 0, 0
+        self._replay(start)
+
+    def _replay(self, start, repair=True):
+        good = start
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(line.decode("utf-8"))
+                except Exception:
+                    break
+                self._apply(rec, good, len(line))
+                self._since_checkpoint += 1
+                good += len(line)
+        self._end = good
+        if repair and good < os.path.getsize(self.path):
+            # Escritura interrumpida: se descarta la cola incompleta
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+
+    def refresh(self):
+        """Incorpora lo que otro proceso escribió en el archivo. True si hubo cambios."""
+        with self._lock, self._flock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        if st.st_ino == self._ino and st.st_size == self._end:
+            return False
+        if st.st_ino == self._ino and st.st_size > self._end:
+            # Cola nueva; con el candado tomado nadie escribe, así que una línea a medias
+            # es de una escritura interrumpida y se descarta
+            self._replay(self._end)
+        else:
+            # Archivo reemplazado (compactado por otro proceso): releer desde su índice
+            self._offsets, self._meta, self._dead, self._end = {}, {}, 0, 0
+            self._open()
+        return True
+
+    def checkpoint(self):
+        with self._lock, self._flock:
+            self._refresh_locked()
+            self._checkpoint_locked()
+
+    def _checkpoint_locked(self):
+        size = self._end
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "ino": self._ino, "offsets": self._offsets, "meta": self._meta, "dead": self._dead}, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+        _set_private_file_permissions(self.index_path)
+        self._since_checkpoint = 0
+
+    def compact(self):
+        with self._lock, self._flock:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        self._refresh_locked()
+        tmp = self.path + ".tmp"
+        offsets = {}
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            for key, (offset, length) in self._offsets.items():
+                src.seek(offset)
+                line = src.read(length)
+                offsets[key] = (dst.tell(), length)
+                dst.write(line)
+        os.replace(tmp, self.path)
+        _set_private_file_permissions(self.path)
+        self._offsets = offsets
+        self._dead = 0
+        st = os.stat(self.path)
+        self._ino, self._end = st.st_ino, st.st_size
+        self._checkpoint_locked()
@@ -0,0 +1,180 @@
+# visor_auditoria.py
+# Visor del audit log con filtros (fechas, evento, usuario, módulo, texto) sobre el
+# índice de indice_auditoria: pagina de a PAGE_SIZE registros, del más reciente al
+# más antiguo, sin cargar el historial en memoria. Lo usan Seguridad y la pasarela.
+
+import os
+import re
+import json
+import time
+import threading
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+from security_core import flush_audit, button_clicked
+from indice_auditoria import audit_index, time_key, PAGE_SIZE
+from integridad_auditoria import verificar, texto_resultado
+
+BASE_DIR = r"C:\RICHARD\RB\2025\Taller_mecánica"
+AUDIT_DIR = os.path.join(BASE_DIR, "auditoria")
+
+_FECHA = re.compile(r"\d{4}-\d{2}-\d{2}( \d{2}:\d{2})?")
+
+def _detalle(rec):
+    partes = [rec.get("msg") or ""]
+    if rec.get("data"):
+        partes.append(json.dumps(rec["data"], ensure_ascii=False))
+    return " ".join(p for p in partes if p)
+
+class VisorAuditoria:
+    def __init__(self, root, modulo):
+        self.modulo = modulo
+        flush_audit()
+        self.index = audit_index(AUDIT_DIR)
+        self.top = tk.Toplevel(root)
+        self.top.title("Audit log")
+        self.top.geometry("1150x650")
+        self.top.configure(bg="#0f172a")
+
+        bar = tk.Frame(self.top, bg="#0f172a")
+        bar.pack(fill="x", padx=10, pady=8)
+        self.vars = {f: tk.StringVar() for f in ("desde", "hasta", "event", "user", "module", "texto")}
+        campos = [("Desde", "desde", None, 16), ("Hasta", "hasta", None, 16), ("Evento", "event", "event", 22),
+                  ("Usuario", "user", "user", 14), ("Módulo", "module", "module", 18), ("Texto", "texto", None, 18)]
+        self.combos = {}
+        for col, (label, key, field, width) in enumerate(campos):
+            tk.Label(bar, text=label, bg="#0f172a", fg="#e2e8f0").grid(row=col // 3, column=(col % 3) * 2, sticky="e", padx=(8, 2), pady=2)
+            if field:
+                cb = ttk.Combobox(bar, textvariable=self.vars[key], width=width)
+                cb.grid(row=col // 3, column=(col % 3) * 2 + 1, sticky="w")
+                self.combos[field] = cb
+            else:
+                ttk.Entry(bar, textvariable=self.vars[key], width=width).grid(row=col // 3, column=(col % 3) * 2 + 1, sticky="w")
+        tk.Label(bar, text="(YYYY-MM-DD o YYYY-MM-DD HH:MM)", bg="#0f172a", fg="#94a3b8").grid(row=0, column=6, sticky="w", padx=8)
+        ttk.Button(bar, text="Filtrar", style="Menu.TButton", command=self.filtrar).grid(row=1, column=6, sticky="w", padx=8)
+
+        nav = tk.Frame(self.top, bg="#0f172a")
+        nav.pack(fill="x", padx=10)
+        ttk.Button(nav, text="◀ Más recientes", style="Menu.TButton", command=self._mas_recientes).pack(side="left", padx=4)
+        ttk.Button(nav, text="Más antiguos ▶", style="Menu.TButton", command=self._mas_antiguos).pack(side="left", padx=4)
+        ttk.Button(nav, text="Actualizar", style="Menu.TButton", command=self._actualizar).pack(side="left", padx=4)
+        ttk.Button(nav, text="Verificar integridad", style="Menu.TButton", command=self._verificar).pack(side="left", padx=4)
+        self.estado_var = tk.StringVar(value="")
+        tk.Label(nav, textvariable=self.estado_var, bg="#0f172a", fg="#fbbf24").pack(side="left", padx=12)
+
+        cols = [("ts", "Fecha", 170), ("event", "Evento", 170), ("user", "Usuario", 100), ("module", "Módulo", 130), ("detalle", "Detalle", 560)]
+        self.tree = ttk.Treeview(self.top, columns=[c for c, _, _ in cols], show="headings")
+        for c, txt, w in cols:
+            self.tree.heading(c, text=txt)
+            self.tree.column(c, width=w, anchor="w")
+        self.tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.tree.bind("<Double-1>", self._ver_registro)
+
+        self._filtros = {}
+        self._cursores = [None]
+        self._siguiente = None
+        self._pagina = []
+        self._cargar_combos()
+        self._mostrar()
+
+    def _cargar_combos(self):
+        for field, cb in self.combos.items():
+            cb["values"] = [""] + self.index.values(field)
+
+    def _leer_filtros(self):
+        filtros = {}
+        for key in ("desde", "hasta"):
+            valor = self.vars[key].get().strip()
+            if valor:
+                if not _FECHA.fullmatch(valor):
+                    messagebox.showwarning("Validación", f"Fecha inválida: {valor}", parent=self.top)
+                    return None
+                filtros[key] = time_key(valor, end=(key == "hasta"))
+        for key in ("event", "user", "module", "texto"):
+            valor = self.vars[key].get().strip()
+            if valor:
+                filtros[key] = valor
+        return filtros
+
+    def filtrar(self):
+        filtros = self._leer_filtros()
+        if filtros is None:
+            return
+        self._filtros = filtros
+        self._cursores = [None]
+        self._mostrar()
+        button_clicked(self.modulo, "Audit log: filtrar", json.dumps(filtros, ensure_ascii=False))
+
+    def _actualizar(self):
+        flush_audit()
+        self.index = audit_index(AUDIT_DIR)
+        self._cargar_combos()
+        self._cursores = [None]
+        self._mostrar()
+
+    def _mostrar(self):
+        t0 = time.perf_counter()
+        registros, self._siguiente = self.index.page(self._filtros, self._cursores[-1], PAGE_SIZE)
+        total = self.index.count(self._filtros)
+        ms = (time.perf_counter() - t0) * 1000
+        self._pagina = registros
+        self.tree.delete(*self.tree.get_children())
+        for i, r in enumerate(registros):
+            self.tree.insert("", "end", iid=str(i), values=((r.get("ts") or "").replace("T", " "), r.get("event"),
+                                                           r.get("user"), r.get("module") or "", _detalle(r)))
+        offset = (len(self._cursores) - 1) * PAGE_SIZE
+        first = offset + 1 if registros else 0
+        de = f" de {total}" if total is not None else ""
+        self.estado_var.set(f"{first}–{offset + len(registros)}{de}  ({ms:.0f} ms, {len(self.index)} registros indexados)")
+
+    def _mas_antiguos(self):
+        if self._siguiente is None:
+            return
+        self._cursores.append(self._siguiente)
+        self._mostrar()
+
+    def _mas_recientes(self):
+        if len(self._cursores) <= 1:
+            return
+        self._cursores.pop()
+        self._mostrar()
+
+    def _verificar(self):
+        # Incremental (desde el último checkpoint verificado); corre fuera del hilo de Tk
+        flush_audit()
+        self.estado_var.set("Verificando integridad...")
+        resultado = {}
+
+        def trabajo():
+            try:
+                resultado.update(verificar(AUDIT_DIR))
+            except Exception as e:
+                resultado.update(ok=False, errores=[f"Error al verificar: {e}"], desde=0, hasta=0,
+                                 verificados=0, checkpoints=0, sin_checkpoint=0, segundos=0.0)
+        hilo = threading.Thread(target=trabajo, daemon=True)
+        hilo.start()
+
+        def esperar():
+            if hilo.is_alive():
+                self.top.after(100, esperar)
+                return
+            self._mostrar()
+            button_clicked(self.modulo, "Audit log: verificar integridad", json.dumps({"ok": resultado.get("ok"), "errores": len(resultado.get("errores", []))}))
+            if resultado.get("ok"):
+                messagebox.showinfo("Integridad del audit log", texto_resultado(resultado), parent=self.top)
+            else:
+                messagebox.showerror("Integridad del audit log", texto_resultado(resultado), parent=self.top)
+        esperar()
+
+    def _ver_registro(self, event=None):
+        sel = self.tree.selection()
+        if not sel:
+            return
+        rec = self._pagina[int(sel[0])]
+        top = tk.Toplevel(self.top)
+        top.title(f"{rec.get('event')} — {rec.get('ts')}")
+        txt = tk.Text(top, width=90, height=20, bg="#1e293b", fg="#e2e8f0")
+        txt.pack(fill="both", expand=True)
+        txt.insert("1.0", json.dumps(rec, ensure_ascii=False, indent=2))
+        txt.config(state="disabled")